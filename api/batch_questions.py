@@ -0,0 +1,103 @@
+# batch_questions.py - Send many questions to POST /chat/batch
+# Reads questions from a text file (one per line, # starts a comment) or a
+# JSON / JSONL file of strings or {"question", "route"} objects, streams the
+# answers as they complete and writes them as JSON lines. Questions with an
+# expected "route" are checked against the route that answered them (such
+# files always bypass the semantic cache, whose answers carry no route); the
+# exit status is 1 when a route differs or could not be checked, or a question failed.
+#
+#   python batch_questions.py homework.txt --out answers.jsonl
+#   python batch_questions.py routing_cases.jsonl --no-suggestions   # routing regression check
+#   python batch_questions.py homework.txt --persist --url https://api.example.com
+#
+import sys
+import json
+import argparse
+from typing import Any, Dict, List
+
+import httpx
+
+
+def read_cases(path: str) -> List[Dict[str, Any]]:
+    """[{"question", "route" (optional)}] from a .txt, .json or .jsonl file ("-" reads text from stdin)."""
+    text = sys.stdin.read() if path == "-" else open(path, 'r').read()
+    if path.endswith(".json"):
+        items = json.loads(text)
+    elif path.endswith(".jsonl"):
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        items = [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    return [item if isinstance(item, dict) else {"question": item} for item in items]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions through POST /chat/batch.")
+    parser.add_argument("questions", help="Questions file (.txt, .json or .jsonl), or - for stdin")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the API")
+    parser.add_argument("--concurrency", type=int, help="Chain runs in flight (default: the server's BATCH_CONCURRENCY)")
+    parser.add_argument("--persist", action="store_true", help="Save every question and answer as its own chat")
+    parser.add_argument("--no-suggestions", action="store_true", help="Skip the suggested follow-up questions")
+    parser.add_argument("--no-cache", action="store_true", help="Answer every question with the chain (no semantic cache)")
+    parser.add_argument("--out", help="Write the results as JSON lines to this file (default: stdout)")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for the whole batch")
+    args = parser.parse_args()
+
+    cases = read_cases(args.questions)
+    checked = sum(1 for case in cases if case.get("route"))
+    if checked and not args.no_cache:
+        print("Expected routes given: answering without the semantic cache.", file=sys.stderr)
+        args.no_cache = True
+    payload = {"questions": [case["question"] for case in cases], "concurrency": args.concurrency,
+               "persist": args.persist, "suggestions": not args.no_suggestions, "use_cache": not args.no_cache}
+    out = open(args.out, 'w') if args.out else sys.stdout
+    mismatches, unknown, errors, unanswered, summary = [], [], 0, 0, None
+    with httpx.stream("POST", f"{args.url.rstrip('/')}/chat/batch", json=payload, timeout=args.timeout) as response:
+        if response.status_code != 200:
+            response.read()
+            sys.exit(f"/chat/batch returned {response.status_code}: {response.text}")
+        for line in response.iter_lines():
+            if not line:
+                continue
+            result = json.loads(line)
+            if result.get("done"):
+                summary = result
+                continue
+            expected = cases[result["index"]].get("route")
+            if "error" in result:
+                errors += 1
+                unanswered += 1 if expected else 0
+                status = f"ERROR {result['error']}"
+            elif expected and not result.get("route"):
+                unknown.append(result["question"])
+                status = "ROUTE unknown"
+            elif expected and result["route"] != expected:
+                mismatches.append((result["question"], expected, result["route"]))
+                status = f"ROUTE {result['route']} (expected {expected})"
+            else:
+                status = "cached" if result.get("cached") else result.get("route") or ""
+            print(f"[{result['index'] + 1}/{len(cases)}] {result['seconds']:7.2f}s {status:<20} {result['question']}",
+                  file=sys.stderr)
+            out.write(json.dumps({**result, "expected_route": expected} if expected else result) + "\n")
+    if out is not sys.stdout:
+        out.close()
+
+    if summary is None:
+        sys.exit("The batch ended without a summary; the server may have stopped.")
+    print(f"{summary['questions']} question(s) in {summary['seconds']:.2f}s: {summary['answered']} answered, "
+          f"{summary['cached']} from the cache, {summary['errors']} failed", file=sys.stderr)
+    if summary.get("error"):
+        print(f"Batch error: {summary['error']}", file=sys.stderr)
+    if checked:
+        matched = checked - len(mismatches) - len(unknown) - unanswered
+        print(f"Routing: {matched}/{checked} as expected"
+              + (f", {len(unknown)} unknown" if unknown else "")
+              + (f", {unanswered} failed" if unanswered else ""), file=sys.stderr)
+        for question, expected, actual in mismatches:
+            print(f"  {question!r}: {actual}, expected {expected}", file=sys.stderr)
+        for question in unknown:
+            print(f"  {question!r}: route unknown", file=sys.stderr)
+    sys.exit(1 if mismatches or unknown or errors or summary.get("error") else 0)
+
+
+if __name__ == "__main__":
+    main()
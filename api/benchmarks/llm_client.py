@@ -0,0 +1,156 @@
+# benchmarks/llm_client.py - The resilient LLM client against the OpenAI API stub
+# Starts benchmarks.llm_stub with injected latency and failures, then sends
+# the same calls through the production client (src/llm_client.py) in each
+# mode: without retries, with jittered retries, and with retries plus hedged
+# requests. Reports the success rate, latency percentiles and how many
+# attempts, retries and hedges each mode needed.
+#
+#   python -m benchmarks.llm_client                                  # 5% errors, 1% hangs
+#   python -m benchmarks.llm_client --latency lognormal:300:0.8 --fail-rate 0 --hang-rate 0
+#   python -m benchmarks.llm_client --stream --calls 200
+#
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+from typing import Any, Dict, List
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from benchmarks import llm_stub
+from benchmarks.load_test import percentile
+from src.llm_client import ResilientChatModel, shared_http_clients
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {
+    "plain": {"max_retries": 0, "hedging": False},
+    "retries": {"hedging": False},
+    "hedged": {"hedging": True},
+}
+QUESTIONS = ["What is bibliometrics?", "How do I use dplyr filter?", "What is a p-value?",
+             "How do I assign a variable in RStudio?", "How do I make a ggplot2 bar chart?"]
+# Calls per mode that only fill the latency window hedging starts from
+WARMUP_CALLS = 30
+
+
+def start_stub(args) -> subprocess.Popen:
+    command = [sys.executable, "-m", "benchmarks.llm_stub", "--port", str(args.port)]
+    for name in ("latency", "token_latency", "fail_rate", "fail_status", "hang_rate", "hang_seconds", "seed"):
+        command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    return subprocess.Popen(command, cwd=API_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The stub server exited during startup.")
+        try:
+            httpx.get(f"{url}/stats", timeout=1).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise TimeoutError("The stub server did not start.")
+
+
+async def run_mode(mode: str, args, base_url: str) -> Dict[str, Any]:
+    http_client, http_async_client = shared_http_clients()
+    model = ResilientChatModel.create(lambda timeout: ChatOpenAI(
+        model="gpt-4o", api_key="stub", base_url=base_url, timeout=args.timeout, max_retries=0,
+        http_client=http_client, http_async_client=http_async_client), stage=args.stage, **MODES[mode])
+    rng = random.Random(args.seed)
+    prompts = [f"Given the user question, classify it. <question>{rng.choice(QUESTIONS)}</question>"
+               for _ in range(WARMUP_CALLS + args.calls)]
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def call(prompt: str) -> Dict[str, Any]:
+        async with limit:
+            started = time.perf_counter()
+            try:
+                if args.stream:
+                    async for _ in model.astream(prompt):
+                        pass
+                else:
+                    await model.ainvoke(prompt)
+                error = None
+            except Exception as e:
+                error = type(e).__name__
+            return {"seconds": time.perf_counter() - started, "error": error}
+
+    await asyncio.gather(*(call(prompt) for prompt in prompts[:WARMUP_CALLS]))
+    before = model.policy.stats()
+    results = await asyncio.gather(*(call(prompt) for prompt in prompts[WARMUP_CALLS:]))
+    after = model.policy.stats()
+    latencies = sorted(result["seconds"] for result in results if result["error"] is None)
+    errors: Dict[str, int] = {}
+    for result in results:
+        if result["error"]:
+            errors[result["error"]] = errors.get(result["error"], 0) + 1
+    delta = {key: after[key] - before[key] for key in ("calls", "attempts", "retries", "timeouts", "hedged", "hedge_wins")}
+    return {
+        "mode": mode,
+        "calls": len(results),
+        "ok_rate": len(latencies) / len(results),
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "max_ms": 1000 * latencies[-1] if latencies else 0.0,
+        "attempts_per_call": delta["attempts"] / delta["calls"] if delta["calls"] else 0.0,
+        **{key: delta[key] for key in ("retries", "timeouts", "hedged", "hedge_wins")},
+        "errors": errors,
+    }
+
+
+async def run_modes(args, base_url: str) -> List[Dict[str, Any]]:
+    # One event loop: the shared async connection pool belongs to it
+    return [await run_mode(mode, args, base_url) for mode in args.modes]
+
+
+def print_report(results: List[Dict[str, Any]], args):
+    print(f"\n{args.calls} {'streamed ' if args.stream else ''}calls per mode, concurrency {args.concurrency}, "
+          f"stub latency {args.latency}, {args.fail_rate:.0%} errors, {args.hang_rate:.0%} hangs, timeout {args.timeout}s")
+    print(f"{'mode':<9}{'ok':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'att/call':>9}"
+          f"{'retries':>8}{'timeouts':>9}{'hedged':>7}{'won':>5}")
+    for r in results:
+        print(f"{r['mode']:<9}{r['ok_rate']:>7.1%}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}{r['p99_ms']:>9.0f}"
+              f"{r['max_ms']:>9.0f}{r['attempts_per_call']:>9.2f}{r['retries']:>8}{r['timeouts']:>9}"
+              f"{r['hedged']:>7}{r['hedge_wins']:>5}")
+        if r["errors"]:
+            print(f"{'':<9}errors: {r['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise the resilient LLM client against the OpenAI API stub.")
+    parser.add_argument("--port", type=int, default=8100, help="Port of the stub server")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--calls", type=int, default=300, help="Measured calls per mode")
+    parser.add_argument("--concurrency", type=int, default=16, help="Calls in flight")
+    parser.add_argument("--stage", default="router", help="Stage whose policy the calls use")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Seconds per attempt")
+    parser.add_argument("--stream", action="store_true", help="Stream the responses (never hedged)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    llm_stub.add_arguments(parser)
+    parser.set_defaults(fail_rate=0.05, hang_rate=0.01, hang_seconds=30)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    process = start_stub(args)
+    try:
+        wait_ready(url, process)
+        results = asyncio.run(run_modes(args, f"{url}/v1"))
+    finally:
+        process.terminate()
+        process.wait()
+    print_report(results, args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# benchmarks/llm_stub.py - Local stand-in for the OpenAI API with injected latency and failures
+# Serves /v1/chat/completions (plain and streamed) and /v1/embeddings with
+# the answers of the mock LLM and embeddings, so the production client
+# (src/llm_client.py) and main.py can be exercised without the real API.
+# Latency specs are those of src/mock_components.py. Failures are drawn per
+# request: an HTTP error, or a hang that only a client timeout ends.
+#
+#   python -m benchmarks.llm_stub --port 8100 --latency lognormal:300:0.5 --fail-rate 0.05 --hang-rate 0.01
+#   OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=stub uvicorn main:app
+#
+import json
+import time
+import base64
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from langchain_core.messages import HumanMessage
+
+from src.mock_components import FakeChatModel, FakeEmbeddings, Latency
+
+app = FastAPI(title="OpenAI API stub")
+# Replaced by main() from the command line
+settings: Dict[str, Any] = {}
+stats = {"chat": 0, "streams": 0, "embeddings": 0, "errors": 0, "hangs": 0}
+_model = FakeChatModel()
+
+
+def configure(args):
+    settings.update(
+        latency=Latency(args.latency, seed=args.seed),
+        token_latency=Latency(args.token_latency, seed=args.seed + 1),
+        random=random.Random(args.seed + 2),
+        fail_rate=args.fail_rate, fail_status=[int(code) for code in args.fail_status.split(",")],
+        hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+        embeddings=FakeEmbeddings(dimension=args.dimension, latency="fixed:0"),
+    )
+
+
+async def inject_failure():
+    """Sleeps through a hang, or returns an error response, for the drawn share of requests."""
+    draw = settings["random"].random()
+    if draw < settings["hang_rate"]:
+        stats["hangs"] += 1
+        await asyncio.sleep(settings["hang_seconds"])
+    elif draw < settings["hang_rate"] + settings["fail_rate"]:
+        stats["errors"] += 1
+        status = settings["random"].choice(settings["fail_status"])
+        return JSONResponse({"error": {"message": f"Injected {status}", "type": "stub_error", "code": None}},
+                            status_code=status, headers={"retry-after": "0"} if status == 429 else None)
+    return None
+
+
+def prompt_of(messages: List[Dict[str, Any]]) -> str:
+    content = messages[-1].get("content") or ""
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content)
+    return content
+
+
+def usage(prompt: str, answer: str) -> Dict[str, int]:
+    prompt_tokens, completion_tokens = len(prompt) // 4 + 1, len(answer) // 4 + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    failure = await inject_failure()
+    if failure is not None:
+        return failure
+    prompt = prompt_of(body["messages"])
+    answer = _model._respond([HumanMessage(content=prompt)])
+    tokens = FakeChatModel._tokens(answer)
+    created, model = int(time.time()), body.get("model", "stub")
+    await asyncio.sleep(settings["latency"].sample())
+
+    if not body.get("stream"):
+        stats["chat"] += 1
+        await asyncio.sleep(sum(settings["token_latency"].sample() for _ in tokens[1:]))
+        return {"id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": usage(prompt, answer)}
+
+    stats["streams"] += 1
+
+    async def events():
+        def chunk(delta: Dict[str, Any], finish_reason=None, **extra) -> str:
+            return "data: " + json.dumps({
+                "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                **extra}) + "\n\n"
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(settings["token_latency"].sample())
+            yield chunk({"role": "assistant", "content": token} if i == 0 else {"content": token})
+        yield chunk({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk(None, usage=usage(prompt, answer))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    failure = await inject_failure()
+    if failure is not None:
+        return failure
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    # Token ids when the client tokenized the input itself
+    texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in texts]
+    await asyncio.sleep(settings["latency"].sample())
+    stats["embeddings"] += 1
+    vectors = settings["embeddings"].embed_documents(texts)
+    if body.get("encoding_format") == "base64":
+        vectors = [base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode() for vector in vectors]
+    return {"object": "list", "model": body.get("model", "stub"),
+            "data": [{"object": "embedding", "index": i, "embedding": vector} for i, vector in enumerate(vectors)],
+            "usage": {"prompt_tokens": sum(len(text) // 4 + 1 for text in texts),
+                      "total_tokens": sum(len(text) // 4 + 1 for text in texts)}}
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default="lognormal:300:0.5", help="Time to the first token (latency spec)")
+    parser.add_argument("--token-latency", default="fixed:0", help="Time between streamed tokens (latency spec)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with an error")
+    parser.add_argument("--fail-status", default="500,503,429", help="Error statuses to draw from")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Share of requests that hang")
+    parser.add_argument("--hang-seconds", type=float, default=120, help="How long a hung request sleeps")
+    parser.add_argument("--dimension", type=int, default=3072, help="Embedding dimension")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the latencies and failures")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stub of the OpenAI API with injected latency and failures.")
+    parser.add_argument("--port", type=int, default=8100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure(args)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
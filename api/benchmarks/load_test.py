@@ -0,0 +1,315 @@
+# benchmarks/load_test.py - Concurrent load test of the API on mock components
+# Starts main_mock (the real app with the mock LLM and embeddings) on a copy
+# of a seeded history database, drives a weighted mix of requests from
+# concurrent clients and reports throughput and latency percentiles per
+# endpoint. Runs are reproducible: the database, the request mix and the
+# mock latencies all derive from --seed.
+#
+#   python -m benchmarks.load_test                              # 30s, 16 clients
+#   python -m benchmarks.load_test --concurrency 64 --llm-latency lognormal:800:0.4
+#   python -m benchmarks.load_test --url http://localhost:8000  # an already running server
+#
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from benchmarks.seed_history import seed, TOPICS, QUESTIONS
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Relative weights of the operations in the request mix
+DEFAULT_MIX = "chat=2,followup=1,stream=2,history=4,chat_messages=4,search=2"
+SEARCH_TERMS = ["pivot_longer", "mutate", "missing values", "geom_bar", "error column", "mtcars", "group_by summarise"]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, weight = part.split("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}' (known: {', '.join(OPERATIONS)})")
+        mix[name] = float(weight)
+    return mix
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, float], seed_value: int):
+        self.client = client
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.seed = seed_value
+        self.chat_ids: List[int] = []
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: Dict[str, str] = {}
+        # Requests turned away by admission control, per endpoint and status;
+        # not errors, and kept out of the latencies
+        self.rejected: Dict[str, Dict[int, int]] = defaultdict(lambda: {429: 0, 503: 0})
+
+    def question(self, rng: random.Random) -> str:
+        package, function = rng.choice(TOPICS)
+        return rng.choice(QUESTIONS).format(package=package, function=function, other=rng.choice(TOPICS)[1])
+
+    def record(self, name: str, seconds: float, error: Optional[str] = None, status: Optional[int] = None):
+        if status in (429, 503):
+            self.rejected[name][status] += 1
+            return
+        self.latencies[name].append(seconds)
+        if error:
+            self.errors[name] += 1
+            self.error_samples.setdefault(name, error)
+
+    async def timed(self, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.record(name, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+            return None
+        error = None
+        if response.status_code >= 400:
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+        elif response.headers.get("content-type", "").startswith("application/json") and \
+                isinstance(response.json(), dict) and "error" in response.json():
+            error = str(response.json()["error"])[:200]
+        self.record(name, time.perf_counter() - started, error, response.status_code)
+        return None if error else response
+
+    # --- Operations ---
+    async def op_chat(self, rng: random.Random):
+        response = await self.timed("chat", "POST", "/chat", json={"question": self.question(rng)})
+        if response is not None:
+            self.chat_ids.append(response.json()["chat_id"])
+
+    async def op_followup(self, rng: random.Random):
+        await self.timed("followup", "POST", "/chat",
+                         json={"question": self.question(rng), "chat_id": rng.choice(self.chat_ids)})
+
+    async def op_stream(self, rng: random.Random):
+        started = time.perf_counter()
+        first_token, error, event, status = None, None, None, None
+        try:
+            async with self.client.stream("POST", "/chat/stream", json={"question": self.question(rng)}) as response:
+                status = response.status_code
+                if response.status_code >= 400:
+                    error = f"HTTP {response.status_code}"
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        if event == "token" and first_token is None:
+                            first_token = time.perf_counter() - started
+                        elif event == "error":
+                            error = line[len("data: "):][:200]
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {e}"
+        if first_token is not None:
+            self.latencies["stream_ttft"].append(first_token)
+        self.record("stream", time.perf_counter() - started, error, status)
+
+    async def op_history(self, rng: random.Random):
+        await self.timed("history", "GET", "/history", params={"limit": 100})
+
+    async def op_chat_messages(self, rng: random.Random):
+        await self.timed("chat_messages", "GET", f"/chats/{rng.choice(self.chat_ids)}")
+
+    async def op_search(self, rng: random.Random):
+        await self.timed("search", "GET", "/history/search", params={"q": rng.choice(SEARCH_TERMS)})
+
+    # --- Driver ---
+    async def load_chat_ids(self):
+        """Chat ids for follow-ups and /chats requests: the newest chats of the history."""
+        response = await self.client.get("/history", params={"limit": 1000})
+        response.raise_for_status()
+        self.chat_ids = [chat["id"] for chat in response.json()]
+        if not self.chat_ids:
+            # Empty history: start with a few chats of our own
+            for i in range(4):
+                await self.op_chat(random.Random(self.seed - i - 1))
+
+    async def worker(self, index: int, deadline: float, budget: List[int]):
+        rng = random.Random(self.seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+            operation = rng.choices(self.operations, self.weights)[0]
+            await OPERATIONS[operation](self, rng)
+
+    async def run(self, concurrency: int, duration: float, requests: Optional[int]) -> float:
+        await self.load_chat_ids()
+        budget = [requests if requests else float("inf")]
+        started = time.perf_counter()
+        await asyncio.gather(*(self.worker(i, started + duration, budget) for i in range(concurrency)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        for name in sorted(set(self.latencies) | set(self.rejected)):
+            count = len(self.latencies[name])
+            values = sorted(self.latencies[name]) or [0.0]
+            endpoints[name] = {
+                "count": count,
+                "errors": self.errors.get(name, 0),
+                "rejected_429": self.rejected[name][429] if name in self.rejected else 0,
+                "rejected_503": self.rejected[name][503] if name in self.rejected else 0,
+                "rps": count / elapsed,
+                "p50_ms": 1000 * percentile(values, 50),
+                "p95_ms": 1000 * percentile(values, 95),
+                "p99_ms": 1000 * percentile(values, 99),
+                "mean_ms": 1000 * sum(values) / len(values),
+                "max_ms": 1000 * values[-1],
+            }
+        total = sum(len(values) for name, values in self.latencies.items() if name != "stream_ttft")
+        return {"elapsed_seconds": elapsed, "requests": total, "rps": total / elapsed,
+                "errors": sum(self.errors.values()),
+                "rejected_429": sum(counts[429] for counts in self.rejected.values()),
+                "rejected_503": sum(counts[503] for counts in self.rejected.values()),
+                "endpoints": endpoints, "error_samples": self.error_samples}
+
+
+OPERATIONS = {
+    "chat": LoadTest.op_chat,
+    "followup": LoadTest.op_followup,
+    "stream": LoadTest.op_stream,
+    "history": LoadTest.op_history,
+    "chat_messages": LoadTest.op_chat_messages,
+    "search": LoadTest.op_search,
+}
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\n{'endpoint':<15}{'count':>8}{'errors':>8}{'429':>6}{'503':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'mean ms':>10}{'max ms':>10}")
+    for name, row in result["endpoints"].items():
+        print(f"{name:<15}{row['count']:>8}{row['errors']:>8}{row['rejected_429']:>6}{row['rejected_503']:>6}"
+              f"{row['rps']:>9.1f}{row['p50_ms']:>10.1f}"
+              f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['mean_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    print(f"\n{result['requests']} requests in {result['elapsed_seconds']:.1f}s "
+          f"({result['rps']:.1f} req/s), {result['errors']} errors, "
+          f"{result['rejected_429']} rate limited (429), {result['rejected_503']} shed (503)")
+    for name, sample in result["error_samples"].items():
+        print(f"  first {name} error: {sample}")
+
+
+def start_server(args, workdir: str) -> subprocess.Popen:
+    """Runs main_mock with uvicorn on a copy of the seeded database; returns the process."""
+    database = os.path.join(workdir, "chat_history.sqlite3")
+    if args.db:
+        shutil.copyfile(args.db, database)
+    else:
+        seed(database, args.chats, args.turns, args.seed)
+    env = dict(os.environ,
+               DATABASE_PATH=database,
+               JOURNAL_PATH=os.path.join(workdir, "chat_journal.jsonl"),
+               SEMANTIC_CACHE_PATH=os.path.join(workdir, "semantic_cache.sqlite3"),
+               MOCK_LLM_LATENCY=args.llm_latency,
+               MOCK_LLM_TOKEN_LATENCY=args.token_latency,
+               MOCK_EMBEDDING_LATENCY=args.embedding_latency,
+               MOCK_SEED=str(args.seed),
+               # Every simulated client shares one address, so a per-client
+               # rate limit would reject most questions; the global cap stays
+               CLIENT_RATE_PER_MINUTE=os.environ.get("CLIENT_RATE_PER_MINUTE", "0"))
+    log = open(os.path.join(workdir, "server.log"), "w")
+    print(f"Starting main_mock on port {args.port} (log: {log.name})...")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main_mock:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=API_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+
+async def wait_ready(url: str, process: Optional[subprocess.Popen], timeout: float):
+    """Waits until /ready reports every component built."""
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.perf_counter() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                if (await client.get("/ready")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {timeout:.0f}s")
+
+
+async def run(args) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    workdir, process = None, None
+    url = args.url
+    if not url:
+        workdir = tempfile.mkdtemp(prefix="chatbot-load-")
+        process = start_server(args, workdir)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        started = time.perf_counter()
+        await wait_ready(url, process, args.ready_timeout)
+        print(f"Server ready in {time.perf_counter() - started:.1f}s; "
+              f"{args.concurrency} clients for {args.requests or f'{args.duration:.0f}s'}...")
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+            test = LoadTest(client, mix, args.seed)
+            elapsed = await test.run(args.concurrency, args.duration if not args.requests else float("inf"),
+                                     args.requests)
+            result = test.report(elapsed)
+            result["config"] = {key: value for key, value in vars(args).items() if key != "json"}
+            stats = await client.get("/stats")
+            if stats.status_code == 200:
+                result["server_stats"] = stats.json()
+        return result
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the chat API on mock components.")
+    parser.add_argument("--url", help="Test an already running server instead of starting main_mock")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the main_mock server started by the test")
+    parser.add_argument("--db", help="Seeded history database to copy (default: seed one with --chats/--turns)")
+    parser.add_argument("--chats", type=int, default=5000, help="Chats in the seeded history")
+    parser.add_argument("--turns", type=int, default=5, help="Average turns per seeded chat")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests instead of --duration")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Operation weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--llm-latency", default="lognormal:400:0.3", help="Mock LLM time to first token")
+    parser.add_argument("--token-latency", default="fixed:5", help="Mock LLM time between tokens")
+    parser.add_argument("--embedding-latency", default="lognormal:40:0.3", help="Mock embedding call latency")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the history, request mix and latencies")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--ready-timeout", type=float, default=300, help="Seconds to wait for /ready")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
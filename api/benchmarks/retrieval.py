@@ -0,0 +1,268 @@
+# benchmarks/retrieval.py - Offline retrieval quality/latency matrix
+# Chunks the knowledge base at several sizes, builds every vector backend
+# from the same vectors and sweeps retriever settings (similarity or MMR
+# search, k, hybrid BM25 fusion) over a golden set of questions with known
+# source chunks. For each route it reports recall@k, MRR, retrieval latency
+# percentiles and the tokens of context retrieved and packed into the prompt.
+# Documents and questions are embedded once per chunk size, before timing,
+# with the deterministic mock embeddings or from the embedding cache, so no
+# network is needed.
+#
+#   python -m benchmarks.retrieval                                   # full matrix, mock embeddings
+#   python -m benchmarks.retrieval --chunk-tokens 400 --k 8 --backends numpy-int8
+#   python -m benchmarks.retrieval --embeddings cached --json retrieval_results.json
+#
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import tempfile
+from typing import Any, Dict, List
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.load_test import percentile
+from src import chunking
+from src.chunking import count_tokens, pack_context
+from src.data_loader import (KNOWLEDGE_BASE_ROOT, KNOWLEDGE_BASES, add_documents, document_ids,
+                             embedding_id, hash_file, read_file)
+from src.lexical import BM25Index, HybridRetriever
+from src.vector_index import DTYPES, NumpyVectorStore, export_numpy_index
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_golden.jsonl")
+BACKENDS = ("chroma",) + tuple(f"numpy-{dtype}" for dtype in DTYPES)
+# Candidates MMR re-ranks, as a multiple of k (at least the LangChain default of 20)
+MMR_FETCH_FACTOR = 4
+
+
+class OfflineEmbeddings(Embeddings):
+    """Stands in for the API model behind the embedding cache: every cache miss is an error."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise RuntimeError(f"{len(texts)} text(s) are not in the embedding cache. Fill it once with "
+                           "`--embeddings openai` (needs OPENAI_API_KEY), then rerun with `--embeddings cached`.")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Serves vectors embedded before the timed runs, so latency is retrieval alone."""
+
+    def __init__(self, vectors: Dict[str, List[float]], model_name: str):
+        self.vectors = vectors
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vectors[text]
+
+
+def make_embeddings(name: str) -> Embeddings:
+    if name == "mock":
+        from src.mock_components import FakeEmbeddings
+        return FakeEmbeddings()
+    from src.config import EMBEDDING_MODEL
+    from src.embedding_cache import CachedEmbeddings
+    if name == "cached":
+        return CachedEmbeddings(OfflineEmbeddings(), model_name=EMBEDDING_MODEL)
+    from src.config import get_production_embeddings
+    return get_production_embeddings()
+
+
+def read_golden(path: str) -> List[Dict[str, Any]]:
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def matches(doc: Document, expected: Dict[str, Any]) -> bool:
+    """Whether a chunk is one the golden entry expects: equal metadata ("source" by file name) and "contains" text."""
+    for key, value in expected.items():
+        if key == "contains":
+            if value not in doc.page_content:
+                return False
+        elif key == "source":
+            if os.path.basename(str(doc.metadata.get("source", ""))) != value:
+                return False
+        elif doc.metadata.get(key) != value:
+            return False
+    return True
+
+
+def score(documents: List[Document], expected: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Recall of the expected chunks and reciprocal rank of the first one found."""
+    found = [any(matches(doc, item) for doc in documents) for item in expected]
+    first = next((rank for rank, doc in enumerate(documents, 1)
+                  if any(matches(doc, item) for item in expected)), None)
+    return {"recall": sum(found) / len(expected), "reciprocal_rank": 1 / first if first else 0.0}
+
+
+def read_sources(kb: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The unchunked documents of every source file, parsed once for all chunk sizes."""
+    source_path = os.path.join(KNOWLEDGE_BASE_ROOT, kb["name"])
+    sources = []
+    for filename in sorted(os.listdir(source_path)):
+        file_path = os.path.join(source_path, filename)
+        if os.path.isfile(file_path):
+            sources.append({"hash": hash_file(file_path), "documents": read_file(kb, file_path)})
+    return sources
+
+
+def chunk_sources(kb_name: str, sources: List[Dict[str, Any]], chunk_tokens: int) -> List[Document]:
+    """Chunks like ingest.py would with CHUNK_TOKENS=chunk_tokens, with the same ids."""
+    default, chunking.CHUNK_TOKENS = chunking.CHUNK_TOKENS, chunk_tokens
+    try:
+        chunks = []
+        for source in sources:
+            documents = chunking.chunk_documents(kb_name, source["documents"])
+            for doc, doc_id in zip(documents, document_ids(source["hash"], len(documents))):
+                doc.id = doc_id
+                chunks.append(doc)
+        return chunks
+    finally:
+        chunking.CHUNK_TOKENS = default
+
+
+def build_stores(chunks: List[Document], embeddings: Embeddings, workdir: str, name: str,
+                 backends: List[str]) -> Dict[str, Any]:
+    """One store per backend over the same vectors: an in-memory Chroma collection and its NumPy exports."""
+    db = Chroma(collection_name=name, embedding_function=embeddings, client=chromadb.EphemeralClient())
+    add_documents(db, chunks, [doc.id for doc in chunks])
+    stores = {"chroma": db} if "chroma" in backends else {}
+    for backend in backends:
+        if backend.startswith("numpy-"):
+            path = os.path.join(workdir, f"{name}-{backend}")
+            export_numpy_index(db, path, name, embedding_id(embeddings), backend.split("-", 1)[1])
+            stores[backend] = NumpyVectorStore.load(path, embeddings)
+    return stores
+
+
+def make_retriever(store, index: BM25Index, search: str, k: int, hybrid: bool):
+    """The retriever build_retriever would make for these settings."""
+    search_kwargs = {"k": k, "fetch_k": max(20, MMR_FETCH_FACTOR * k)} if search == "mmr" else {"k": k}
+    vector_retriever = store.as_retriever(search_type=search, search_kwargs=search_kwargs)
+    if not hybrid:
+        return vector_retriever
+    return HybridRetriever(vector_retriever=vector_retriever, index=index, vectorstore=store, k=k)
+
+
+def evaluate(retriever, cases: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    """Runs every question `repeat` times; quality comes from the first run, latency from all of them."""
+    retriever.invoke(cases[0]["question"])  # warm-up: first-call setup is not retrieval latency
+    latencies, recalls, reciprocal_ranks, packed_recalls, retrieved_tokens, packed_tokens = [], [], [], [], [], []
+    for case in cases:
+        for run in range(repeat):
+            started = time.perf_counter()
+            documents = retriever.invoke(case["question"])
+            latencies.append(time.perf_counter() - started)
+            if run:
+                continue
+            result = score(documents, case["expected"])
+            packed = pack_context(documents)
+            recalls.append(result["recall"])
+            reciprocal_ranks.append(result["reciprocal_rank"])
+            packed_recalls.append(score(packed, case["expected"])["recall"])
+            retrieved_tokens.append(sum(count_tokens(doc.page_content) for doc in documents))
+            packed_tokens.append(sum(count_tokens(doc.page_content) for doc in packed))
+    latencies.sort()
+    mean = lambda values: sum(values) / len(values)
+    result = {
+        "recall": mean(recalls),
+        "mrr": mean(reciprocal_ranks),
+        "packed_recall": mean(packed_recalls),
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "retrieved_tokens": mean(retrieved_tokens),
+        "context_tokens": mean(packed_tokens),
+    }
+    if isinstance(retriever, HybridRetriever):
+        result["fast_path_rate"] = retriever.stats()["fast_path_rate"]
+    return result
+
+
+def run(args) -> Dict[str, Any]:
+    golden = read_golden(args.golden)
+    embeddings = make_embeddings(args.embeddings)
+    workdir = tempfile.mkdtemp(prefix="retrieval_bench_")
+    results = []
+    try:
+        for kb in KNOWLEDGE_BASES:
+            cases = [case for case in golden if case["route"] == kb["name"]]
+            if not cases or (args.kb and kb["name"] != args.kb):
+                continue
+            print(f"Reading '{kb['name']}' ({len(cases)} golden question(s))...")
+            sources = read_sources(kb)
+            for chunk_tokens in args.chunk_tokens:
+                chunks = chunk_sources(kb["name"], sources, chunk_tokens)
+                texts = list(dict.fromkeys([doc.page_content for doc in chunks] + [case["question"] for case in cases]))
+                started = time.perf_counter()
+                precomputed = PrecomputedEmbeddings(dict(zip(texts, embeddings.embed_documents(texts))),
+                                                    embedding_id(embeddings))
+                print(f"  {chunk_tokens} tokens: {len(chunks)} chunk(s), embedded in {time.perf_counter() - started:.1f}s")
+                stores = build_stores(chunks, precomputed, workdir, f"{kb['name']}-{chunk_tokens}", args.backends)
+                index = BM25Index(chunks)
+                for backend, search, k, hybrid in itertools.product(args.backends, args.search, args.k, args.hybrid):
+                    retriever = make_retriever(stores[backend], index, search, k, hybrid == "on")
+                    result = evaluate(retriever, cases, args.repeat)
+                    results.append({"route": kb["name"], "chunk_tokens": chunk_tokens, "chunks": len(chunks),
+                                    "backend": backend, "search": search, "k": k, "hybrid": hybrid == "on", **result})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"embeddings": embedding_id(embeddings), "golden": args.golden, "questions": len(golden),
+            "repeat": args.repeat, "context_token_budget": chunking.CONTEXT_TOKEN_BUDGET, "results": results}
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\nEmbeddings: {result['embeddings']}, {result['questions']} golden question(s), "
+          f"context budget {result['context_token_budget']} tokens")
+    for route in dict.fromkeys(r["route"] for r in result["results"]):
+        print(f"\n{route}")
+        print(f"{'chunk':>6}{'backend':>15}{'search':>11}{'k':>4}{'hybrid':>8}{'recall':>8}{'MRR':>7}"
+              f"{'p50 ms':>8}{'p95 ms':>8}{'retr tok':>10}{'ctx tok':>9}{'ctx recall':>11}")
+        for r in result["results"]:
+            if r["route"] != route:
+                continue
+            print(f"{r['chunk_tokens']:>6}{r['backend']:>15}{r['search']:>11}{r['k']:>4}{'on' if r['hybrid'] else 'off':>8}"
+                  f"{r['recall']:>8.3f}{r['mrr']:>7.3f}{r['p50_ms']:>8.2f}{r['p95_ms']:>8.2f}"
+                  f"{r['retrieved_tokens']:>10.0f}{r['context_tokens']:>9.0f}{r['packed_recall']:>11.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep retriever settings over a golden question set, offline.")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="Golden set: JSON lines of {question, route, expected}")
+    parser.add_argument("--kb", choices=[kb["name"] for kb in KNOWLEDGE_BASES], help="Only this knowledge base")
+    parser.add_argument("--embeddings", choices=["mock", "cached", "openai"], default="mock",
+                        help="mock: deterministic hashing embeddings; cached: the embedding cache only (no API calls); "
+                             "openai: the production model through the cache, to fill it")
+    parser.add_argument("--chunk-tokens", type=int, nargs="+", default=[200, 400, 800], help="Chunk sizes to compare")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS), help="Vector backends")
+    parser.add_argument("--search", nargs="+", choices=["similarity", "mmr"], default=["similarity", "mmr"],
+                        help="Vector search types")
+    parser.add_argument("--k", type=int, nargs="+", default=[4, 8, 12], help="Chunks retrieved per question")
+    parser.add_argument("--hybrid", nargs="+", choices=["on", "off"], default=["off", "on"],
+                        help="Fuse BM25 results with the vector results")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per question")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        result = run(args)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# benchmarks/seed_history.py - Seeded chat history database for load tests
+# Generates a large, deterministic history (same --seed, same database) with
+# the production schema, so /history paging, /chats, search and memory run
+# against realistic table sizes without any API calls:
+#
+#   python -m benchmarks.seed_history --db chat_history_bench.sqlite3 --chats 5000
+#
+import os
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+
+# R topics the generated questions and answers are about; they also appear
+# in knowledge_base/, so searching and retrieving them is meaningful
+TOPICS = [
+    ("dplyr", "filter"), ("dplyr", "mutate"), ("dplyr", "summarise"), ("dplyr", "group_by"),
+    ("dplyr", "arrange"), ("dplyr", "left_join"), ("dplyr", "select"), ("tidyr", "pivot_longer"),
+    ("tidyr", "pivot_wider"), ("tidyr", "separate"), ("tidyr", "drop_na"), ("ggplot2", "geom_bar"),
+    ("ggplot2", "geom_point"), ("ggplot2", "facet_wrap"), ("ggplot2", "aes"), ("base", "lapply"),
+    ("base", "as.numeric"), ("base", "data.frame"), ("base", "merge"), ("stats", "lm"),
+]
+QUESTIONS = [
+    "How do I use {function} from {package}?",
+    "What does {function}() return when the input has missing values?",
+    "Can you show an example of {function} with the mtcars dataset?",
+    "Why does {function} give me an error about a missing column?",
+    "What is the difference between {function} and {other}?",
+    "How can I combine {function} with {other} in one pipeline?",
+]
+ANSWERS = [
+    "`{function}()` from {package} takes a data frame as its first argument, so it works with the pipe: "
+    "`df %>% {function}(...)`. The result keeps the columns you did not touch.",
+    "Use `{function}()` when you need to {verb}. For example:\n\n```r\nlibrary({package})\n"
+    "mtcars %>% {function}(cyl == 4)\n```\n\nCompare it with `{other}()`, which {other_verb}.",
+    "The error usually means a column name is misspelled. Check `names(df)` before calling `{function}()`; "
+    "{package} evaluates column names inside the data frame.",
+]
+VERBS = ["keep rows that match a condition", "add or change columns", "reduce groups to one row",
+         "reshape data", "draw a layer of the plot", "apply a function to each element"]
+
+SOURCES = [{"source": "knowledge_base/r_packages/{package}.pdf", "page": 0}]
+
+
+def generate_chat(rng: random.Random, started: datetime, turns: int):
+    """Returns (title, timestamp, messages) of one chat with `turns` question/answer pairs."""
+    package, function = rng.choice(TOPICS)
+    timestamp = started
+    messages = []
+    for _ in range(turns):
+        other = rng.choice(TOPICS)[1]
+        values = {"package": package, "function": function, "other": other,
+                  "verb": rng.choice(VERBS), "other_verb": rng.choice(VERBS)}
+        question = rng.choice(QUESTIONS).format(**values)
+        answer = rng.choice(ANSWERS).format(**values)
+        sources = [{key: value.format(**values) if isinstance(value, str) else value
+                    for key, value in source.items()} for source in SOURCES]
+        timestamp += timedelta(seconds=rng.randint(5, 120))
+        messages.append(("user", question, [], timestamp.isoformat()))
+        timestamp += timedelta(seconds=rng.randint(1, 20))
+        messages.append(("ai", answer, sources, timestamp.isoformat()))
+        # Follow-ups usually stay on the topic, sometimes switch
+        if rng.random() < 0.3:
+            package, function = rng.choice(TOPICS)
+    title = messages[0][1][:50] + ('...' if len(messages[0][1]) > 50 else '')
+    return title, started.isoformat(), messages
+
+
+def seed(path: str, chats: int, turns: int, seed_value: int):
+    if os.path.exists(path):
+        os.remove(path)
+    # The database module reads its path at import time
+    os.environ["DATABASE_PATH"] = path
+    from src import database
+    database.DATABASE_NAME = path
+    database.init_db()
+
+    rng = random.Random(seed_value)
+    started = datetime(2024, 1, 1)
+    with database.transaction() as conn:
+        for _ in range(chats):
+            started += timedelta(minutes=rng.randint(1, 240))
+            title, timestamp, messages = generate_chat(rng, started, rng.randint(1, 2 * turns - 1))
+            chat_id = conn.execute("INSERT INTO chats (title, timestamp) VALUES (?, ?)", (title, timestamp)).lastrowid
+            conn.executemany(
+                "INSERT INTO messages (chat_id, type, text, sources, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(chat_id, kind, text, json.dumps(sources), at) for kind, text, sources, at in messages]
+            )
+    conn = database.get_db_connection()
+    counts = conn.execute("SELECT (SELECT COUNT(*) FROM chats), (SELECT COUNT(*) FROM messages)").fetchone()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    database.close_connection()
+    print(f"Seeded {path}: {counts[0]} chats, {counts[1]} messages (seed {seed_value})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic chat history database.")
+    parser.add_argument("--db", default="chat_history_bench.sqlite3", help="Database file to (re)create")
+    parser.add_argument("--chats", type=int, default=5000, help="Number of chats")
+    parser.add_argument("--turns", type=int, default=5, help="Average turns (question + answer) per chat")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    args = parser.parse_args()
+    seed(args.db, args.chats, args.turns, args.seed)
+
+
+if __name__ == "__main__":
+    main()
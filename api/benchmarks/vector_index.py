@@ -0,0 +1,193 @@
+# benchmarks/vector_index.py - Chroma vs the memory-mapped NumPy vector index
+# Loads every backend in a fresh process, like a uvicorn worker does, and
+# reports load time (open + first query), resident and anonymous memory,
+# search latency and recall@k against exact float32 search. Queries are
+# stored vectors with seeded noise added, so no embedding calls are made.
+#
+#   python -m benchmarks.vector_index --mock                      # the *_db_mock stores
+#   python -m benchmarks.vector_index --kb course_modules         # a production store
+#   python -m benchmarks.vector_index --synthetic 20000 --dimension 3072
+#
+import os
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.load_test import percentile
+from src.data_loader import KNOWLEDGE_BASES, vector_store_path
+from src.vector_index import DTYPES, NumpyVectorStore, export_numpy_index
+
+# Chunks per synthetic cluster; real chunks of one manual are close to each other too
+SYNTHETIC_CLUSTER_SIZE = 50
+# Chroma's add() limit per call
+CHROMA_BATCH_SIZE = 5000
+
+
+def memory_mb() -> Dict[str, Optional[float]]:
+    """
+    Resident memory of this process and the anonymous part of it (heap, not
+    backed by a file). Mapped index pages are file-backed: they live in the
+    page cache, shared by every worker that maps them. Linux only.
+    """
+    usage: Dict[str, Optional[float]] = {"rss": None, "anonymous": None}
+    try:
+        with open("/proc/self/smaps_rollup", 'r') as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return usage
+    kb = lambda name: int(fields.get(name, "0 kB").split()[0])
+    usage["rss"] = kb("Rss") / 1024
+    usage["anonymous"] = kb("Anonymous") / 1024
+    return usage
+
+
+def measure(backend: str, path: str, queries_path: str, k: int) -> Dict[str, Any]:
+    """Worker process: opens one backend, runs every query and reports timings, memory and results."""
+    from langchain_chroma import Chroma
+    queries = np.load(queries_path)
+    before = memory_mb()
+
+    started = time.perf_counter()
+    if backend == "chroma":
+        store = Chroma(persist_directory=path)
+    else:
+        store = NumpyVectorStore.load(path, None)
+    # Chroma loads its HNSW index on the first query, so it counts as loading
+    first = store.similarity_search_by_vector(queries[0].tolist(), k=k)
+    load_seconds = time.perf_counter() - started
+
+    latencies, results = [], [[doc.id for doc in first]]
+    for query in queries[1:]:
+        started = time.perf_counter()
+        documents = store.similarity_search_by_vector(query.tolist(), k=k)
+        latencies.append(time.perf_counter() - started)
+        results.append([doc.id for doc in documents])
+
+    after = memory_mb()
+    latencies.sort()
+    delta = {name: after[name] - before[name] if after[name] is not None else None for name in after}
+    return {
+        "backend": backend,
+        "load_ms": 1000 * load_seconds,
+        "rss_mb": delta["rss"],
+        "anonymous_mb": delta["anonymous"],
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+        "results": results,
+    }
+
+
+def build_synthetic_store(path: str, count: int, dimension: int, seed: int):
+    """A Chroma store of clustered random unit vectors, the size of a larger knowledge base."""
+    import chromadb
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(count // SYNTHETIC_CLUSTER_SIZE, 1), dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)] + rng.standard_normal((count, dimension)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # The collection name and metadata the langchain Chroma wrapper opens by default
+    collection = chromadb.PersistentClient(path=path).get_or_create_collection("langchain")
+    for start in range(0, count, CHROMA_BATCH_SIZE):
+        end = min(start + CHROMA_BATCH_SIZE, count)
+        collection.add(ids=[f"synthetic-{i}" for i in range(start, end)], embeddings=vectors[start:end],
+                       documents=[f"Synthetic chunk {i}." for i in range(start, end)],
+                       metadatas=[{"chunk": i} for i in range(start, end)])
+
+
+def make_queries(vectors: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+    """Stored vectors plus Gaussian noise: near a few chunks, like a question about them."""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), count)]
+    queries = queries + noise * rng.standard_normal(queries.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def exact_top_k(vectors: np.ndarray, ids: List[str], queries: np.ndarray, k: int) -> List[List[str]]:
+    scores = queries @ vectors.T
+    return [[ids[row] for row in np.argsort(-row_scores, kind="stable")[:k]] for row_scores in scores]
+
+
+def recall(results: List[List[str]], truth: List[List[str]]) -> float:
+    hits = sum(len(set(found) & set(expected)) for found, expected in zip(results, truth))
+    return hits / sum(len(expected) for expected in truth) if truth else 0.0
+
+
+def run(args) -> Dict[str, Any]:
+    from langchain_chroma import Chroma
+    workdir = tempfile.mkdtemp(prefix="vector_index_bench_")
+    if args.synthetic:
+        store_path = os.path.join(workdir, "synthetic_db")
+        print(f"Building a synthetic store of {args.synthetic} x {args.dimension} vectors...")
+        build_synthetic_store(store_path, args.synthetic, args.dimension, args.seed)
+    else:
+        store_path = vector_store_path(args.kb, args.mock)
+        if not os.path.isdir(store_path):
+            raise FileNotFoundError(f"No vector store at '{store_path}'. Run `python ingest.py{' --mock' if args.mock else ''}` first.")
+
+    db = Chroma(persist_directory=store_path)
+    data = db.get(include=["embeddings"])
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = make_queries(vectors, args.queries + 1, args.noise, args.seed)
+    queries_path = os.path.join(workdir, "queries.npy")
+    np.save(queries_path, queries)
+    truth = exact_top_k(vectors, data["ids"], queries, args.k)
+
+    paths = {"chroma": store_path}
+    for dtype in DTYPES:
+        paths[f"numpy-{dtype}"] = os.path.join(workdir, dtype)
+        export_numpy_index(db, paths[f"numpy-{dtype}"], "benchmark", "benchmark", dtype)
+    del db
+
+    backends = []
+    context = multiprocessing.get_context("spawn")
+    for backend, path in paths.items():
+        with context.Pool(1) as pool:
+            result = pool.apply(measure, (backend, path, queries_path, args.k))
+        result["recall"] = recall(result.pop("results"), truth)
+        result["disk_mb"] = sum(os.path.getsize(os.path.join(root, name))
+                                for root, _, names in os.walk(path) for name in names) / 1e6
+        backends.append(result)
+    return {"store": store_path, "rows": len(vectors), "dimension": int(vectors.shape[1]),
+            "queries": args.queries, "k": args.k, "backends": backends}
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\n{result['rows']} vectors x {result['dimension']} dims, {result['queries']} queries, k={result['k']}")
+    print(f"{'backend':<16}{'load ms':>9}{'rss MB':>8}{'anon MB':>9}{'disk MB':>9}"
+          f"{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}{'recall':>8}")
+    fmt = lambda value, spec: format(value, spec) if value is not None else "-".rjust(int(spec.split(".")[0]))
+    for b in result["backends"]:
+        print(f"{b['backend']:<16}{b['load_ms']:>9.1f}{fmt(b['rss_mb'], '8.1f')}{fmt(b['anonymous_mb'], '9.1f')}"
+              f"{b['disk_mb']:>9.1f}{b['p50_ms']:>8.3f}{b['p95_ms']:>8.3f}{b['p99_ms']:>8.3f}{b['recall']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Chroma with the memory-mapped NumPy vector index.")
+    parser.add_argument("--kb", choices=[kb["name"] for kb in KNOWLEDGE_BASES], default="r_packages",
+                        help="Knowledge base whose store is benchmarked")
+    parser.add_argument("--mock", action="store_true", help="Use the *_db_mock store")
+    parser.add_argument("--synthetic", type=int, help="Benchmark a synthetic store of this many vectors instead")
+    parser.add_argument("--dimension", type=int, default=3072, help="Dimension of the synthetic vectors")
+    parser.add_argument("--queries", type=int, default=500, help="Queries per backend")
+    parser.add_argument("--k", type=int, default=8, help="Results per query")
+    parser.add_argument("--noise", type=float, default=0.5, help="Query distance from the stored vector it is drawn from")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the synthetic store and the queries")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
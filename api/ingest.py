@@ -0,0 +1,237 @@
+# ingest.py - Offline ingestion CLI
+# Prebuilds the vector stores under vector_stores/ so the API only has to
+# load them. Run it after changing anything in knowledge_base/:
+#
+#   python ingest.py                      # all knowledge bases
+#   python ingest.py --kb r_packages      # a single one
+#   python ingest.py --dry-run            # only show what would change
+#
+# It also keeps the suggested follow-up index of every store up to date
+# (--suggestions llm|template|none); only new or changed chunks are sent to the LLM.
+# Each store is also exported to a memory-mapped vector index for
+# VECTOR_BACKEND=numpy (--numpy-index int8|float16|none).
+#
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, List
+from dotenv import load_dotenv
+
+load_dotenv()
+from langchain_chroma import Chroma
+from src.data_loader import (
+    KNOWLEDGE_BASES, KNOWLEDGE_BASE_ROOT, vector_store_path, load_file,
+    open_manifest, plan_changes, apply_plan, has_changes, numpy_index_path, sync_numpy_index,
+)
+from src.embedding_cache import CachedEmbeddings
+from src.vector_index import DTYPES
+from src.suggestion_index import suggestion_index_path, sync_suggestion_index, llm_generator, template_generator
+from src.chunking import count_tokens
+
+
+class RateLimiter:
+    """Token buckets for requests per minute and tokens per minute, shared by all embedding threads."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.capacity = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.available = dict(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """Blocks until one request carrying `tokens` tokens may be sent."""
+        # A batch larger than the per-minute budget could never fit; let it
+        # through once the bucket is full instead of waiting forever.
+        tokens = min(tokens, self.capacity["tokens"])
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                for key, capacity in self.capacity.items():
+                    self.available[key] = min(capacity, self.available[key] + capacity * (now - self.updated) / 60)
+                self.updated = now
+                if self.available["requests"] >= 1 and self.available["tokens"] >= tokens:
+                    self.available["requests"] -= 1
+                    self.available["tokens"] -= tokens
+                    return
+                wait = max((1 - self.available["requests"]) / self.capacity["requests"],
+                           (tokens - self.available["tokens"]) / self.capacity["tokens"]) * 60
+            time.sleep(min(max(wait, 0.01), 5))
+
+
+def parse_file(kb_name: str, file_path: str):
+    """Process-pool entry point: loads and chunks one source file."""
+    kb = next(kb for kb in KNOWLEDGE_BASES if kb["name"] == kb_name)
+    return load_file(kb, file_path)
+
+
+def make_batches(texts: List[str], token_counts: List[int], max_docs: int, max_tokens: int) -> List[List[int]]:
+    """Groups text indexes into batches bounded by document count and total tokens."""
+    batches, current, current_tokens = [], [], 0
+    for i, tokens in enumerate(token_counts):
+        if current and (len(current) >= max_docs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_in_batches(embeddings, texts: List[str], token_counts: List[int], args) -> Dict[str, float]:
+    """
+    Embeds `texts` in size-bounded batches with `args.concurrency` requests in
+    flight under the rate limit. The vectors land in the embedding cache, so
+    adding the documents to Chroma afterwards does not call the API again.
+    """
+    limiter = RateLimiter(args.requests_per_minute, args.tokens_per_minute)
+    batches = make_batches(texts, token_counts, args.batch_size, args.batch_tokens)
+
+    def run(batch: List[int]):
+        batch_tokens = sum(token_counts[i] for i in batch)
+        limiter.acquire(batch_tokens)
+        embeddings.embed_documents([texts[i] for i in batch])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in pool.map(run, batches):
+            pass
+    return {"seconds": time.perf_counter() - started, "batches": len(batches)}
+
+
+def ingest_knowledge_base(kb: Dict[str, Any], embeddings, args) -> Dict[str, Any]:
+    kb_name = kb["name"]
+    source_path = os.path.join(KNOWLEDGE_BASE_ROOT, kb_name)
+    db_path = vector_store_path(kb_name, args.mock)
+    if not os.path.isdir(source_path) or not os.listdir(source_path):
+        raise FileNotFoundError(f"Source directory '{source_path}' is empty or missing.")
+
+    db = Chroma(persist_directory=db_path, embedding_function=embeddings)
+    manifest = open_manifest(db, kb_name, db_path)
+    plan = plan_changes(source_path, manifest)
+    to_load = {**plan["added"], **plan["changed"]}
+    print(f"[{kb_name}] {len(plan['added'])} added, {len(plan['changed'])} changed, "
+          f"{len(plan['removed'])} removed, {len(plan['touched'])} touched file(s).")
+    stats = {"kb": kb_name, "files": len(to_load), "docs": 0, "tokens": 0,
+             "parse_seconds": 0.0, "embed_seconds": 0.0, "write_seconds": 0.0}
+    if args.dry_run or not (has_changes(plan) or plan["touched"]):
+        return stats
+
+    # 1. Parse and chunk PDFs / course JSON in parallel processes
+    started = time.perf_counter()
+    documents_by_file = {}
+    if to_load:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = {filename: pool.submit(parse_file, kb_name, os.path.join(source_path, filename))
+                       for filename in to_load}
+            for filename, future in futures.items():
+                documents_by_file[filename] = future.result()
+                print(f"  - Parsed {filename}: {len(documents_by_file[filename])} chunk(s)")
+    stats["parse_seconds"] = time.perf_counter() - started
+
+    # 2. Embed in concurrent, rate-limited batches (through the embedding cache)
+    texts = [doc.page_content for documents in documents_by_file.values() for doc in documents]
+    token_counts = [count_tokens(text) for text in texts]
+    stats["docs"], stats["tokens"] = len(texts), sum(token_counts)
+    if texts and isinstance(embeddings, CachedEmbeddings):
+        embed_stats = embed_in_batches(embeddings, texts, token_counts, args)
+        stats["embed_seconds"] = embed_stats["seconds"]
+        print(f"  - Embedded {len(texts)} document(s) in {embed_stats['batches']} batch(es)")
+
+    # 3. Write the store and manifest
+    started = time.perf_counter()
+    apply_plan(db, kb, source_path, db_path, manifest, plan, documents_by_file)
+    stats["write_seconds"] = time.perf_counter() - started
+    return stats
+
+
+def build_numpy_index(kb: Dict[str, Any], embeddings, args) -> bool:
+    """Exports a knowledge base's (just synced) Chroma store to its memory-mapped index if it changed."""
+    db_path = vector_store_path(kb["name"], args.mock)
+    db = Chroma(persist_directory=db_path, embedding_function=embeddings)
+    return sync_numpy_index(db, kb["name"], db_path, numpy_index_path(kb["name"], args.mock), args.numpy_index)
+
+
+def build_suggestions(kb: Dict[str, Any], embeddings, generator_name: str, generate, args) -> Dict[str, int]:
+    """Updates a knowledge base's suggestion index from its (just synced) vector store."""
+    db = Chroma(persist_directory=vector_store_path(kb["name"], args.mock), embedding_function=embeddings)
+    path = suggestion_index_path(kb["name"], args.mock)
+    counts = sync_suggestion_index(db, kb["name"], path, generator_name, generate, args.suggestion_concurrency)
+    print(f"[{kb['name']}] suggestions: {counts['generated']} generated, {counts['kept']} kept, "
+          f"{counts['removed']} removed ({path})")
+    return counts
+
+
+def print_stats(all_stats: List[Dict[str, Any]], total_seconds: float, embeddings):
+    print("=" * 50)
+    print(f"{'knowledge base':<16}{'files':>6}{'docs':>7}{'tokens':>10}{'parse s':>9}{'embed s':>9}{'write s':>9}{'docs/s':>9}{'tokens/s':>10}")
+    for s in all_stats:
+        busy = s["parse_seconds"] + s["embed_seconds"] + s["write_seconds"]
+        docs_rate = s["docs"] / busy if busy else 0.0
+        tokens_rate = s["tokens"] / s["embed_seconds"] if s["embed_seconds"] else 0.0
+        print(f"{s['kb']:<16}{s['files']:>6}{s['docs']:>7}{s['tokens']:>10}{s['parse_seconds']:>9.2f}"
+              f"{s['embed_seconds']:>9.2f}{s['write_seconds']:>9.2f}{docs_rate:>9.1f}{tokens_rate:>10.0f}")
+    total_docs = sum(s["docs"] for s in all_stats)
+    total_tokens = sum(s["tokens"] for s in all_stats)
+    print(f"Total: {total_docs} docs, {total_tokens} tokens in {total_seconds:.2f}s "
+          f"({total_docs / total_seconds:.1f} docs/s, {total_tokens / total_seconds:.0f} tokens/s)")
+    if hasattr(embeddings, "stats"):
+        print(f"Embedding cache: {embeddings.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild the knowledge base vector stores.")
+    parser.add_argument("--kb", nargs="*", choices=[kb["name"] for kb in KNOWLEDGE_BASES],
+                        help="Knowledge bases to ingest (default: all)")
+    parser.add_argument("--mock", action="store_true", help="Use mock embeddings and the *_db_mock stores")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Processes parsing source files")
+    parser.add_argument("--batch-size", type=int, default=128, help="Max documents per embedding request")
+    parser.add_argument("--batch-tokens", type=int, default=100_000, help="Max tokens per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Embedding requests in flight")
+    parser.add_argument("--requests-per-minute", type=float, default=3000, help="Embedding request rate limit")
+    parser.add_argument("--tokens-per-minute", type=float, default=1_000_000, help="Embedding token rate limit")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be re-indexed")
+    parser.add_argument("--suggestions", choices=["llm", "template", "none"],
+                        help="How follow-up suggestions are generated per chunk (default: llm, template with --mock)")
+    parser.add_argument("--suggestion-concurrency", type=int, default=8, help="Suggestion LLM calls in flight")
+    parser.add_argument("--numpy-index", choices=[*DTYPES, "none"], default="int8",
+                        help="Element type of the memory-mapped vector index (VECTOR_BACKEND=numpy)")
+    args = parser.parse_args()
+    args.suggestions = args.suggestions or ("template" if args.mock else "llm")
+
+    if args.mock:
+        from src.mock_components import get_mock_embeddings
+        embeddings = get_mock_embeddings()
+    else:
+        from src.config import get_production_embeddings
+        embeddings = get_production_embeddings()
+
+    started = time.perf_counter()
+    all_stats = [ingest_knowledge_base(kb, embeddings, args)
+                 for kb in KNOWLEDGE_BASES if not args.kb or kb["name"] in args.kb]
+    print_stats(all_stats, max(time.perf_counter() - started, 1e-9), embeddings)
+
+    if args.dry_run:
+        return
+    if args.numpy_index != "none":
+        for kb in KNOWLEDGE_BASES:
+            if not args.kb or kb["name"] in args.kb:
+                build_numpy_index(kb, embeddings, args)
+    if args.suggestions == "none":
+        return
+    if args.suggestions == "template":
+        generator_name, generate = "template", template_generator()
+    else:
+        from src.config import get_production_llm
+        from src.mock_components import get_mock_llm
+        llm = get_mock_llm() if args.mock else get_production_llm()
+        generator_name, generate = f"llm:{getattr(llm, 'model_name', type(llm).__name__)}", llm_generator(llm)
+    for kb in KNOWLEDGE_BASES:
+        if not args.kb or kb["name"] in args.kb:
+            build_suggestions(kb, embeddings, generator_name, generate, args)
+
+
+if __name__ == "__main__":
+    main()
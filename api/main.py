@@ -1,9 +1,20 @@
 # main.py
+import time
+# Cold-start breakdown reported by /ready; measured from the first line of this module
+STARTUP_STARTED = time.perf_counter()
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import json
+import asyncio
+from types import SimpleNamespace
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -11,21 +22,114 @@ from fastapi.middleware.cors import CORSMiddleware
 from src import database
 
 # --- 1. Load Environment and Blueprints ---
+# Only lightweight modules are imported here. LangChain, Chroma and the
+# OpenAI clients are imported by the "imports" component below, so the
+# history endpoints are served before they are loaded.
 load_dotenv()
-from src.config import get_production_llm, get_production_embeddings
-from src.data_loader import get_retrievers
-from src.chains import create_master_chain
+from src.components import Components
+from src.suggestions import SuggestionRegistry, generate_suggestions
+from src.journal import MessageJournal, JournalFull
+from src import metrics
+from src.singleflight import SingleFlight, normalize_question
+from src.admission import AdmissionController, Rejected, client_key
 
 # --- 2. Assemble the Application ---
-print("="*50)
-print("ASSEMBLING PRODUCTION APPLICATION")
-print("="*50)
+# The AI components are built on first use or warmed in the background at
+# startup (AI_WARMUP=false only builds them on first use). GET /ready
+# reports the state and build time of each one.
+components = Components()
+
+def import_ai_modules(_):
+    from src import config, data_loader, chains, router, semantic_cache, memory, tracing, suggestion_index, llm_client
+    return SimpleNamespace(config=config, data_loader=data_loader, chains=chains, router=router,
+                           semantic_cache=semantic_cache, memory=memory, tracing=tracing,
+                           suggestion_index=suggestion_index, llm_client=llm_client)
+
+def build_local_router(c):
+    return c.get("imports").router.LocalRouter.from_retrievers(c.get("retrievers"), c.get("embeddings"))
+
+def build_chains(c):
+    # (master_chain, suggestion_chain), reporting their stages to GET /metrics
+    imports = c.get("imports")
+    chains = imports.chains.create_master_chain(c.get("llm"), c.get("retrievers"), local_router=c.get("local_router"),
+                                                speculative_retrieval=SPECULATIVE_RETRIEVAL)
+    return tuple(chain.with_config(callbacks=[imports.tracing.callback_handler]) for chain in chains)
+
+# Search both knowledge bases while the router runs instead of after it
+# (SPECULATIVE_RETRIEVAL=true); /stats reports the time saved and wasted
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true"
+
+components.add("imports", import_ai_modules)
 # Create the real AI components
-llm = get_production_llm()
-embeddings = get_production_embeddings()
-# Inject them to build the retrievers and chains
-retrievers = get_retrievers(embeddings, is_mock=False)
-master_chain, suggestion_chain = create_master_chain(llm, retrievers)
+components.add("llm", lambda c: c.get("imports").config.get_production_llm())
+components.add("embeddings", lambda c: c.get("imports").tracing.TimedEmbeddings(c.get("imports").config.get_production_embeddings()))
+# Inject them to load the prebuilt vector stores and build the chains
+components.add("retrievers", lambda c: c.get("imports").data_loader.get_retrievers(c.get("embeddings"), is_mock=False))
+# Local keyword/centroid router in front of the LLM router (LOCAL_ROUTER=false disables it)
+components.add("local_router", build_local_router, enabled=os.getenv("LOCAL_ROUTER", "true").lower() == "true")
+components.add("chains", build_chains)
+# Near-duplicate questions are answered from the cache (SEMANTIC_CACHE=false disables it)
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "true").lower() == "true"
+components.add("semantic_cache", lambda c: c.get("imports").semantic_cache.SemanticCache(c.get("embeddings")),
+               enabled=SEMANTIC_CACHE)
+# Last turns + rolling summary of a chat for follow-up questions (CONVERSATION_MEMORY=false disables it)
+components.add("memory", lambda c: c.get("imports").memory.ConversationMemory(
+                   c.get("imports").chains.stage_llm(c.get("llm"), "summary"),
+                   callbacks=[c.get("imports").tracing.callback_handler]),
+               enabled=os.getenv("CONVERSATION_MEMORY", "true").lower() == "true")
+
+# Follow-ups picked from the index precomputed by ingest.py (SUGGESTION_INDEX=false
+# always asks the LLM); SUGGESTION_LLM_FALLBACK=false never does
+SUGGESTION_INDEX = os.getenv("SUGGESTION_INDEX", "true").lower() == "true"
+components.add("suggestion_index", lambda c: c.get("imports").suggestion_index.SuggestionIndex.load(c.get("retrievers")),
+               enabled=SUGGESTION_INDEX)
+SUGGESTION_LLM_FALLBACK = os.getenv("SUGGESTION_LLM_FALLBACK", "true").lower() == "true"
+
+async def get_ai() -> SimpleNamespace:
+    """The AI components a chat request needs, waiting for (or triggering) their build."""
+    master_chain, suggestion_chain = await components.aget("chains")
+    return SimpleNamespace(
+        chains=(await components.aget("imports")).chains,
+        master_chain=master_chain,
+        suggestion_chain=suggestion_chain,
+        semantic_cache=await components.aget("semantic_cache"),
+        memory=await components.aget("memory"),
+        suggestion_index=await components.aget("suggestion_index"),
+    )
+
+# Suggestions generated in the background, fetched later by id
+suggestion_registry = SuggestionRegistry()
+# Messages are written behind the response by a background group-commit writer
+journal = MessageJournal()
+# Concurrent identical first questions share one master chain run (streamed
+# and non-streamed separately) and one suggestion run (SINGLE_FLIGHT=false disables it)
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+answer_flights = SingleFlight()
+answer_stream_flights = SingleFlight()
+suggestion_flights = SingleFlight()
+# Global cap, wait queue and per-client rate limits in front of the LLM endpoints
+admission_control = AdmissionController()
+# Summary updates that run after the response; referenced so they are not garbage collected
+background_tasks = set()
+# Where the suggested prompts came from
+suggestion_stats = {"from_index": 0, "from_llm": 0}
+# Answer prompt sizes, to watch the effect of chunking and context packing
+prompt_token_stats = {"requests": 0, "prompt_tokens": 0}
+# Seconds spent in each step of the cold start (the AI components are in /ready)
+startup_timings: Dict[str, float] = {}
+
+def record_prompt_tokens(ai: SimpleNamespace, result) -> Optional[int]:
+    """Logs and accumulates the answer prompt size of a chain result."""
+    prompt_tokens = ai.chains.prompt_tokens_of(result)
+    if prompt_tokens is not None:
+        prompt_token_stats["requests"] += 1
+        prompt_token_stats["prompt_tokens"] += prompt_tokens
+    return prompt_tokens
+
+# Page sizes of /history and /chats/{chat_id}
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "100"))
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "500"))
+MAX_PAGE_SIZE = 1000
 
 # --- 3. FastAPI Application ---
 app = FastAPI(title="Hybrid R Chatbot - Production Version")
@@ -33,7 +137,21 @@ app = FastAPI(title="Hybrid R Chatbot - Production Version")
 # --- NEW: Initialize database on startup ---
 @app.on_event("startup")
 def startup_event():
+    startup_timings["app_import"] = time.perf_counter() - STARTUP_STARTED
+    started = time.perf_counter()
     database.init_db()
+    journal.start()
+    startup_timings["database"] = time.perf_counter() - started
+    startup_timings["to_first_request"] = time.perf_counter() - STARTUP_STARTED
+    print(f"Serving after {startup_timings['to_first_request']:.2f}s "
+          f"(app import {startup_timings['app_import']:.2f}s, database {startup_timings['database']:.2f}s)")
+    if os.getenv("AI_WARMUP", "true").lower() == "true":
+        components.warm()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Commit every queued message before the process exits
+    journal.close()
 
 # Temporary CORS fix - allow all origins for debugging
 print("CORS DEBUG MODE: Allowing all origins")
@@ -44,12 +162,48 @@ app.add_middleware(
     allow_credentials=False,  # Must be False when using "*"
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    # Let the frontend read the pagination, validation and timing headers
+    expose_headers=["ETag", "Last-Modified", "X-Next-Cursor", "Link", "Server-Timing"],
 )
+# Request latency histograms and the per-request trace behind Server-Timing
+app.add_middleware(metrics.MetricsMiddleware)
+
+# --- NEW: Requests the admission control turned away ---
+# 429 when the client is over its rate, 503 when the server is overloaded;
+# "answer" is what the frontend shows, Retry-After when to try again.
+def rejection_response(status_code: int, reason: str, retry_after: int) -> JSONResponse:
+    message = ("You are sending questions too quickly" if status_code == 429
+               else "The tutor is answering a lot of questions right now")
+    return JSONResponse(
+        {"error": reason, "answer": f"{message}. Please try again in {retry_after} seconds.", "retry_after": retry_after},
+        status_code=status_code, headers={"Retry-After": str(retry_after)})
+
+@app.exception_handler(Rejected)
+async def rejected_handler(request: Request, exc: Rejected):
+    return rejection_response(exc.status_code, exc.reason, exc.retry_after)
+
+async def missing_chat(chat_id: Optional[int]) -> Optional[JSONResponse]:
+    """404 for a follow-up to a chat that does not exist, whose turn could not be saved."""
+    if not chat_id or await run_in_threadpool(database.chat_exists, chat_id):
+        return None
+    return JSONResponse({"error": f"Chat {chat_id} not found",
+                         "answer": "This conversation no longer exists. Please start a new chat."}, status_code=404)
+
+async def release_after(ticket, events):
+    """Streams `events`, then frees the admission slots the stream held."""
+    try:
+        async for event in events:
+            yield event
+    finally:
+        ticket.release()
 
 # --- MODIFIED: Update ChatRequest to include optional chat_id ---
 class ChatRequest(BaseModel):
     question: str
     chat_id: Optional[int] = None
+    # When True, /chat returns as soon as the answer is ready and the
+    # suggestions are fetched afterwards from GET /suggestions/{suggestions_id}.
+    defer_suggestions: bool = False
 
 # --- NEW: Pydantic model for deleting chats ---
 class DeleteRequest(BaseModel):
@@ -59,64 +213,202 @@ class DeleteRequest(BaseModel):
 def chat_options():
     return {"message": "OK"}
 
-# --- MODIFIED: The /chat endpoint now saves messages ---
-@app.post("/chat")
-def chat(request: ChatRequest) -> Dict[str, Any]:
+def format_sse(event: str, data: Any) -> str:
+    """Formats a single Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def new_message(message_type: str, text: str, sources: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """Builds a message dict in the shape the database and the journal expect."""
+    message = {"type": message_type, "text": text, "timestamp": datetime.now().isoformat()}
+    if sources is not None:
+        message["sources"] = sources
+    return message
+
+async def lookup_cached_answer(ai: SimpleNamespace, question: str):
+    """Returns (cache entry or None, question vector or None); cache errors count as misses."""
+    if ai.semantic_cache is None:
+        return None, None
     try:
-        # 1. Save user's message to the database
-        user_message = {
-            "type": "user",
-            "text": request.question,
-            "timestamp": datetime.now().isoformat()
-        }
-        # This will return a new ID if chat_id is None, or the existing ID back
-        chat_id = database.add_message_to_chat(request.chat_id, user_message)
-
-        # 2. Get AI response (this logic remains the same)
-        print(f"DEBUG: Processing question: {request.question}")
-        result = master_chain.invoke({"input": request.question})
-        print(f"DEBUG: Chain result type: {type(result)}")
-        print(f"DEBUG: Chain result: {result}")
-        
-        final_answer, sources = "", []
-        if isinstance(result, dict) and "answer" in result:
-            final_answer = result.get("answer", "Could not find a specific answer.")
-            if "context" in result: 
-                sources = [doc.metadata for doc in result["context"]]
-                print(f"DEBUG: Found {len(sources)} sources")
-        else:
-            final_answer = result.content if hasattr(result, "content") else str(result)
-            print(f"DEBUG: Using content/string result")
-        
-        # 3. Get suggested prompts (this logic remains the same)
+        return await ai.semantic_cache.alookup(question)
+    except Exception as e:
+        print(f"Error looking up the semantic cache: {e}")
+        return None, None
+
+def wait_chat_committed(chat_id: int):
+    """
+    Blocking: waits until the messages journaled for one chat are in the
+    database. Raises Rejected (503) when the writer is too far behind,
+    rather than reading the chat without its latest turn.
+    """
+    if not journal.wait_chat_committed(chat_id):
+        print(f"WARNING: journal entries of chat {chat_id} are not committed yet.")
+        raise Rejected(503, "journal_backlog", 1)
+
+async def journal_append(chat_id: int, messages: List[Dict[str, Any]]) -> int:
+    """Journals messages of a chat; raises Rejected (503) rather than waiting when the journal queue is full."""
+    try:
+        return await journal.aappend(chat_id, messages)
+    except JournalFull as e:
+        print(f"WARNING: journal queue is full, message of chat {chat_id} not saved: {e}")
+        raise Rejected(503, "journal_backlog", 1)
+
+def load_memory(ai: SimpleNamespace, chat_id: Optional[int]) -> Dict[str, Any]:
+    """Blocking: the chat's {"history", "history_tokens"} once its journaled messages are committed."""
+    if ai.memory is None or not chat_id:
+        return {"history": [], "history_tokens": 0}
+    wait_chat_committed(chat_id)
+    return ai.memory.load(chat_id)
+
+def schedule_memory_update(ai: SimpleNamespace, chat_id: int, seq: int):
+    """After journal entry `seq` is committed, folds the turns that left the memory window into the summary."""
+    if ai.memory is None:
+        return
+    async def update():
         try:
-            suggestions_result = suggestion_chain.invoke({"input": request.question, "answer": final_answer})
-            suggestions_text = suggestions_result.content.strip()
-            suggested_prompts = [line.strip() for line in suggestions_text.splitlines() if line.strip()]
+            if not await run_in_threadpool(journal.wait_committed, seq):
+                # The next turn's update folds these messages in
+                print(f"Skipped the summary update of chat {chat_id}: its turn is not committed yet.")
+                return
+            await ai.memory.aupdate(chat_id)
         except Exception as e:
-            print(f"Error generating suggestions: {e}")
-            suggested_prompts = []
+            print(f"Error updating the conversation summary: {e}")
+    task = asyncio.create_task(update())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
-        # 4. Save AI's message to the database
-        ai_message = {
-            "type": "ai",
-            "text": final_answer,
-            "sources": sources,
-            "timestamp": datetime.now().isoformat()
-        }
-        database.add_message_to_chat(chat_id, ai_message)
+async def invoke_master_chain(ai: SimpleNamespace, question: str, history: List[Any]):
+    """Runs the master chain; concurrent identical first questions share one run."""
+    chain_input = {"input": question, "history": history}
+    # A follow-up's answer depends on its chat, so only first questions are coalesced
+    if history or not SINGLE_FLIGHT:
+        return await ai.master_chain.ainvoke(chain_input)
+    return await answer_flights.do(normalize_question(question), lambda: ai.master_chain.ainvoke(chain_input))
 
-        # 5. Return the response to the frontend, now including the chat_id
-        return {
+def stream_master_chain(ai: SimpleNamespace, question: str, history: List[Any]):
+    """Streams the master chain; concurrent identical first questions share (and replay) one stream."""
+    chain_input = {"input": question, "history": history}
+    if history or not SINGLE_FLIGHT:
+        return ai.master_chain.astream(chain_input)
+    return answer_stream_flights.stream(normalize_question(question), lambda: ai.master_chain.astream(chain_input))
+
+async def pick_suggestions(ai: SimpleNamespace, question: str, final_answer: str, documents: List[Any]) -> List[str]:
+    """Follow-ups from the precomputed index, or from the LLM when it has too few."""
+    if ai.suggestion_index is not None:
+        picked = ai.suggestion_index.suggest(question, documents)
+        if len(picked) >= ai.suggestion_index.count or not SUGGESTION_LLM_FALLBACK:
+            suggestion_stats["from_index"] += 1
+            return picked
+    suggestion_stats["from_llm"] += 1
+    return await generate_suggestions(ai.suggestion_chain, question, final_answer)
+
+async def suggest_and_cache(ai: SimpleNamespace, question: str, final_answer: str, sources: List[Dict[str, Any]],
+                            documents: List[Any], question_vector, started: float) -> List[str]:
+    """
+    Picks the suggestions, then caches the complete response for
+    near-duplicate questions. Concurrent calls for the same question and
+    answer share one run, which also stores the cache entry only once.
+    """
+    async def run():
+        suggested_prompts = await pick_suggestions(ai, question, final_answer, documents)
+        if ai.semantic_cache is not None and question_vector is not None:
+            try:
+                await run_in_threadpool(ai.semantic_cache.store, question, question_vector, final_answer,
+                                        sources, suggested_prompts, time.perf_counter() - started)
+            except Exception as e:
+                print(f"Error storing in the semantic cache: {e}")
+        return suggested_prompts
+    if not SINGLE_FLIGHT:
+        return await run()
+    return await suggestion_flights.do((normalize_question(question), final_answer), run)
+
+# --- MODIFIED: The /chat endpoint is async so LLM waits don't hold a worker thread ---
+# Admission control runs first: over-limit requests are rejected before any work
+@app.post("/chat")
+async def chat(request: ChatRequest, http_request: Request):
+    not_found = await missing_chat(request.chat_id)
+    if not_found is not None:
+        return not_found
+    async with admission_control.admit(client_key(http_request)):
+        return await answer_chat(request)
+
+async def answer_chat(request: ChatRequest):
+    try:
+        # 1. A new chat is created right away (in the threadpool, while the
+        # chain call below is already in flight) so its ID can be returned.
+        # An existing chat's recent turns and summary are loaded instead.
+        user_message = new_message("user", request.question)
+        chat_id = request.chat_id
+        create_chat = None
+        if not chat_id:
+            create_chat = asyncio.ensure_future(run_in_threadpool(database.create_chat, request.question))
+
+        # 2. Get AI response, from the semantic cache when a near-duplicate was answered before
+        started = time.perf_counter()
+        try:
+            # Waits for the AI components on a cold start
+            ai = await get_ai()
+            conversation = await run_in_threadpool(load_memory, ai, chat_id)
+            # Follow-ups depend on the conversation, so only first questions use the cache
+            cached, question_vector = (None, None) if conversation["history"] else await lookup_cached_answer(ai, request.question)
+            prompt_tokens = None
+            if cached is not None:
+                final_answer, sources = cached["answer"], cached["sources"]
+            else:
+                result = await invoke_master_chain(ai, request.question, conversation["history"])
+                final_answer, sources = ai.chains.extract_answer(result)
+                documents = ai.chains.context_of(result)
+                prompt_tokens = record_prompt_tokens(ai, result)
+        except Exception:
+            # Keep the question in the history even when answering failed
+            if create_chat is not None:
+                chat_id = await create_chat
+            await journal_append(chat_id, [user_message])
+            raise
+        if create_chat is not None:
+            chat_id = await create_chat
+
+        # Suggestions are generated while the turn is being saved
+        suggestions_task = None
+        if cached is None:
+            suggestions_task = asyncio.create_task(
+                suggest_and_cache(ai, request.question, final_answer, sources, documents, question_vector, started)
+            )
+
+        # 3. Journal the user's message and the AI's answer as one entry; they
+        # are committed together by the background writer.
+        ai_message = new_message("ai", final_answer, sources)
+        seq = await journal_append(chat_id, [user_message, ai_message])
+        schedule_memory_update(ai, chat_id, seq)
+
+        # 4. Return the response to the frontend, now including the chat_id
+        response = {
             "answer": final_answer,
             "sources": sources,
-            "suggested_prompts": suggested_prompts,
-            "chat_id": chat_id
+            "chat_id": chat_id,
+            "cached": cached is not None,
+            "prompt_tokens": prompt_tokens,
+            "history_tokens": conversation["history_tokens"]
         }
+        if cached is not None:
+            response["suggested_prompts"] = cached["suggested_prompts"]
+            return response
+
+        if request.defer_suggestions:
+            response["suggested_prompts"] = []
+            response["suggestions_id"] = suggestion_registry.register(suggestions_task)
+        else:
+            response["suggested_prompts"] = await suggestions_task
+        return response
     except Exception as e:
+        if isinstance(e, Rejected):
+            raise
         print(f"ERROR in /chat endpoint: {e}")
         import traceback
         traceback.print_exc()
+        # The OpenAI API is rate limiting us: answer 503 and shed new requests until it recovers
+        retry_after = admission_control.upstream_limited(e)
+        if retry_after is not None:
+            raise Rejected(503, "upstream_rate_limited", retry_after)
         
         # Return a proper JSON response instead of raising an HTTPException
         # This ensures the frontend gets the expected JSON structure
@@ -125,26 +417,406 @@ def chat(request: ChatRequest) -> Dict[str, Any]:
             "answer": "Sorry, an error occurred processing your request."
         }
 
-# --- NEW: Endpoint to get all chat history ---
+# --- NEW: Fetch suggestions started by a /chat call with defer_suggestions ---
+@app.get("/suggestions/{suggestions_id}")
+async def get_suggestions(suggestions_id: str, wait: float = 10.0):
+    result = await suggestion_registry.get(suggestions_id, wait_seconds=min(max(wait, 0), 30))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired suggestions_id")
+    return {"suggestions_id": suggestions_id, **result}
+
+# --- NEW: Streaming variant of /chat using Server-Sent Events ---
+# Events, in order: "chat_id" (once the user message is saved), "sources"
+# (once retrieval finishes, RAG branches only), "token" (one per answer
+# chunk), "suggested_prompts" and finally "done" (or "error").
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    not_found = await missing_chat(request.chat_id)
+    if not_found is not None:
+        return not_found
+    # Held until the stream ends; rejected requests get a 429/503 response instead of a stream
+    ticket = await admission_control.acquire(client_key(http_request))
+
+    async def event_stream():
+        chat_id = request.chat_id
+        try:
+            user_message = new_message("user", request.question)
+            if not chat_id:
+                chat_id = await run_in_threadpool(database.create_chat, request.question)
+            yield format_sse("chat_id", {"chat_id": chat_id})
+
+            # Waits for the AI components on a cold start
+            started = time.perf_counter()
+            try:
+                ai = await get_ai()
+                # Loaded before this question is journaled, so it is not part of its own history
+                conversation = await run_in_threadpool(load_memory, ai, request.chat_id)
+            finally:
+                await journal_append(chat_id, [user_message])
+            cached, question_vector = (None, None) if conversation["history"] else await lookup_cached_answer(ai, request.question)
+            if cached is not None:
+                yield format_sse("sources", {"sources": cached["sources"]})
+                yield format_sse("token", {"text": cached["answer"]})
+                ai_message = new_message("ai", cached["answer"], cached["sources"])
+                await journal_append(chat_id, [ai_message])
+                yield format_sse("suggested_prompts", {"suggested_prompts": cached["suggested_prompts"]})
+                yield format_sse("done", {"chat_id": chat_id, "cached": True})
+                return
+
+            # The RunnableBranch streams whichever branch the router picked:
+            # RAG branches yield dict chunks ("context" once, then "answer"
+            # pieces), the general branch yields AIMessageChunks.
+            answer_parts, sources, documents, prompt_tokens = [], [], [], None
+            async for chunk in stream_master_chain(ai, request.question, conversation["history"]):
+                if isinstance(chunk, dict):
+                    if "prompt_tokens" in chunk:
+                        prompt_tokens = record_prompt_tokens(ai, chunk)
+                    if "context" in chunk:
+                        documents = chunk["context"]
+                        sources = [doc.metadata for doc in documents]
+                        yield format_sse("sources", {"sources": sources})
+                    token = chunk.get("answer", "")
+                else:
+                    token = chunk.content if hasattr(chunk, "content") else str(chunk)
+                    if getattr(chunk, "usage_metadata", None):
+                        prompt_tokens = record_prompt_tokens(ai, chunk)
+                if token:
+                    answer_parts.append(token)
+                    yield format_sse("token", {"text": token})
+            final_answer = "".join(answer_parts) or "Could not find a specific answer."
+
+            # The answer is complete for the user; journal it and generate suggestions
+            ai_message = new_message("ai", final_answer, sources)
+            schedule_memory_update(ai, chat_id, await journal_append(chat_id, [ai_message]))
+            suggested_prompts = await suggest_and_cache(ai, request.question, final_answer, sources, documents,
+                                                        question_vector, started)
+            yield format_sse("suggested_prompts", {"suggested_prompts": suggested_prompts})
+            yield format_sse("done", {"chat_id": chat_id, "prompt_tokens": prompt_tokens,
+                                      "history_tokens": conversation["history_tokens"]})
+        except Exception as e:
+            print(f"ERROR in /chat/stream endpoint: {e}")
+            import traceback
+            traceback.print_exc()
+            yield format_sse("error", {
+                "error": str(e),
+                "answer": "Sorry, an error occurred processing your request.",
+                "chat_id": chat_id,
+                "retry_after": e.retry_after if isinstance(e, Rejected) else admission_control.upstream_limited(e)
+            })
+
+    # The background task frees the slots if the stream never started (client gone)
+    return StreamingResponse(
+        release_after(ticket, event_stream()),
+        media_type="text/event-stream",
+        # Stop reverse proxies (nginx, Render) from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release)
+    )
+
+# --- NEW: Many questions in one request (homework sets, routing regression checks) ---
+class BatchRequest(BaseModel):
+    questions: List[str]
+    # Chain runs in flight (default BATCH_CONCURRENCY, at most MAX_BATCH_CONCURRENCY)
+    concurrency: Optional[int] = None
+    # Save every question and its answer as a chat of its own
+    persist: bool = False
+    suggestions: bool = True
+    # False answers every question with the chain, e.g. to check the routing
+    use_cache: bool = True
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+MAX_BATCH_CONCURRENCY = 32
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "500"))
+batch_stats = {"batches": 0, "questions": 0, "chain_runs": 0, "cached": 0, "errors": 0}
+
+async def answer_batch(ai: SimpleNamespace, request: BatchRequest, concurrency: int, results: asyncio.Queue):
+    """
+    Answers every question of a batch and puts one result per question on
+    `results` as soon as it is ready. Duplicate questions are answered once,
+    all questions are embedded in one request, and the master chain runs
+    through abatch_as_completed with at most `concurrency` runs in flight,
+    each in a background admission slot.
+    """
+    started = time.perf_counter()
+    positions: Dict[str, List[int]] = {}
+    for position, question in enumerate(request.questions):
+        positions.setdefault(normalize_question(question), []).append(position)
+    questions = [request.questions[indexes[0]] for indexes in positions.values()]
+    # Suggestion LLM calls and database writes share the limit of the chain runs
+    limit = asyncio.Semaphore(concurrency)
+
+    async def publish(question: str, answer: Dict[str, Any]):
+        for position in positions[normalize_question(question)]:
+            line = {"index": position, "question": request.questions[position], **answer, "chat_id": None}
+            if request.persist and "error" not in answer:
+                async with limit:
+                    line["chat_id"] = await run_in_threadpool(database.create_chat, line["question"])
+                    try:
+                        await journal_append(line["chat_id"], [new_message("user", line["question"]),
+                                                               new_message("ai", answer["answer"], answer["sources"])])
+                    except Rejected:
+                        # The answer is still returned; only saving it failed
+                        line["error"] = "The chat could not be saved: the journal queue is full."
+            line["seconds"] = round(time.perf_counter() - started, 3)
+            batch_stats["questions"] += 1
+            batch_stats["errors"] += "error" in line
+            await results.put(line)
+
+    async def finish(question: str, result, question_vector):
+        try:
+            if isinstance(result, Exception):
+                raise result
+            final_answer, sources = ai.chains.extract_answer(result)
+            answer = {"answer": final_answer, "sources": sources, "route": ai.chains.route_of(result),
+                      "cached": False, "prompt_tokens": record_prompt_tokens(ai, result), "suggested_prompts": []}
+            if request.suggestions:
+                async with limit:
+                    answer["suggested_prompts"] = await suggest_and_cache(
+                        ai, question, final_answer, sources, ai.chains.context_of(result), question_vector, started)
+        except Exception as e:
+            print(f"Error answering batch question '{question}': {e}")
+            admission_control.upstream_limited(e)
+            answer = {"error": str(e)}
+        await publish(question, answer)
+
+    embeddings = await components.aget("embeddings")
+    vectors = await embeddings.aembed_queries(questions)
+    with embeddings.prefetched(dict(zip(questions, vectors))):
+        todo, vectors_by_question = [], {}
+        lookups = await asyncio.gather(*(lookup_cached_answer(ai, question) if request.use_cache else
+                                         asyncio.sleep(0, (None, None)) for question in questions))
+        for question, (cached, question_vector) in zip(questions, lookups):
+            if cached is not None:
+                batch_stats["cached"] += 1
+                await publish(question, {"answer": cached["answer"], "sources": cached["sources"], "route": None,
+                                         "cached": True, "suggested_prompts": cached["suggested_prompts"]})
+            else:
+                todo.append(question)
+                vectors_by_question[question] = question_vector
+        batch_stats["chain_runs"] += len(todo)
+
+        # Every chain run holds a background admission slot while it runs
+        admitted_chain = ai.chains.with_ticket(ai.master_chain, admission_control.acquire_background)
+        finishing = []
+        inputs = [{"input": question, "history": []} for question in todo]
+        async for i, result in admitted_chain.abatch_as_completed(
+                inputs, config={"max_concurrency": concurrency}, return_exceptions=True):
+            finishing.append(asyncio.create_task(finish(todo[i], result, vectors_by_question[todo[i]])))
+        await asyncio.gather(*finishing)
+
+# Newline-delimited JSON, one line per question in the order they finish:
+# {"index", "question", "answer", "sources", "route", "cached",
+# "suggested_prompts", "chat_id", "seconds"} or {"index", "question", "error"},
+# then a last {"done": true, ...} line with the totals.
+@app.post("/chat/batch")
+async def chat_batch(request: BatchRequest, http_request: Request):
+    if not request.questions:
+        raise HTTPException(status_code=422, detail="questions must not be empty")
+    if len(request.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+    # Batches have a quota of their own; each chain run then waits for a background slot
+    admission_control.charge_batch(client_key(http_request), len(request.questions))
+    concurrency = min(max(request.concurrency or BATCH_CONCURRENCY, 1), MAX_BATCH_CONCURRENCY)
+    batch_stats["batches"] += 1
+
+    async def lines():
+        started = time.perf_counter()
+        results: asyncio.Queue = asyncio.Queue()
+        counts = {"answered": 0, "cached": 0, "errors": 0}
+        producer = None
+        try:
+            # Waits for the AI components on a cold start
+            ai = await get_ai()
+            producer = asyncio.create_task(answer_batch(ai, request, concurrency, results))
+            for _ in request.questions:
+                getter = asyncio.ensure_future(results.get())
+                await asyncio.wait([getter, producer], return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done() and producer.exception() is not None:
+                    # The batch failed before every question had a result
+                    getter.cancel()
+                    raise producer.exception()
+                line = await getter
+                counts["errors" if "error" in line else "cached" if line["cached"] else "answered"] += 1
+                yield json.dumps(line) + "\n"
+            await producer
+            error = None
+        except Exception as e:
+            print(f"ERROR in /chat/batch endpoint: {e}")
+            admission_control.upstream_limited(e)
+            error = str(e)
+        finally:
+            # Also reached when the client disconnects
+            if producer is not None and not producer.done():
+                producer.cancel()
+        yield json.dumps({"done": True, "questions": len(request.questions), **counts, "concurrency": concurrency,
+                          "seconds": round(time.perf_counter() - started, 3), "error": error}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- NEW: Runtime statistics of the optional performance components ---
+@app.get("/stats")
+def get_stats():
+    # Components that are not built yet report None; /stats never triggers a build
+    local_router = components.peek("local_router")
+    semantic_cache = components.peek("semantic_cache")
+    embeddings = components.peek("embeddings")
+    memory = components.peek("memory")
+    retrievers = components.peek("retrievers") or {}
+    imports = components.peek("imports")
+    suggestion_index = components.peek("suggestion_index")
+    return {
+        "router": local_router.stats() if local_router else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+        "embedding_cache": embeddings.stats() if hasattr(embeddings, "stats") else None,
+        "journal": journal.stats(),
+        "memory": memory.stats() if memory is not None else None,
+        "retrieval": {name: retriever.stats() for name, retriever in retrievers.items() if hasattr(retriever, "stats")},
+        # Only the memory-mapped index (VECTOR_BACKEND=numpy) reports stats
+        "vector_index": {name: retriever.vectorstore.stats() for name, retriever in retrievers.items()
+                         if hasattr(getattr(retriever, "vectorstore", None), "stats")} or None,
+        "batch": batch_stats,
+        "admission": admission_control.stats(),
+        # Retries, hedges and latency per LLM stage (production client only)
+        "llm_client": (imports.llm_client.stats() or None) if imports else None,
+        "suggestions": {
+            **suggestion_stats,
+            "index": suggestion_index.stats() if suggestion_index else None,
+        },
+        "speculative_retrieval": imports.chains.speculation_stats.stats() if SPECULATIVE_RETRIEVAL and imports else None,
+        "coalescing": {
+            "answers": answer_flights.stats(),
+            "answer_streams": answer_stream_flights.stats(),
+            "suggestions": suggestion_flights.stats(),
+        },
+        "prompt_tokens": {
+            **prompt_token_stats,
+            "avg_per_request": prompt_token_stats["prompt_tokens"] / prompt_token_stats["requests"]
+            if prompt_token_stats["requests"] else 0.0,
+        },
+    }
+
+# --- NEW: Prometheus metrics ---
+# Latency histograms per HTTP route, per stage of answering (condense,
+# router, query_embedding, retrieval, generation, suggestions, summary) and
+# per database call, LLM tokens per stage, the routes picked and the number
+# of retrieved documents. Send `X-Server-Timing: true` (or set
+# TIMING_HEADER=true) to get one request's breakdown in a Server-Timing header.
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- NEW: Readiness of the lazily built AI components ---
+# 200 once every enabled component is built, 503 before (or after a failed
+# build, or while the journal cannot write to the database). "startup" breaks the cold start down; the time each AI component
+# took to build (imports, retrievers = store load, chains = chain build)
+# is in "components".
+@app.get("/ready")
+def get_ready():
+    ready = components.ready() and journal.healthy()
+    body = {
+        "ready": ready,
+        "components": components.status(),
+        "journal": {"healthy": journal.healthy(), "write_error": journal.stats()["write_error"]},
+        "startup": {**startup_timings, "components_warmup": components.warm_seconds},
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+# --- NEW: Conditional GET helpers for the history endpoints ---
+def http_date(timestamp: str) -> str:
+    """HTTP-date for an ISO timestamp stored by the database (local time)."""
+    return format_datetime(datetime.fromisoformat(timestamp).astimezone(timezone.utc), usegmt=True)
+
+def not_modified(request: Request, etag: str, last_modified: str) -> bool:
+    """Whether the client's cached copy (If-None-Match, else If-Modified-Since) is still current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison: W/"x" matches "x"
+        tags = {re.sub(r"^W/", "", tag.strip()) for tag in if_none_match.split(",")}
+        return "*" in tags or re.sub(r"^W/", "", etag) in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def set_page_headers(request: Request, response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
+# --- MODIFIED: Chat history is paged (newest first) and validated with an ETag ---
+# The body stays a list of chats; the cursor of the next page is returned in
+# the X-Next-Cursor header. The ETag changes whenever a chat is created or
+# deleted, so an unchanged history is answered with 304 Not Modified.
 @app.get("/history")
-def get_history():
+def get_history(request: Request, response: Response,
+                limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                cursor: Optional[str] = None):
     try:
-        result = database.get_all_chats()
-        print(f"DEBUG: Retrieved {len(result)} chats from database")
+        version, updated = database.get_history_version()
+        validators = {"ETag": f'W/"h{version}"', "Last-Modified": http_date(updated), "Cache-Control": "no-cache"}
+        if not_modified(request, validators["ETag"], validators["Last-Modified"]):
+            return Response(status_code=304, headers=validators)
+        try:
+            result, next_cursor = database.get_chats_page(limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        response.headers.update(validators)
+        set_page_headers(request, response, next_cursor)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR in /history endpoint: {e}")
         import traceback
         traceback.print_exc()
         return {"error": str(e)}
 
-# --- NEW: Endpoint to get messages for a specific chat ---
+# --- MODIFIED: Messages of a chat are paged (oldest first) and validated with an ETag ---
+# The ETag is the id of the chat's latest message; messages are never edited,
+# so it only changes when the chat grows. include_sources=false leaves out
+# the (large) sources of every message.
 @app.get("/chats/{chat_id}")
-def get_chat_messages(chat_id: int):
-    return database.get_messages_for_chat(chat_id)
+def get_chat_messages(chat_id: int, request: Request, response: Response,
+                      limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                      cursor: Optional[str] = None, include_sources: bool = True):
+    # Read-your-writes: the chat's journaled messages are committed first
+    wait_chat_committed(chat_id)
+    latest = database.get_chat_version(chat_id)
+    if latest is not None:
+        validators = {"ETag": f'W/"m{latest["id"]}"', "Last-Modified": http_date(latest["timestamp"]),
+                      "Cache-Control": "no-cache"}
+        if not_modified(request, validators["ETag"], validators["Last-Modified"]):
+            return Response(status_code=304, headers=validators)
+        response.headers.update(validators)
+    try:
+        messages, next_cursor = database.get_messages_page(chat_id, limit, cursor, include_sources)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_page_headers(request, response, next_cursor)
+    return messages
+
+# --- NEW: Full-text search over all messages (FTS5, ranked by BM25) ---
+# Returns a list of {"chat": {...}, "messages": [matching message]} with a
+# snippet as the message text; the next page's cursor is in X-Next-Cursor.
+@app.get("/history/search")
+def search_history(request: Request, response: Response, q: str = Query(..., min_length=1),
+                   limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None):
+    try:
+        offset = int(cursor) if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    # No wait for the journal: a message is searchable once committed, a few ms later
+    results, next_offset = database.search_messages(q, limit, max(offset, 0))
+    set_page_headers(request, response, str(next_offset) if next_offset is not None else None)
+    return results
 
 # --- NEW: Endpoint to delete selected chats ---
 @app.post("/history/delete")
 async def delete_history(request: DeleteRequest):
-    database.delete_chats(request.ids)
+    # Journal entries still queued for these chats are skipped by the writer
+    await run_in_threadpool(database.delete_chats, request.ids)
     return {"status": "success"}
\ No newline at end of file
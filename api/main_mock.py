@@ -1,77 +1,40 @@
 # main_mock.py
+# The production application (main.py) with the mock components swapped in:
+# every endpoint, the database, journal, caches and chains are the real ones,
+# only the LLM and the embeddings are fakes from src/mock_components.py
+# (configurable latency, hash-based embeddings). Used for local development
+# and by the load-testing harness in benchmarks/.
+#
+#   uvicorn main_mock:app --port 8000
+#
 import os
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import Dict, Any
 from dotenv import load_dotenv
-from fastapi.middleware.cors import CORSMiddleware
 
-# --- 1. Load Environment and Mock Blueprints ---
+# --- 1. Load Environment and Keep Mock Data Apart ---
 load_dotenv()
-from src.mock_components import get_mock_llm, get_mock_embeddings
-from src.data_loader import get_retrievers
-from src.chains import create_master_chain
+# Mock runs never touch the production history or caches
+os.environ.setdefault("DATABASE_PATH", "chat_history_mock.sqlite3")
+os.environ.setdefault("JOURNAL_PATH", "chat_journal_mock.jsonl")
+os.environ.setdefault("SEMANTIC_CACHE_PATH", "semantic_cache_mock.sqlite3")
 
 # --- 2. Assemble the MOCK Application ---
 print("="*50)
 print("ASSEMBLING MOCK APPLICATION")
 print("="*50)
-llm = get_mock_llm()
-embeddings = get_mock_embeddings()
-retrievers = get_retrievers(embeddings, is_mock=True)
-master_chain, suggestion_chain = create_master_chain(llm, retrievers)
-
-# --- 3. FastAPI Application ---
-app = FastAPI(title="Hybrid R Chatbot - Mock Version")
-
-# Temporary CORS fix - allow all origins for debugging
-print("CORS DEBUG MODE: Allowing all origins")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Temporarily allow all origins
-    allow_credentials=False,  # Must be False when using "*"
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
-
-class ChatRequest(BaseModel):
-    question: str
-
-@app.options("/chat")
-def chat_options():
-    return {"message": "OK"}
-
-@app.post("/chat")
-def chat(request: ChatRequest) -> Dict[str, Any]:
-    result = master_chain.invoke({"input": request.question})
-    final_answer, sources = "", []
+import main
+from src.mock_components import get_mock_llm, get_mock_embeddings
 
-    if isinstance(result, dict) and "answer" in result:
-        final_answer = result.get("answer", "Could not find a mock answer.")
-        # We manually add mock sources for testing the frontend display
-        if "course material" in final_answer:
-            sources = [
-                {"source_module": "Module 1: Getting Started with R", "timestamp": "07:35"},
-                {"source_module": "Module 1: Getting Started with R", "timestamp": "12:38"}
-            ]
-        elif "R package manual" in final_answer:
-             sources = [
-                {"source_module": "dplyr PDF Manual", "timestamp": "N/A"}
-            ]
-    else:
-        final_answer = result.content if hasattr(result, 'content') else str(result)
-    
-    try:
-        suggestions_result = suggestion_chain.invoke({"input": request.question, "answer": final_answer})
-        suggestions_text = suggestions_result.content.strip()
-        suggested_prompts = [line.strip() for line in suggestions_text.splitlines() if line.strip()]
-    except Exception as e:
-        print(f"Error generating mock suggestions: {e}")
-        suggested_prompts = []
+main.components.add("llm", lambda c: get_mock_llm())
+main.components.add("embeddings", lambda c: c.get("imports").tracing.TimedEmbeddings(get_mock_embeddings()))
+# Mock stores are built (incrementally) from knowledge_base/ at startup
+main.components.add("retrievers", lambda c: c.get("imports").data_loader.get_retrievers(c.get("embeddings"), is_mock=True))
+# The semantic cache is invalidated when the mock stores are rebuilt
+main.components.add("semantic_cache", lambda c: c.get("imports").semantic_cache.SemanticCache(c.get("embeddings"), is_mock=True),
+                    enabled=main.SEMANTIC_CACHE)
+# The mock suggestion index is generated from templates at startup (no LLM)
+main.components.add("suggestion_index", lambda c: c.get("imports").suggestion_index.SuggestionIndex.load(c.get("retrievers"), is_mock=True),
+                    enabled=main.SUGGESTION_INDEX)
 
-    return {
-        "answer": final_answer,
-        "sources": sources,
-        "suggested_prompts": suggested_prompts
-    }
\ No newline at end of file
+# --- 3. FastAPI Application ---
+app = main.app
+app.title = "Hybrid R Chatbot - Mock Version"
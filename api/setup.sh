@@ -54,7 +54,8 @@ info "Next steps:"
 info "1. (IMPORTANT) Edit the .env file with your OpenAI API key."
 info "2. Activate the virtual environment by running: source venv/bin/activate"
 info "3. Run the mock server with: uvicorn main_mock:app --reload --port 8000"
-info "   OR run the production server with: uvicorn main:app --reload --port 8000"
+info "   OR build the vector stores with: python ingest.py"
+info "   and run the production server with: uvicorn main:app --reload --port 8000"
 echo ""
 warning "FRONTEND SETUP:"
 info "For the best development experience, use VS Code's Live Server extension:"
@@ -0,0 +1,362 @@
+# src/admission.py
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+from src import metrics
+
+# ADMISSION_CONTROL=false admits every request at once
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+# Requests served by the LLM chains at the same time (/chat, /chat/stream, /chat/batch)
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+# Requests that may wait for a free slot, and the longest they wait
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# Per-client token bucket: sustained questions per minute and burst (0 disables it)
+CLIENT_RATE_PER_MINUTE = float(os.getenv("CLIENT_RATE_PER_MINUTE", "20"))
+CLIENT_BURST = int(os.getenv("CLIENT_BURST", "10"))
+# Batch questions have a bucket of their own: per hour, and the most one client may send at once
+BATCH_QUESTIONS_PER_HOUR = float(os.getenv("BATCH_QUESTIONS_PER_HOUR", "1000"))
+BATCH_BURST = int(os.getenv("BATCH_BURST", "500"))
+# Share of the slots batch chain runs may hold together; they only take free
+# slots no interactive request is waiting for
+ADMISSION_BATCH_SHARE = float(os.getenv("ADMISSION_BATCH_SHARE", "0.5"))
+# Header a trusted reverse proxy sets to the client address (e.g. x-forwarded-for).
+# Unset, the peer address is the client: clients can put anything in such headers.
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "")
+# New requests are shed this long after the OpenAI API rate limited us without a Retry-After
+UPSTREAM_BACKOFF_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_SECONDS", "5"))
+# Idle (full) buckets are dropped beyond this many clients
+MAX_TRACKED_CLIENTS = 10000
+# Weight of the latest request in the average service time that predicts queue waits
+SERVICE_TIME_SMOOTHING = 0.1
+
+
+def client_key(request) -> str:
+    """
+    The client a request counts against: the peer address, or behind a
+    trusted proxy the last address of ADMISSION_CLIENT_HEADER (the one the
+    proxy added; earlier ones come from the client).
+    """
+    forwarded = request.headers.get(ADMISSION_CLIENT_HEADER) if ADMISSION_CLIENT_HEADER else None
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def upstream_retry_after(error: BaseException) -> Optional[float]:
+    """Seconds to back off when `error` is a 429 from the OpenAI API, else None."""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return max(float(headers.get("retry-after")), 0.0)
+    except (TypeError, ValueError):
+        return UPSTREAM_BACKOFF_SECONDS
+
+
+class Rejected(Exception):
+    """A request that was not admitted: 429 (client over its rate) or 503 (overloaded)."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        # Whole seconds, as the Retry-After header needs them
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBuckets:
+    """Token bucket per client: `burst` tokens, refilled at `rate` per second (0 disables it)."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _tokens(self, client: str, now: float) -> float:
+        tokens, updated = self._buckets.get(client, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def take(self, client: str, cost: int, now: float) -> Optional[float]:
+        """Takes `cost` tokens; returns None, or the seconds until they are available."""
+        if self.rate <= 0:
+            return None
+        tokens = self._tokens(client, now)
+        if tokens < cost:
+            return (cost - tokens) / self.rate
+        self._buckets[client] = (tokens - cost, now)
+        if len(self._buckets) > MAX_TRACKED_CLIENTS:
+            # A full bucket is the same as no bucket
+            self._buckets = {key: value for key, value in self._buckets.items()
+                             if self._tokens(key, now) < self.burst}
+        return None
+
+    def refund(self, client: str, cost: int):
+        if self.rate > 0 and client in self._buckets:
+            now = time.monotonic()
+            self._buckets[client] = (min(self.burst, self._tokens(client, now) + cost), now)
+
+
+class Ticket:
+    """Slots held by an admitted request; release() is idempotent."""
+
+    def __init__(self, controller: Optional["AdmissionController"], weight: int, background: bool = False):
+        self.controller = controller
+        self.weight = weight
+        self.background = background
+        self.started = time.monotonic()
+        self.released = controller is None
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Admission control in front of the LLM chains. At most `max_concurrent`
+    slots are in use; further requests wait in a FIFO queue of
+    `queue_size` for up to `queue_timeout` seconds. A request is shed with
+    503 right away when the queue is full, when its predicted wait (queued
+    slots ahead times the average service time) exceeds the timeout, or
+    while the OpenAI API is rate limiting us. Each client also has a token
+    bucket; an empty bucket gets 429. Batch chain runs take one slot each
+    in the background: only slots no queued request needs, up to
+    `batch_share` of them. Runs on the event loop only.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, rate_per_minute: float = CLIENT_RATE_PER_MINUTE,
+                 burst: int = CLIENT_BURST, batch_per_hour: float = BATCH_QUESTIONS_PER_HOUR,
+                 batch_burst: int = BATCH_BURST, batch_share: float = ADMISSION_BATCH_SHARE,
+                 enabled: bool = ADMISSION_CONTROL):
+        self.enabled = enabled
+        self.max_concurrent = max(max_concurrent, 1)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.buckets = TokenBuckets(rate_per_minute / 60, burst)
+        self.batch_buckets = TokenBuckets(batch_per_hour / 3600, batch_burst)
+        self.max_background = max(int(self.max_concurrent * batch_share), 1)
+        self.in_use = 0
+        self.background_in_use = 0
+        # (future, weight) in arrival order; a waiter's future is resolved when it gets its slots
+        self._waiters: Deque[Tuple[asyncio.Future, int]] = deque()
+        self._queued_weight = 0
+        # Batch chain runs waiting for a background slot, in arrival order
+        self._background_waiters: Deque[asyncio.Future] = deque()
+        self._paused_until = 0.0
+        self._service_seconds: Optional[float] = None
+        self._stats = {"admitted": 0, "queued": 0, "max_queue_depth": 0, "wait_seconds": 0.0,
+                       "rate_limited": 0, "batch_rate_limited": 0, "background_admitted": 0,
+                       "shed": {"queue_full": 0, "deadline": 0, "timeout": 0, "upstream": 0}}
+
+    # --- Per-client token buckets ---
+    def _take(self, client: str, cost: int, now: float, batch: bool = False):
+        reason = "batch_rate_limited" if batch else "rate_limited"
+        retry_after = (self.batch_buckets if batch else self.buckets).take(client, cost, now)
+        if retry_after is not None:
+            self._stats[reason] += 1
+            metrics.ADMISSION_REJECTED.inc(reason=reason)
+            raise Rejected(429, reason, retry_after)
+
+    def _refund(self, client: str, cost: int):
+        self.buckets.refund(client, cost)
+
+    # --- Slots and the wait queue ---
+    def _expected_wait(self, weight: int) -> float:
+        """Seconds until `weight` more slots free up behind the current queue."""
+        if self._service_seconds is None:
+            return 0.0
+        return (self._queued_weight + weight) / self.max_concurrent * self._service_seconds
+
+    def _shed(self, reason: str, retry_after: float):
+        self._stats["shed"][reason] += 1
+        metrics.ADMISSION_REJECTED.inc(reason=reason)
+        raise Rejected(503, reason, retry_after)
+
+    def _grant(self):
+        """Hands free slots to the waiters at the head of the queue, strictly in order."""
+        while self._waiters:
+            future, weight = self._waiters[0]
+            if future.done():
+                # Timed out or cancelled; already removed from the queued weight
+                self._waiters.popleft()
+                continue
+            if self.in_use + weight > self.max_concurrent:
+                break
+            self._waiters.popleft()
+            self._queued_weight -= weight
+            self.in_use += weight
+            future.set_result(None)
+        # Batch chain runs get what is left once the queue is empty
+        while self._background_waiters and self._background_free():
+            future = self._background_waiters.popleft()
+            if not future.done():
+                self._take_background()
+                future.set_result(None)
+        self._observe()
+
+    def _background_free(self) -> bool:
+        return not self._waiters and self.in_use < self.max_concurrent and \
+            self.background_in_use < self.max_background
+
+    def _take_background(self):
+        self.in_use += 1
+        self.background_in_use += 1
+        self._stats["background_admitted"] += 1
+
+    def _observe(self):
+        metrics.ADMISSION_IN_FLIGHT.set(self.in_use)
+        metrics.ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+
+    def _release(self, ticket: Ticket):
+        self.in_use -= ticket.weight
+        if ticket.background:
+            # Batch runs wait behind every queued request; their times do not predict its waits
+            self.background_in_use -= 1
+        elif ticket.weight == 1:
+            seconds = time.monotonic() - ticket.started
+            self._service_seconds = seconds if self._service_seconds is None else \
+                (1 - SERVICE_TIME_SMOOTHING) * self._service_seconds + SERVICE_TIME_SMOOTHING * seconds
+        self._grant()
+
+    async def acquire(self, client: str, weight: int = 1, cost: int = 1) -> Ticket:
+        """
+        Waits for `weight` slots (capped at max_concurrent) and charges the
+        client's bucket `cost` questions. Raises Rejected instead of waiting
+        when the request cannot be served in time.
+        """
+        weight = min(max(weight, 1), self.max_concurrent)
+        if not self.enabled:
+            return Ticket(None, weight)
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._shed("upstream", self._paused_until - now)
+        self._take(client, cost, now)
+
+        if not self._waiters and self.in_use + weight <= self.max_concurrent:
+            self.in_use += weight
+            self._stats["admitted"] += 1
+            self._observe()
+            return Ticket(self, weight)
+
+        expected = self._expected_wait(weight)
+        if len(self._waiters) >= self.queue_size or expected > self.queue_timeout:
+            self._refund(client, cost)
+            self._shed("queue_full" if len(self._waiters) >= self.queue_size else "deadline",
+                       expected or self.queue_timeout)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((future, weight))
+        self._queued_weight += weight
+        self._stats["queued"] += 1
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._waiters))
+        self._observe()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._queued_weight -= weight
+            self._grant()
+            self._refund(client, cost)
+            self._shed("timeout", self._expected_wait(weight) or self.queue_timeout)
+        except asyncio.CancelledError:
+            # The client went away while queued, or right after its slots were granted
+            if future.done() and not future.cancelled():
+                self.in_use -= weight
+            else:
+                self._queued_weight -= weight
+            self._grant()
+            raise
+        waited = time.monotonic() - now
+        self._stats["admitted"] += 1
+        self._stats["wait_seconds"] += waited
+        metrics.ADMISSION_WAIT_SECONDS.observe(waited)
+        return Ticket(self, weight)
+
+    def charge_batch(self, client: str, questions: int):
+        """Charges the client's batch bucket one token per question; raises Rejected (429) when it is short."""
+        if not self.enabled or not questions:
+            return
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._shed("upstream", self._paused_until - now)
+        # A batch larger than the burst would never fit; it takes the full bucket
+        self._take(client, min(questions, self.batch_buckets.burst), now, batch=True)
+
+    async def acquire_background(self) -> Ticket:
+        """
+        Waits for one slot for a batch chain run, charged by charge_batch.
+        It only gets a slot no queued request is waiting for, while batch
+        runs hold less than their share; it is never shed, and it waits out
+        an OpenAI rate limit instead.
+        """
+        if not self.enabled:
+            return Ticket(None, 1, background=True)
+        while time.monotonic() < self._paused_until:
+            await asyncio.sleep(self._paused_until - time.monotonic())
+        if not self._background_waiters and self._background_free():
+            self._take_background()
+            self._observe()
+            return Ticket(self, 1, background=True)
+        future = asyncio.get_running_loop().create_future()
+        self._background_waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Cancelled right after its slot was granted
+            if future.done() and not future.cancelled():
+                self._release(Ticket(self, 1, background=True))
+            raise
+        return Ticket(self, 1, background=True)
+
+    @asynccontextmanager
+    async def admit(self, client: str, weight: int = 1, cost: int = 1):
+        ticket = await self.acquire(client, weight, cost)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def upstream_limited(self, error: BaseException) -> Optional[float]:
+        """
+        Call with the error of a failed answer. When it is a 429 from the
+        OpenAI API, new requests are shed until its Retry-After has passed;
+        returns those seconds (None for other errors).
+        """
+        seconds = upstream_retry_after(error)
+        if seconds is not None and self.enabled:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        return seconds
+
+    def stats(self) -> Dict[str, Any]:
+        queued = self._stats["queued"]
+        return {
+            "enabled": self.enabled,
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_use,
+            "queue_depth": len(self._waiters),
+            "max_queue_depth": self._stats["max_queue_depth"],
+            "queue_size": self.queue_size,
+            "admitted": self._stats["admitted"],
+            "queued": queued,
+            "avg_queue_wait_ms": 1000 * self._stats["wait_seconds"] / queued if queued else 0.0,
+            "avg_service_ms": 1000 * self._service_seconds if self._service_seconds is not None else None,
+            "shed": dict(self._stats["shed"]),
+            "rate_limited": self._stats["rate_limited"],
+            "batch_rate_limited": self._stats["batch_rate_limited"],
+            "background_in_flight": self.background_in_use,
+            "background_queue_depth": len(self._background_waiters),
+            "max_background": self.max_background,
+            "background_admitted": self._stats["background_admitted"],
+            "clients": len(self.buckets),
+            "batch_clients": len(self.batch_buckets),
+            "upstream_backoff_seconds": max(self._paused_until - time.monotonic(), 0.0),
+        }
@@ -1,19 +1,139 @@
 # src/chains.py
-from typing import Dict, Any, Literal
-from langchain_core.runnables import RunnableBranch
-from langchain_core.prompts import PromptTemplate, ChatPromptTemplate
+import time
+import threading
+from typing import Dict, Any, List, Literal, Optional, Tuple
+from langchain_core.runnables import RunnableBranch, RunnableLambda, RunnableParallel, RunnablePassthrough
+from langchain_core.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.messages import get_buffer_string
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
+from src.chunking import count_tokens, pack_context
 
 # --- THIS IS THE FIX ---
 # REMOVE the old, incorrect imports:
 # from src.config import llm  <-- DELETE THIS LINE
 # from src.data_loader import r_packages_retriever, course_modules_retriever <-- DELETE THIS LINE
 
-def create_master_chain(llm, retrievers):
+def count_prompt_tokens(prompt, inputs: Dict[str, Any]) -> int:
+    """Counts the tokens of a RAG prompt as the stuff-documents chain formats it."""
+    values = dict(inputs, context="\n\n".join(doc.page_content for doc in inputs["context"]))
+    variables = [*prompt.input_variables, *getattr(prompt, "optional_variables", [])]
+    messages = prompt.format_messages(**{key: values[key] for key in variables if key in values})
+    return sum(count_tokens(message.content) for message in messages)
+
+class SpeculationStats:
+    """
+    What speculative retrieval gained and cost. Per request, `saved` is the
+    serial critical path (router, then the chosen retrieval) minus the wall
+    time of running the router and every retrieval at once; it is negative
+    when the overlap did not pay off. `wasted` is the time spent in
+    retrievals whose results were thrown away.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "saved_seconds": 0.0, "wasted_seconds": 0.0,
+                       "retrievals": 0, "wasted_retrievals": 0}
+
+    def record(self, router_seconds: float, retrieval_seconds: Dict[str, float], route: str, wall_seconds: float):
+        serial = router_seconds + retrieval_seconds.get(route, 0.0)
+        wasted = {name: seconds for name, seconds in retrieval_seconds.items() if name != route}
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["saved_seconds"] += serial - wall_seconds
+            self._stats["wasted_seconds"] += sum(wasted.values())
+            self._stats["retrievals"] += len(retrieval_seconds)
+            self._stats["wasted_retrievals"] += len(wasted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        requests = stats["requests"]
+        return {
+            **stats,
+            "avg_saved_ms": 1000 * stats["saved_seconds"] / requests if requests else 0.0,
+            "avg_wasted_ms": 1000 * stats["wasted_seconds"] / requests if requests else 0.0,
+            "wasted_retrieval_ratio": stats["wasted_retrievals"] / stats["retrievals"] if stats["retrievals"] else 0.0,
+        }
+
+# Reported by GET /stats when the master chain is built with speculative_retrieval
+speculation_stats = SpeculationStats()
+
+def stage_llm(llm, stage: str):
+    """The model for one stage (router, condense, answer, suggestions, summary) when `llm` has per-stage policies."""
+    return llm.for_stage(stage) if hasattr(llm, "for_stage") else llm
+
+def _timed(runnable):
+    """Wraps a runnable to return {"output": ..., "seconds": ...}."""
+    def invoke(x, config):
+        started = time.perf_counter()
+        output = runnable.invoke(x, config=config)
+        return {"output": output, "seconds": time.perf_counter() - started}
+
+    async def ainvoke(x, config):
+        started = time.perf_counter()
+        output = await runnable.ainvoke(x, config=config)
+        return {"output": output, "seconds": time.perf_counter() - started}
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+def with_ticket(runnable, acquire, name: str = "admitted"):
+    """
+    Wraps a runnable so each async run first awaits `acquire()` for a ticket
+    (an admission slot) and releases it when the run ends; abatch and
+    abatch_as_completed on the wrapper take one ticket per input.
+    """
+    async def ainvoke(x, config):
+        ticket = await acquire()
+        try:
+            return await runnable.ainvoke(x, config=config)
+        finally:
+            ticket.release()
+
+    return RunnableLambda(ainvoke, name=name)
+
+def create_rag_chain(llm, retriever, prompt, prefetched: Optional[str] = None):
+    """
+    Retrieval chain whose retrieved chunks are de-duplicated and packed into
+    the context token budget before they reach the prompt. Retrieval uses the
+    condensed `standalone_question` when there is one. With `prefetched`,
+    nothing is retrieved here: the documents are taken from
+    x["prefetched"][prefetched] (speculative retrieval). The output also
+    carries `prompt_tokens`, the size of the answer prompt.
+    """
+    if prefetched:
+        # Named so src.tracing counts the chosen route's documents only
+        documents = RunnableLambda(lambda x: x["prefetched"][prefetched], name="prefetched_retrieval")
+    else:
+        documents = ((lambda x: x.get("standalone_question") or x["input"])
+                     | retriever.with_config(run_name="retrieval"))
+    packed_retriever = documents | RunnableLambda(pack_context, name="pack_context")
+    qa_chain = create_stuff_documents_chain(llm, prompt)
+    return create_retrieval_chain(packed_retriever, qa_chain) | RunnablePassthrough.assign(
+        prompt_tokens=lambda x: count_prompt_tokens(prompt, x)
+    )
+
+def route(info: Dict[str, Any]) -> Literal["course_modules", "r_packages", "general_knowledge"]:
+    """The branch picked by the router's answer in info["topic"]."""
+    topic_str = info["topic"].content.lower()
+    if "course_modules" in topic_str:
+        return "course_modules"
+    if "r_packages" in topic_str:
+        return "r_packages"
+    return "general_knowledge"
+
+def create_master_chain(llm, retrievers, local_router=None, speculative_retrieval: bool = False):
     """
     Creates and returns the master hybrid chain and the suggestion chain.
     It now RECEIVES llm and retrievers as arguments.
+    An optional `local_router` (src.router.LocalRouter) answers the routing
+    step locally and only falls back to the LLM router when unsure.
+    The master chain takes {"input", "history"}: `history` is an optional
+    list of messages (see src.memory) that follow-up questions are condensed
+    against before routing and retrieval, and that the answer prompts see.
+    With `speculative_retrieval`, both knowledge bases are searched while the
+    router runs and the chosen branch uses its prefetched documents.
     """
     # A. The Router Chain
     router_prompt = PromptTemplate.from_template(
@@ -29,7 +149,31 @@ def create_master_chain(llm, retrievers):
         <question>{input}</question>
         Classification:"""
     )
-    router = router_prompt | llm
+    router = router_prompt | stage_llm(llm, "router")
+    if local_router is not None:
+        router = local_router.with_fallback(router)
+    # Run names mark the stages timed by src.tracing
+    router = router.with_config(run_name="router")
+
+    # A2. Follow-up questions are rewritten into standalone questions, so
+    # routing and retrieval work without the conversation.
+    condense_prompt = PromptTemplate.from_template(
+        """Given the conversation and a follow-up question, rephrase the follow-up question to be a standalone question that can be understood without the conversation.
+        Keep R package and function names exactly as written. Do not answer the question.
+
+        <conversation>{history}</conversation>
+        <question>{input}</question>
+        Standalone question:"""
+    )
+    condense_chain = {
+        "history": lambda x: get_buffer_string(x["history"], human_prefix="Student", ai_prefix="Tutor"),
+        "input": lambda x: x["input"],
+    } | condense_prompt | stage_llm(llm, "condense") | StrOutputParser()
+    condense_chain = condense_chain.with_config(run_name="condense")
+    standalone_question = RunnableBranch(
+        (lambda x: bool(x.get("history")), condense_chain),
+        RunnableLambda(lambda x: x["input"]),
+    )
 
     # B. RAG Chain for Course Modules
     course_rag_prompt = ChatPromptTemplate.from_messages([
@@ -39,11 +183,12 @@ def create_master_chain(llm, retrievers):
     - Break down complex topics into smaller, easy-to-understand segments.
     - Use code examples where helpful.
     - Base your answer strictly on the provided course material context."""),
+    MessagesPlaceholder("history", optional=True),
     ("human", "Here is the relevant course material:\n\n{context}\n\nMy question is: {input}"),
     ("ai", "Of course! I can help with that. Here is a step-by-step explanation based on your course material:")
 ])
-    course_qa_chain = create_stuff_documents_chain(llm, course_rag_prompt)
-    course_modules_rag_chain = create_retrieval_chain(retrievers["course_modules"], course_qa_chain)
+    course_modules_rag_chain = create_rag_chain(stage_llm(llm, "answer"), retrievers["course_modules"], course_rag_prompt,
+                                                prefetched="course_modules" if speculative_retrieval else None)
 
     # C. RAG Chain for R Packages
     package_rag_prompt = ChatPromptTemplate.from_messages([
@@ -53,12 +198,13 @@ def create_master_chain(llm, retrievers):
     - Break down complex topics into smaller, easy-to-understand segments.
     - Provide clear explanations of functions and their arguments.
     - Base your answer strictly on the provided R package manual context."""),
+    MessagesPlaceholder("history", optional=True),
     ("human", "Based on the R package documentation:\n\n{context}\n\nMy question is: {input}"),
     ("ai", "Absolutely! Let's break down that package information for you:")
     ])
 
-    package_qa_chain = create_stuff_documents_chain(llm, package_rag_prompt)
-    r_packages_rag_chain = create_retrieval_chain(retrievers["r_packages"], package_qa_chain)
+    r_packages_rag_chain = create_rag_chain(stage_llm(llm, "answer"), retrievers["r_packages"], package_rag_prompt,
+                                            prefetched="r_packages" if speculative_retrieval else None)
 
     # D. General Knowledge Chain
     general_prompt = ChatPromptTemplate.from_messages([
@@ -67,34 +213,91 @@ def create_master_chain(llm, retrievers):
     - Always be encouraging and friendly.
     - Give answers in clear segments to make them easy to follow.
     - Use simple analogies and code examples to clarify topics."""),
+    MessagesPlaceholder("history", optional=True),
     ("human", "{input}")
 ])
 
     # 2. Create the final chain by piping the new prompt to the llm
-    general_chain = general_prompt | llm
+    general_chain = general_prompt | stage_llm(llm, "answer")
 
     # E. Suggestion Chain
     suggestion_chain = PromptTemplate.from_template(
         "Based on the question and answer, suggest 3 follow-up questions.\nQUESTION: {input}\nANSWER: {answer}\nSUGGESTED NEXT QUESTIONS:"
-    ) | llm
+    ) | stage_llm(llm, "suggestions")
+    suggestion_chain = suggestion_chain.with_config(run_name="suggestions")
     
     # F. The Master Hybrid Chain
-    def route(info: Dict[str, Any]) -> Literal["course_modules", "r_packages", "general_knowledge"]:
-        topic_str = info["topic"].content.lower()
-        print(f"DEBUG ROUTER: Router classified as: '{topic_str}'")
-        if "course_modules" in topic_str: 
-            print(f"DEBUG ROUTER: Routing to course_modules")
-            return "course_modules"
-        if "r_packages" in topic_str: 
-            print(f"DEBUG ROUTER: Routing to r_packages")
-            return "r_packages"
-        print(f"DEBUG ROUTER: Routing to general_knowledge")
-        return "general_knowledge"
-
-    master_chain = {"topic": router, "input": lambda x: x["input"]} | RunnableBranch(
-        (lambda x: route(x) == "course_modules", course_modules_rag_chain),
-        (lambda x: route(x) == "r_packages", r_packages_rag_chain),
-        general_chain
+    # The branch that runs is named "answer" and carries its route (see src.tracing)
+    def answer(chain, route_name: str):
+        return chain.with_config(run_name="answer", metadata={"route": route_name})
+
+    routed = {
+        "topic": (lambda x: {"input": x["standalone_question"]}) | router,
+        "input": lambda x: x["input"],
+        "history": lambda x: x.get("history") or [],
+        "standalone_question": lambda x: x["standalone_question"],
+    }
+    if speculative_retrieval:
+        # The router and a retrieval per knowledge base run at the same time;
+        # only the chosen route's documents are used. The searches are timed
+        # as their own stage, so `retrieval` never includes discarded work.
+        def retrieve(kb_name: str):
+            return ((lambda x: x["standalone_question"])
+                    | retrievers[kb_name].with_config(run_name="speculative_retrieval"))
+
+        speculation = _timed(RunnableParallel(
+            routed=_timed(RunnableParallel(routed)),
+            **{kb_name: _timed(retrieve(kb_name)) for kb_name in ("course_modules", "r_packages")}
+        ))
+
+        def settle(x: Dict[str, Any]) -> Dict[str, Any]:
+            parallel = x["output"]
+            routed_input = parallel["routed"]["output"]
+            retrieval_seconds = {kb_name: parallel[kb_name]["seconds"] for kb_name in ("course_modules", "r_packages")}
+            speculation_stats.record(parallel["routed"]["seconds"], retrieval_seconds, route(routed_input), x["seconds"])
+            return {**routed_input,
+                    "prefetched": {kb_name: parallel[kb_name]["output"] for kb_name in ("course_modules", "r_packages")}}
+
+        routed = speculation | RunnableLambda(settle, name="settle_speculation")
+
+    master_chain = RunnablePassthrough.assign(standalone_question=standalone_question) | routed | RunnableBranch(
+        (lambda x: route(x) == "course_modules", answer(course_modules_rag_chain, "course_modules")),
+        (lambda x: route(x) == "r_packages", answer(r_packages_rag_chain, "r_packages")),
+        answer(general_chain, "general_knowledge")
     )
     
-    return master_chain, suggestion_chain
\ No newline at end of file
+    return master_chain, suggestion_chain
+
+def extract_answer(result) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Normalizes a master chain result into (answer, sources).
+    RAG branches return a dict with "answer" and "context"; the general
+    branch returns an AIMessage.
+    """
+    if isinstance(result, dict) and "answer" in result:
+        final_answer = result.get("answer", "Could not find a specific answer.")
+        sources = [doc.metadata for doc in result.get("context", [])]
+        return final_answer, sources
+    final_answer = result.content if hasattr(result, "content") else str(result)
+    return final_answer, []
+
+
+def prompt_tokens_of(result) -> Optional[int]:
+    """
+    Returns the answer prompt size of a master chain result: counted by the
+    RAG branches, or reported by the model for the general branch.
+    """
+    if isinstance(result, dict):
+        return result.get("prompt_tokens")
+    usage = getattr(result, "usage_metadata", None)
+    return usage.get("input_tokens") if usage else None
+
+
+def context_of(result) -> List[Any]:
+    """The documents a master chain result was answered from (none for the general branch)."""
+    return result.get("context", []) if isinstance(result, dict) else []
+
+
+def route_of(result) -> str:
+    """The branch a master chain result was answered by (RAG results carry the router's topic)."""
+    return route(result) if isinstance(result, dict) and "topic" in result else "general_knowledge"
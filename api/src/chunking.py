@@ -0,0 +1,175 @@
+# src/chunking.py
+import os
+import re
+from typing import List
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Bump when the chunking changes so ingestion re-indexes every file
+CHUNKING_VERSION = 1
+# Target size of a chunk; sections are merged up to it and split beyond it
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = 40
+# Tokens of retrieved context the packer puts into an answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Section headings of the R reference manuals (one per line in the PDF text)
+SECTION_HEADINGS = {
+    "Description", "Usage", "Arguments", "Details", "Value", "Examples", "See Also", "Note",
+    "References", "Format", "Source", "Methods", "Aesthetics", "Computed variables",
+    "Life cycle", "Lifecycle", "Facet specification", "Orientation", "Useful functions",
+}
+# Running page headers: "between 11" or "12 bind_rows"
+PAGE_HEADER_PATTERN = re.compile(r"^(\d+ \S+|\S+ \d+)$")
+# A topic heading ("mutate Create, modify, and delete columns") is the line
+# right before a "Description" heading and starts with an R name
+TOPIC_PATTERN = re.compile(r"^([A-Za-z.][\w.]*(?:-[\w.]+)*)\s+(.+)$")
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Counts tokens with the GPT-4o/embedding tokenizer, estimating when tiktoken is unavailable."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken unavailable ({e}); estimating 4 characters per token.")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def _splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS, length_function=count_tokens
+    )
+
+
+def _split_oversized(text: str) -> List[str]:
+    return [text] if count_tokens(text) <= CHUNK_TOKENS else _splitter().split_text(text)
+
+
+def chunk_manual(pages: List[Document]) -> List[Document]:
+    """
+    Splits the pages of one R package manual into function-reference chunks.
+    Each topic (e.g. `mutate`) is cut at its section headings (Description,
+    Usage, Arguments, ...); consecutive sections are merged up to
+    CHUNK_TOKENS and every chunk is prefixed with its topic heading so it
+    stands on its own. Pages outside any topic (covers, reference cards) are
+    split by size. Metadata comes from the page the chunk starts on.
+    """
+    # (line, page index) for the whole manual, without running page headers
+    lines = []
+    for page_index, page in enumerate(pages):
+        page_lines = page.page_content.splitlines()
+        if page_lines and PAGE_HEADER_PATTERN.match(page_lines[0].strip()):
+            page_lines = page_lines[1:]
+        lines.extend((line, page_index) for line in page_lines)
+
+    # Group the lines into blocks: (topic, section, [(line, page index)])
+    blocks, topic, section, current = [], None, None, []
+    for i, (line, page_index) in enumerate(lines):
+        stripped = line.strip()
+        next_line = lines[i + 1][0].strip() if i + 1 < len(lines) else ""
+        topic_match = TOPIC_PATTERN.match(stripped) if next_line == "Description" else None
+        if topic_match or stripped in SECTION_HEADINGS:
+            if current:
+                blocks.append((topic, section, current))
+            if topic_match:
+                topic, section = topic_match.group(1), None
+            else:
+                section = stripped
+            current = []
+        current.append((line, page_index))
+    if current:
+        blocks.append((topic, section, current))
+
+    chunks: List[Document] = []
+
+    def emit(topic_name, sections, block_lines):
+        text = "\n".join(line for line, _ in block_lines).strip()
+        if not text:
+            return
+        metadata = dict(pages[block_lines[0][1]].metadata)
+        if topic_name:
+            metadata["topic"] = topic_name
+            metadata["sections"] = ", ".join(s for s in sections if s)
+        for piece in _split_oversized(text):
+            if topic_name and not piece.startswith(topic_name):
+                piece = f"{topic_name} ({metadata['sections']})\n{piece}"
+            chunks.append(Document(page_content=piece, metadata=dict(metadata)))
+
+    # Merge consecutive sections of the same topic up to the chunk size
+    pending_topic, pending_sections, pending_lines, pending_tokens = None, [], [], 0
+    for topic_name, section_name, block_lines in blocks:
+        block_tokens = count_tokens("\n".join(line for line, _ in block_lines))
+        if pending_lines and (topic_name != pending_topic or pending_tokens + block_tokens > CHUNK_TOKENS):
+            emit(pending_topic, pending_sections, pending_lines)
+            pending_sections, pending_lines, pending_tokens = [], [], 0
+        pending_topic = topic_name
+        pending_sections.append(section_name)
+        pending_lines.extend(block_lines)
+        pending_tokens += block_tokens
+    if pending_lines:
+        emit(pending_topic, pending_sections, pending_lines)
+    return chunks
+
+
+def chunk_transcript(segments: List[Document]) -> List[Document]:
+    """
+    Transcript segments already are self-contained units with their own
+    timestamp, so they stay whole; only segments above CHUNK_TOKENS are split
+    (every piece keeps the segment's timestamp).
+    """
+    chunks = []
+    for segment in segments:
+        for piece in _split_oversized(segment.page_content):
+            chunks.append(Document(page_content=piece, metadata=dict(segment.metadata)))
+    return chunks
+
+
+def chunk_documents(kb_name: str, documents: List[Document]) -> List[Document]:
+    """Chunks the documents loaded from one source file of a knowledge base."""
+    if kb_name == "r_packages":
+        chunks = chunk_manual(documents)
+    elif kb_name == "course_modules":
+        chunks = chunk_transcript(documents)
+    else:
+        chunks = [Document(page_content=piece, metadata=dict(doc.metadata))
+                  for doc in documents for piece in _split_oversized(doc.page_content)]
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["chunk"] = i
+    return chunks
+
+
+# --- Context packing ---
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def pack_context(documents: List[Document], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 duplicate_threshold: float = 0.8) -> List[Document]:
+    """
+    Selects retrieved chunks for the prompt, in rank order: chunks whose word
+    3-gram Jaccard similarity with an already selected chunk reaches
+    `duplicate_threshold` are dropped, and chunks are added while they fit in
+    `token_budget`. The best chunk is always kept.
+    """
+    packed, kept_shingles, used = [], [], 0
+    for doc in documents:
+        shingles = _shingles(doc.page_content)
+        if any(len(shingles & other) / len(shingles | other) >= duplicate_threshold for other in kept_shingles):
+            continue
+        tokens = count_tokens(doc.page_content)
+        if packed and used + tokens > token_budget:
+            continue
+        packed.append(doc)
+        kept_shingles.append(shingles)
+        used += tokens
+    return packed
@@ -0,0 +1,101 @@
+# src/components.py
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+# Component states reported by /ready
+PENDING, BUILDING, READY, FAILED, DISABLED = "pending", "building", "ready", "failed", "disabled"
+
+
+class Component:
+    def __init__(self, name: str, factory: Callable[["Components"], Any], enabled: bool = True):
+        self.name = name
+        self.factory = factory
+        self.state = PENDING if enabled else DISABLED
+        self.value: Any = None
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.lock = threading.Lock()
+
+
+class Components:
+    """
+    Lazily built application components. Each factory receives the registry
+    (to `get` the components it depends on) and runs at most once, on first
+    use or from `warm` in a background thread, so the process can serve
+    requests that need none of them right away. A failed build is retried on
+    the next `get`.
+    """
+
+    def __init__(self):
+        self._components: "OrderedDict[str, Component]" = OrderedDict()
+        self._local = threading.local()
+        self.warm_seconds: Optional[float] = None
+
+    def add(self, name: str, factory: Callable[["Components"], Any], enabled: bool = True):
+        self._components[name] = Component(name, factory, enabled)
+
+    def get(self, name: str) -> Any:
+        """Returns the component, building it (and what it depends on) if needed. Blocking."""
+        component = self._components[name]
+        if component.state in (READY, DISABLED):
+            return component.value
+        with component.lock:
+            if component.state in (READY, DISABLED):
+                return component.value
+            component.state = BUILDING
+            # Time spent building dependencies is reported by those components
+            outer_nested = getattr(self._local, "nested", 0.0)
+            self._local.nested = 0.0
+            started = time.perf_counter()
+            try:
+                value = component.factory(self)
+            except Exception as e:
+                component.state, component.error = FAILED, f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                own_nested, self._local.nested = self._local.nested, outer_nested + elapsed
+            component.value, component.error = value, None
+            component.seconds = elapsed - own_nested
+            component.state = READY
+            return value
+
+    async def aget(self, name: str) -> Any:
+        """Async get; waits for a build in a worker thread instead of on the event loop."""
+        component = self._components[name]
+        if component.state in (READY, DISABLED):
+            return component.value
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, name)
+
+    def peek(self, name: str) -> Any:
+        """The component if it is ready, else None; never builds."""
+        component = self._components[name]
+        return component.value if component.state == READY else None
+
+    def warm(self, names: Optional[List[str]] = None) -> threading.Thread:
+        """Builds the components (default: all) in order in a background thread."""
+        def run():
+            started = time.perf_counter()
+            for name in names or list(self._components):
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"ERROR building component '{name}': {e}")
+            self.warm_seconds = time.perf_counter() - started
+            print(f"Components warmed in {self.warm_seconds:.2f}s: "
+                  + ", ".join(f"{c.name} {c.seconds:.2f}s" for c in self._components.values() if c.seconds is not None))
+        thread = threading.Thread(target=run, name="components-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def ready(self) -> bool:
+        return all(c.state in (READY, DISABLED) for c in self._components.values())
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            c.name: {"state": c.state, "seconds": c.seconds, **({"error": c.error} if c.error else {})}
+            for c in self._components.values()
+        }
@@ -1,12 +1,29 @@
 # src/config.py
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from src.embedding_cache import CachedEmbeddings
+from src.llm_client import ResilientChatModel, ResilientEmbeddings, shared_http_clients, stage_timeout
+
+EMBEDDING_MODEL = "text-embedding-3-large"
 
 def get_production_llm():
-    """Returns a configured production LLM."""
+    """
+    Returns a configured production LLM. Every stage of the chains gets its
+    own timeout and retry policy (src/llm_client.py) over one shared
+    connection pool; the OpenAI client's own retries are off.
+    """
     print("--- Creating Production LLM (GPT-4o) ---")
-    return ChatOpenAI(model="gpt-4o", temperature=0)
+    http_client, http_async_client = shared_http_clients()
+    return ResilientChatModel.create(lambda timeout: ChatOpenAI(
+        model="gpt-4o", temperature=0, timeout=timeout, max_retries=0,
+        http_client=http_client, http_async_client=http_async_client))
 
 def get_production_embeddings():
-    """Returns a configured production Embeddings model."""
+    """
+    Returns a configured production Embeddings model. Every embedding call
+    (ingestion and queries) goes through the persistent embedding cache.
+    """
     print("--- Creating Production Embeddings ---")
-    return OpenAIEmbeddings(model="text-embedding-3-large")
\ No newline at end of file
+    http_client, http_async_client = shared_http_clients()
+    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, timeout=stage_timeout("embedding"), max_retries=0,
+                                  http_client=http_client, http_async_client=http_async_client)
+    return CachedEmbeddings(ResilientEmbeddings(embeddings), model_name=EMBEDDING_MODEL)
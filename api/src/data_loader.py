@@ -1,9 +1,14 @@
 # src/data_loader.py
 import os
 import json
+import hashlib
+from typing import Dict, Any, List, Optional
 from langchain_core.documents import Document
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import PyPDFLoader, JSONLoader
+from src.chunking import CHUNKING_VERSION, chunk_documents
+from src.lexical import BM25Index, HybridRetriever
+from src.vector_index import NumpyVectorStore, export_numpy_index, read_index_header
 
 # --- THIS IS THE FIX ---
 # REMOVE the old, incorrect import:
@@ -12,62 +17,317 @@ from langchain_community.document_loaders import PyPDFLoader, JSONLoader
 VECTOR_STORE_ROOT = "./vector_stores"
 KNOWLEDGE_BASE_ROOT = "./knowledge_base"
 
+KNOWLEDGE_BASES = [
+    {"name": "r_packages", "loader_class": PyPDFLoader},
+    {"name": "course_modules", "loader_class": JSONLoader, "loader_kwargs": {"jq_schema": '.transcript_segments[]', "text_content": False}}
+]
+
+# Each store keeps a manifest of the source files it was built from
+MANIFEST_FILENAME = "manifest.json"
+# Chroma rejects very large upserts, so documents are added in batches
+ADD_BATCH_SIZE = 1000
+# Chunks retrieved per question; the context packer in chains.py trims them
+# to the prompt token budget
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "8"))
+# Fuse an in-memory BM25 index with the vector results (HYBRID_RETRIEVAL=false disables it)
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+# "chroma", or "numpy": the memory-mapped int8/float16 index that ingest.py
+# exports next to each Chroma store (src/vector_index.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "int8")
+
+def read_file(kb: Dict[str, Any], file_path: str) -> List[Document]:
+    """Loads a single knowledge base source file unchunked: PDF pages or transcript segments."""
+    if kb["loader_class"] == JSONLoader:
+        documents = []
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+            module_title = data.get("module_title", "Unknown Module")
+            for segment in data.get("transcript_segments", []):
+                metadata = {"source_module": module_title, "timestamp": segment.get("timestamp", "N/A")}
+                documents.append(Document(page_content=segment["content"], metadata=metadata))
+    else:
+        loader = kb["loader_class"](file_path)
+        documents = loader.load()
+    return documents
+
+def load_file(kb: Dict[str, Any], file_path: str) -> List[Document]:
+    """Loads a single knowledge base source file and splits it into chunks."""
+    return chunk_documents(kb["name"], read_file(kb, file_path))
+
+def hash_file(file_path: str) -> str:
+    """Returns the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_manifest(db_path: str) -> Optional[Dict[str, Any]]:
+    """Returns the store's manifest, or None for stores built before manifests existed."""
+    manifest_path = os.path.join(db_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def write_manifest(db_path: str, manifest: Dict[str, Any]):
+    """Writes the manifest atomically so a crash never leaves a half-written file."""
+    os.makedirs(db_path, exist_ok=True)
+    manifest_path = os.path.join(db_path, MANIFEST_FILENAME)
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def plan_changes(source_path: str, manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compares the source directory with the manifest. Size and mtime are
+    checked first; a file is only hashed when they differ, and counts as
+    changed only when its hash differs too.
+    Returns {"added": {name: hash}, "changed": {name: hash}, "removed": [names],
+    "touched": {name: hash}} where "touched" files only got a new mtime.
+    Every file counts as changed when the store was chunked by an older
+    CHUNKING_VERSION.
+    """
+    files = manifest.get("files", {})
+    plan = {"added": {}, "changed": {}, "removed": [], "touched": {}}
+    # Files chunked differently than today are re-indexed even if unchanged
+    rechunk = manifest.get("chunking_version") != CHUNKING_VERSION
+    current = set()
+    if os.path.isdir(source_path):
+        for filename in sorted(os.listdir(source_path)):
+            file_path = os.path.join(source_path, filename)
+            if not os.path.isfile(file_path):
+                continue
+            current.add(filename)
+            stat = os.stat(file_path)
+            entry = files.get(filename)
+            if not rechunk and entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                continue
+            file_hash = hash_file(file_path)
+            if entry is None:
+                plan["added"][filename] = file_hash
+            elif entry["sha256"] != file_hash or rechunk:
+                plan["changed"][filename] = file_hash
+            else:
+                plan["touched"][filename] = file_hash
+    plan["removed"] = sorted(set(files) - current)
+    return plan
+
+def delete_vectors(db, ids: List[str]):
+    """Deletes vectors from a Chroma store in batches."""
+    for start in range(0, len(ids), ADD_BATCH_SIZE):
+        db.delete(ids=ids[start:start + ADD_BATCH_SIZE])
+
+def add_documents(db, documents: List[Document], ids: List[str]):
+    """Adds documents to a Chroma store in batches."""
+    for start in range(0, len(documents), ADD_BATCH_SIZE):
+        db.add_documents(documents[start:start + ADD_BATCH_SIZE], ids=ids[start:start + ADD_BATCH_SIZE])
+
+def embedding_id(embeddings) -> str:
+    """Identifies the embedding model a store was built with."""
+    return getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None) or type(embeddings).__name__
+
+def open_manifest(db, kb_name: str, db_path: str) -> Dict[str, Any]:
+    """
+    Returns the store's manifest. Stores built before manifests existed are
+    emptied so they get re-indexed once: the ids of each file are unknown
+    (the embedding cache makes this cheap when the texts were embedded before).
+    Stores built with a different embedding model are reset: their vectors
+    are not comparable (and may not even have the same dimension).
+    """
+    manifest = read_manifest(db_path)
+    current = embedding_id(db.embeddings)
+    if manifest is not None and "embedding" not in manifest:
+        # Manifests older than this check: compare the vector dimension instead
+        stored = db.get(limit=1, include=["embeddings"])["embeddings"]
+        if stored is not None and len(stored) and len(stored[0]) != len(db.embeddings.embed_query("dimension")):
+            manifest["embedding"] = "unknown"
+    if manifest is not None and manifest.get("embedding", current) != current:
+        print(f"  Store for '{kb_name}' was built with '{manifest['embedding']}', not '{current}'; re-indexing it.")
+        db.reset_collection()
+        manifest = {"files": {}}
+    if manifest is None:
+        legacy_ids = db.get(include=[])["ids"]
+        if legacy_ids:
+            print(f"  Store for '{kb_name}' has no manifest; re-indexing it once.")
+            delete_vectors(db, legacy_ids)
+        manifest = {"files": {}}
+    return manifest
+
+def document_ids(file_hash: str, count: int) -> List[str]:
+    """Vector ids derive from the content hash so re-adding a file never collides."""
+    return [f"{file_hash[:16]}-{i}" for i in range(count)]
+
+def apply_plan(db, kb: Dict[str, Any], source_path: str, db_path: str, manifest: Dict[str, Any],
+               plan: Dict[str, Any], documents_by_file: Optional[Dict[str, List[Document]]] = None):
+    """
+    Applies a plan from plan_changes to a Chroma store and its manifest.
+    Files listed in `documents_by_file` are not loaded again (the ingestion
+    CLI parses them ahead of time in a process pool).
+    """
+    documents_by_file = documents_by_file or {}
+    files = manifest["files"]
+    manifest["chunking_version"] = CHUNKING_VERSION
+    manifest["embedding"] = embedding_id(db.embeddings)
+
+    stale_ids = []
+    for filename in plan["removed"] + list(plan["changed"]):
+        stale_ids.extend(files.pop(filename)["ids"])
+    if stale_ids:
+        print(f"  Deleting {len(stale_ids)} stale vector(s) from '{kb['name']}'.")
+        delete_vectors(db, stale_ids)
+
+    for filename, file_hash in {**plan["added"], **plan["changed"]}.items():
+        file_path = os.path.join(source_path, filename)
+        documents = documents_by_file.get(filename)
+        if documents is None:
+            print(f"  - Loading file: {filename}")
+            documents = load_file(kb, file_path)
+        ids = document_ids(file_hash, len(documents))
+        add_documents(db, documents, ids)
+        stat = os.stat(file_path)
+        files[filename] = {"sha256": file_hash, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "ids": ids}
+        # Persist after every file so an interrupted build resumes where it stopped
+        write_manifest(db_path, manifest)
+
+    for filename in plan["touched"]:
+        stat = os.stat(os.path.join(source_path, filename))
+        files[filename].update({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+
+    write_manifest(db_path, manifest)
+
+def has_changes(plan: Dict[str, Any]) -> bool:
+    return bool(plan["added"] or plan["changed"] or plan["removed"])
+
+def sync_vector_store(db, kb: Dict[str, Any], source_path: str, db_path: str) -> Dict[str, Any]:
+    """
+    Brings a Chroma store in line with its source directory: vectors of
+    removed or changed files are deleted and only added or changed files are
+    loaded and embedded. The cost grows with the size of the change, not the
+    size of the knowledge base. Returns the plan that was applied.
+    """
+    manifest = open_manifest(db, kb["name"], db_path)
+    plan = plan_changes(source_path, manifest)
+    apply_plan(db, kb, source_path, db_path, manifest, plan)
+    return plan
+
+def vector_store_path(kb_name: str, is_mock: bool = False) -> str:
+    """Returns the directory of a knowledge base's vector store."""
+    return os.path.join(VECTOR_STORE_ROOT, f"{kb_name}_db{'_mock' if is_mock else ''}")
+
+def numpy_index_path(kb_name: str, is_mock: bool = False) -> str:
+    """Returns the directory of a knowledge base's memory-mapped vector index."""
+    return os.path.join(VECTOR_STORE_ROOT, f"{kb_name}_npy{'_mock' if is_mock else ''}")
+
+def manifest_fingerprint(manifest: Dict[str, Any]) -> str:
+    """Identifies the content of one store: its vector ids, chunking and embedding model."""
+    digest = hashlib.sha256(f"{manifest.get('chunking_version')}|{manifest.get('embedding')}\n".encode())
+    for filename, entry in sorted(manifest.get("files", {}).items()):
+        digest.update(f"{filename}|{entry['sha256']}|{len(entry['ids'])}\n".encode())
+    return digest.hexdigest()[:16]
+
+def sync_numpy_index(db, kb_name: str, db_path: str, index_path: str, dtype: str = VECTOR_INDEX_DTYPE) -> bool:
+    """
+    Exports a Chroma store to its NumpyVectorStore unless the export is
+    already up to date with the store's manifest and dtype. Returns whether it exported.
+    """
+    source = manifest_fingerprint(read_manifest(db_path) or {"files": {}})
+    header = read_index_header(index_path)
+    if header is not None and header.get("source") == source and header.get("dtype") == dtype:
+        return False
+    index = export_numpy_index(db, index_path, source, embedding_id(db.embeddings), dtype)
+    print(f"  Exported {index['count']} vector(s) of '{kb_name}' to '{index_path}' ({dtype}).")
+    return True
+
+def knowledge_base_fingerprint(is_mock: bool = False) -> str:
+    """
+    Returns a short hash of the content the vector stores were built from,
+    read from their manifests. It changes whenever a store is rebuilt with
+    added, changed or removed source files, a new chunking or a new embedding
+    model (not when files are merely touched).
+    """
+    digest = hashlib.sha256()
+    for kb in KNOWLEDGE_BASES:
+        manifest = read_manifest(vector_store_path(kb["name"], is_mock)) or {"files": {}}
+        digest.update(f"{kb['name']}|{manifest_fingerprint(manifest)}\n".encode())
+    return digest.hexdigest()[:16]
+
+def build_retriever(db):
+    """
+    Returns the retriever for a loaded store: vector search alone, or fused
+    with a BM25 index built from the store's chunks when HYBRID_RETRIEVAL is on.
+    """
+    vector_retriever = db.as_retriever(search_kwargs={"k": RETRIEVER_K})
+    if not HYBRID_RETRIEVAL:
+        return vector_retriever
+    data = db.get(include=["documents", "metadatas"])
+    documents = [Document(id=doc_id, page_content=text, metadata=metadata or {})
+                 for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])]
+    index = BM25Index(documents)
+    print(f"  BM25 index: {len(documents)} chunk(s), {len(index.symbols)} R symbol(s).")
+    return HybridRetriever(vector_retriever=vector_retriever, index=index, vectorstore=db, k=RETRIEVER_K)
+
 # The function now RECEIVES embeddings and is_mock as arguments
-def get_retrievers(embeddings, is_mock=False):
+def get_retrievers(embeddings, is_mock=False, allow_build=None):
     """
-    Builds or loads vector databases for all knowledge sources
-    and returns a dictionary of configured retrievers.
+    Loads the vector databases for all knowledge sources and returns a
+    dictionary of configured retrievers.
+
+    The production API only loads stores prebuilt with `python ingest.py`
+    and never embeds documents at boot. With `allow_build` (the default in
+    mock mode) missing or outdated stores are indexed incrementally here.
     """
-    db_suffix = "_mock" if is_mock else ""
-    
-    knowledge_bases = [
-        {"name": "r_packages", "loader_class": PyPDFLoader},
-        {"name": "course_modules", "loader_class": JSONLoader, "loader_kwargs": {"jq_schema": '.transcript_segments[]', "text_content": False}}
-    ]
+    if allow_build is None:
+        allow_build = is_mock
 
     retrievers = {}
     print("Initializing all knowledge base retrievers...")
 
-    for kb in knowledge_bases:
+    for kb in KNOWLEDGE_BASES:
         kb_name = kb["name"]
         source_path = os.path.join(KNOWLEDGE_BASE_ROOT, kb_name)
-        db_path = os.path.join(VECTOR_STORE_ROOT, f"{kb_name}_db{db_suffix}")
-
-        if not os.path.exists(db_path):
-            print(f"Database for '{kb_name}' not found. Building...")
-            all_documents = []
-
-            if not os.path.exists(source_path) or not os.listdir(source_path):
-                 if is_mock:
-                    print(f"Mock mode: Creating dummy data for '{kb_name}'.")
-                    all_documents = [Document(page_content=f"This is a mock document for {kb_name}.")]
-                 else:
-                    raise FileNotFoundError(f"Source directory '{source_path}' is empty or missing.")
-            else:
-                for filename in os.listdir(source_path):
-                    file_path = os.path.join(source_path, filename)
-                    if os.path.isfile(file_path):
-                        print(f"  - Loading file: {filename}")
-                        loader_kwargs = kb.get("loader_kwargs", {})
-                        
-                        if kb["loader_class"] == JSONLoader:
-                             with open(file_path, 'r') as f:
-                                 data = json.load(f)
-                                 module_title = data.get("module_title", "Unknown Module")
-                                 for segment in data.get("transcript_segments", []):
-                                     metadata = {"source_module": module_title, "timestamp": segment.get("timestamp", "N/A")}
-                                     all_documents.append(Document(page_content=segment["content"], metadata=metadata))
-                        else:
-                            loader = kb["loader_class"](file_path)
-                            all_documents.extend(loader.load())
-
-            print(f"Creating embeddings for '{kb_name}' with {len(all_documents)} document(s)...")
-            db = Chroma.from_documents(documents=all_documents, embedding=embeddings, persist_directory=db_path)
+        db_path = vector_store_path(kb_name, is_mock)
+
+        if not allow_build:
+            manifest = read_manifest(db_path)
+            if manifest is None:
+                raise FileNotFoundError(
+                    f"Vector store '{db_path}' has not been built. Run `python ingest.py` before starting the API."
+                )
+            if has_changes(plan_changes(source_path, manifest)):
+                print(f"WARNING: '{source_path}' changed since '{db_path}' was built. Run `python ingest.py` to update it.")
+            if VECTOR_BACKEND == "numpy":
+                # Chroma is not even opened: the index only maps its files
+                index_path = numpy_index_path(kb_name, is_mock)
+                print(f"Loading vector index for '{kb_name}'...")
+                db = NumpyVectorStore.load(index_path, embeddings)
+                if db.source != manifest_fingerprint(manifest):
+                    print(f"WARNING: '{index_path}' is older than '{db_path}'. Run `python ingest.py` to update it.")
+                retrievers[kb_name] = build_retriever(db)
+                print(f"Retriever for '{kb_name}' is ready.")
+                continue
+            print(f"Loading prebuilt database for '{kb_name}'...")
+            db = Chroma(persist_directory=db_path, embedding_function=embeddings)
+        elif not os.path.exists(source_path) or not os.listdir(source_path):
+            if not is_mock:
+                raise FileNotFoundError(f"Source directory '{source_path}' is empty or missing.")
+            db = Chroma(persist_directory=db_path, embedding_function=embeddings)
+            if not db.get(include=[], limit=1)["ids"]:
+                print(f"Mock mode: Creating dummy data for '{kb_name}'.")
+                db.add_documents([Document(page_content=f"This is a mock document for {kb_name}.")], ids=["mock-0"])
         else:
-            print(f"Loading existing database for '{kb_name}'...")
+            print(f"Loading database for '{kb_name}'...")
             db = Chroma(persist_directory=db_path, embedding_function=embeddings)
-        
-        retrievers[kb_name] = db.as_retriever()
+            plan = sync_vector_store(db, kb, source_path, db_path)
+            print(f"  '{kb_name}': {len(plan['added'])} added, {len(plan['changed'])} changed, "
+                  f"{len(plan['removed'])} removed file(s).")
+
+        if allow_build and VECTOR_BACKEND == "numpy":
+            index_path = numpy_index_path(kb_name, is_mock)
+            sync_numpy_index(db, kb_name, db_path, index_path)
+            db = NumpyVectorStore.load(index_path, embeddings)
+        retrievers[kb_name] = build_retriever(db)
         print(f"Retriever for '{kb_name}' is ready.")
 
-    return retrievers
\ No newline at end of file
+    return retrievers
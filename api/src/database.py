@@ -1,61 +1,254 @@
 # backend/src/database.py
 
+import os
+import re
+import base64
 import sqlite3
 import json
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
-DATABASE_NAME = "chat_history.sqlite3"
+# Every query function is timed into chatbot_db_seconds (GET /metrics)
+from src.metrics import db_call
+
+DATABASE_NAME = os.getenv("DATABASE_PATH", "chat_history.sqlite3")
+# Page cache per connection, in KiB (SQLite takes negative values as KiB)
+DATABASE_CACHE_KIB = int(os.getenv("DATABASE_CACHE_KIB", "16384"))
+# How long a writer waits for another writer's lock before failing
+DATABASE_BUSY_TIMEOUT_MS = 5000
+# Search ranks only the most recent matches of a query, so a word found in
+# most messages costs the same as a rare one
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "2000"))
+
+# Connections are reused per thread (the FastAPI threadpool threads live for
+# the whole process) instead of being opened for every query.
+_local = threading.local()
 
 def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row  # This allows accessing columns by name
+    """Returns this thread's connection to the SQLite database, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_NAME, timeout=DATABASE_BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row  # This allows accessing columns by name
+        # WAL lets readers (history panel) run while a turn is being written;
+        # synchronous=NORMAL is durable across application crashes in WAL mode
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute(f"PRAGMA busy_timeout={DATABASE_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{DATABASE_CACHE_KIB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn = conn
     return conn
 
-def init_db():
-    """Initializes the database and creates tables if they don't exist."""
+@contextmanager
+def transaction():
+    """Runs the enclosed statements in one transaction on this thread's connection."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create a table for chat sessions
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS chats (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        timestamp TEXT NOT NULL
+    with conn:  # commits on success, rolls back on error
+        yield conn
+
+def close_connection():
+    """Closes this thread's connection (the next call opens a new one)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# --- Schema ---
+
+CREATE_CHATS = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+)
+"""
+
+CREATE_MESSAGES = """
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    type TEXT NOT NULL, -- 'user' or 'ai'
+    text TEXT NOT NULL,
+    sources TEXT, -- Store sources as a JSON string
+    timestamp TEXT NOT NULL,
+    FOREIGN KEY (chat_id) REFERENCES chats (id) ON DELETE CASCADE
+)
+"""
+
+CREATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_messages_chat_timestamp ON messages (chat_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_chats_timestamp ON chats (timestamp)",
+]
+
+def _migrate_cascade(conn):
+    """Rebuilds the messages table so deleting a chat deletes its messages."""
+    conn.execute(CREATE_MESSAGES.format(name="messages_new"))
+    # Messages of chats deleted before are dropped rather than carried over
+    conn.execute("""
+    INSERT INTO messages_new (id, chat_id, type, text, sources, timestamp)
+    SELECT id, chat_id, type, text, sources, timestamp FROM messages
+    WHERE chat_id IN (SELECT id FROM chats)
+    """)
+    conn.execute("DROP TABLE messages")
+    conn.execute("ALTER TABLE messages_new RENAME TO messages")
+
+def _migrate_indexes(conn):
+    for statement in CREATE_INDEXES:
+        conn.execute(statement)
+
+def _migrate_history_version(conn):
+    """
+    Adds a counter that triggers bump whenever a chat is created or deleted,
+    so the history list can be validated (ETag) without reading it.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS history_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL,
+        updated TEXT NOT NULL
     )
     """)
-    
-    # Create a table for individual messages, linked to a chat session
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chat_id INTEGER NOT NULL,
-        type TEXT NOT NULL, -- 'user' or 'ai'
-        text TEXT NOT NULL,
-        sources TEXT, -- Store sources as a JSON string
-        timestamp TEXT NOT NULL,
-        FOREIGN KEY (chat_id) REFERENCES chats (id)
+    conn.execute("INSERT OR IGNORE INTO history_version (id, version, updated) VALUES (1, 0, ?)",
+                 (datetime.now().isoformat(),))
+    for event in ("INSERT", "DELETE"):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS chats_{event.lower()}_version AFTER {event} ON chats
+        BEGIN
+            UPDATE history_version SET version = version + 1, updated = strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')
+            WHERE id = 1;
+        END
+        """)
+
+def _migrate_journal_state(conn):
+    """Adds the sequence number of the last message journal entry written to the database."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS journal_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_seq INTEGER NOT NULL
     )
     """)
-    
-    conn.commit()
-    conn.close()
+    conn.execute("INSERT OR IGNORE INTO journal_state (id, last_seq) VALUES (1, 0)")
+
+def _migrate_search_index(conn):
+    """
+    Adds the FTS5 full-text index over message texts. It is an external
+    content table (the texts are not stored twice), kept in sync by triggers
+    and backfilled from the existing messages.
+    """
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        text, content='messages', content_rowid='id', tokenize='porter unicode61'
+    )
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    """)
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+def _migrate_chat_summaries(conn):
+    """Adds the rolling summaries of older conversation turns (see src/memory.py)."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        chat_id INTEGER PRIMARY KEY,
+        summary TEXT NOT NULL,
+        covered_timestamp TEXT NOT NULL, -- (timestamp, id) of the last message folded in
+        covered_id INTEGER NOT NULL,
+        updated TEXT NOT NULL,
+        FOREIGN KEY (chat_id) REFERENCES chats (id) ON DELETE CASCADE
+    )
+    """)
+
+def _migrate_journal_sequences(conn):
+    """
+    Replaces the single journal sequence number with one per journal: every
+    process (uvicorn worker) writes its own journal file. The number of the
+    single journal of older versions is kept under the id ''.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS journal_sequences (
+        journal_id TEXT PRIMARY KEY,
+        last_seq INTEGER NOT NULL
+    )
+    """)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'journal_state'").fetchone():
+        conn.execute("INSERT OR IGNORE INTO journal_sequences (journal_id, last_seq) "
+                     "SELECT '', last_seq FROM journal_state WHERE id = 1")
+        conn.execute("DROP TABLE journal_state")
+
+# Applied in order to databases whose PRAGMA user_version is lower than the
+# migration's position (1-based); append new migrations, never reorder them.
+MIGRATIONS = [
+    _migrate_cascade,
+    _migrate_indexes,
+    _migrate_history_version,
+    _migrate_journal_state,
+    _migrate_search_index,
+    _migrate_chat_summaries,
+    _migrate_journal_sequences,
+]
+
+def init_db():
+    """Initializes the database, creating the tables or migrating an older schema."""
+    conn = get_db_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    has_tables = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages'"
+    ).fetchone() is not None
+
+    if not has_tables:
+        with conn:
+            conn.execute(CREATE_CHATS)
+            conn.execute(CREATE_MESSAGES.format(name="messages"))
+            _migrate_indexes(conn)
+            _migrate_history_version(conn)
+            _migrate_search_index(conn)
+            _migrate_chat_summaries(conn)
+            _migrate_journal_sequences(conn)
+            conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    elif version < len(MIGRATIONS):
+        # Table rebuilds must run with foreign key enforcement off
+        conn.execute("PRAGMA foreign_keys=OFF")
+        try:
+            with conn:
+                for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                    print(f"Migrating database to version {number} ({migration.__name__})...")
+                    migration(conn)
+                conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        finally:
+            conn.execute("PRAGMA foreign_keys=ON")
     print("Database initialized successfully.")
 
+# --- Queries ---
+
+@db_call
 def get_all_chats() -> List[Dict[str, Any]]:
     """Retrieves all chat sessions (without messages) for the history panel."""
     conn = get_db_connection()
     chats = conn.execute("SELECT id, title, timestamp FROM chats ORDER BY timestamp DESC").fetchall()
-    conn.close()
     return [dict(chat) for chat in chats]
 
+@db_call
 def get_messages_for_chat(chat_id: int) -> List[Dict[str, Any]]:
     """Retrieves all messages for a specific chat session."""
     conn = get_db_connection()
     messages = conn.execute("SELECT * FROM messages WHERE chat_id = ? ORDER BY timestamp ASC", (chat_id,)).fetchall()
-    conn.close()
     
     results = []
     for msg in messages:
@@ -66,20 +259,210 @@ def get_messages_for_chat(chat_id: int) -> List[Dict[str, Any]]:
         results.append(msg_dict)
     return results
 
-def add_message_to_chat(chat_id: Optional[int], message: Dict[str, Any]) -> int:
-    """Adds a new message to the database, creating a new chat if necessary."""
+# --- Pagination ---
+# Lists are paged with keyset cursors on (timestamp, id): a page costs the
+# same however deep it is, unlike OFFSET which reads all skipped rows.
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just past `row`."""
+    raw = json.dumps([row['timestamp'], row['id']]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return str(timestamp), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+@db_call
+def get_history_version() -> Tuple[int, str]:
+    """(version, time of last change) of the chat list; the version changes with every created or deleted chat."""
+    row = get_db_connection().execute("SELECT version, updated FROM history_version WHERE id = 1").fetchone()
+    return (row['version'], row['updated']) if row else (0, datetime.now().isoformat())
+
+@db_call
+def get_chats_page(limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Returns up to `limit` chats, newest first, starting after `cursor`, and the cursor of the next page."""
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    if cursor:
+        timestamp, chat_id = decode_cursor(cursor)
+        rows = conn.execute(
+            "SELECT id, title, timestamp FROM chats WHERE (timestamp, id) < (?, ?) "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?", (timestamp, chat_id, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, title, timestamp FROM chats ORDER BY timestamp DESC, id DESC LIMIT ?", (limit + 1,)
+        ).fetchall()
+    chats = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(chats[-1]) if len(rows) > limit else None
+    return chats, next_cursor
+
+@db_call
+def chat_exists(chat_id: int) -> bool:
+    """Whether a chat session exists (messages journaled for a missing chat are dropped)."""
+    return get_db_connection().execute("SELECT 1 FROM chats WHERE id = ?", (chat_id,)).fetchone() is not None
+
+@db_call
+def get_chat_version(chat_id: int) -> Optional[Dict[str, Any]]:
+    """Id and timestamp of the latest message of a chat (messages are never edited), or None."""
+    row = get_db_connection().execute(
+        "SELECT id, timestamp FROM messages WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1", (chat_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+@db_call
+def get_messages_page(chat_id: int, limit: int, cursor: Optional[str] = None,
+                      include_sources: bool = True) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Returns up to `limit` messages of a chat, oldest first, starting after `cursor`, and the next cursor."""
+    columns = "*" if include_sources else "id, chat_id, type, text, timestamp"
+    conn = get_db_connection()
+    if cursor:
+        timestamp, message_id = decode_cursor(cursor)
+        rows = conn.execute(
+            f"SELECT {columns} FROM messages WHERE chat_id = ? AND (timestamp, id) > (?, ?) "
+            "ORDER BY timestamp ASC, id ASC LIMIT ?", (chat_id, timestamp, message_id, limit + 1)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f"SELECT {columns} FROM messages WHERE chat_id = ? ORDER BY timestamp ASC, id ASC LIMIT ?",
+            (chat_id, limit + 1)
+        ).fetchall()
+    messages = []
+    for row in rows[:limit]:
+        msg_dict = dict(row)
+        if msg_dict.get('sources'):
+            msg_dict['sources'] = json.loads(msg_dict['sources'])
+        messages.append(msg_dict)
+    next_cursor = encode_cursor(messages[-1]) if len(rows) > limit else None
+    return messages, next_cursor
+
+# --- Conversation memory ---
+
+@db_call
+def get_recent_messages(chat_id: int, limit: int) -> List[Dict[str, Any]]:
+    """The last `limit` messages of a chat (without sources), oldest first."""
+    rows = get_db_connection().execute(
+        "SELECT id, type, text, timestamp FROM messages WHERE chat_id = ? "
+        "ORDER BY timestamp DESC, id DESC LIMIT ?", (chat_id, limit)
+    ).fetchall()
+    return [dict(row) for row in reversed(rows)]
+
+@db_call
+def get_chat_summary(chat_id: int) -> Optional[Dict[str, Any]]:
+    row = get_db_connection().execute(
+        "SELECT summary, covered_timestamp, covered_id FROM chat_summaries WHERE chat_id = ?", (chat_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+@db_call
+def get_messages_to_summarize(chat_id: int, covered: Optional[Tuple[str, int]], keep_recent: int,
+                              limit: int) -> List[Dict[str, Any]]:
+    """
+    Messages after `covered` (the last summarized message) and before the
+    `keep_recent` most recent ones, oldest first, at most `limit`.
+    """
+    conn = get_db_connection()
+    boundary = conn.execute(
+        "SELECT timestamp, id FROM messages WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?",
+        (chat_id, keep_recent - 1)
+    ).fetchone()
+    if boundary is None:
+        return []
+    covered_timestamp, covered_id = covered or ("", 0)
+    rows = conn.execute(
+        "SELECT id, type, text, timestamp FROM messages WHERE chat_id = ? "
+        "AND (timestamp, id) > (?, ?) AND (timestamp, id) < (?, ?) ORDER BY timestamp ASC, id ASC LIMIT ?",
+        (chat_id, covered_timestamp, covered_id, boundary['timestamp'], boundary['id'], limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+@db_call
+def save_chat_summary(chat_id: int, summary: str, covered: Tuple[str, int],
+                      previous_covered_id: Optional[int]) -> bool:
+    """
+    Stores a chat's summary unless another request updated it since it was
+    read (compare-and-set on covered_id). Returns whether it was stored.
+    """
+    with transaction() as conn:
+        cursor = conn.execute("""
+        INSERT INTO chat_summaries (chat_id, summary, covered_timestamp, covered_id, updated)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (chat_id) DO UPDATE SET
+            summary = excluded.summary, covered_timestamp = excluded.covered_timestamp,
+            covered_id = excluded.covered_id, updated = excluded.updated
+        WHERE chat_summaries.covered_id IS ?
+        """, (chat_id, summary, covered[0], covered[1], datetime.now().isoformat(), previous_covered_id))
+        return cursor.rowcount > 0
+
+# --- Search ---
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Turns free text into an FTS5 query in which every word must match. Words
+    are quoted, so characters like `(`, `-` or `"` in R code cannot break the
+    query syntax.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words)
+
+@db_call
+def search_messages(query: str, limit: int, offset: int = 0) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Ranked (BM25) full-text search over the SEARCH_RANK_WINDOW most recent
+    matching messages. Returns one result per message with its chat and a
+    snippet around the matched words (marked with [ and ]), and the offset
+    of the next page or None.
+    """
+    match = fts_query(query)
+    if match is None:
+        return [], None
+    conn = get_db_connection()
+    # Walking the matches newest first needs no ranking and stops early; the
+    # rowid bound then lets FTS5 rank only the window.
+    oldest = conn.execute(
+        "SELECT rowid FROM messages_fts WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+        (match, SEARCH_RANK_WINDOW - 1)
+    ).fetchone()
+    rows = conn.execute("""
+    SELECT m.id, m.chat_id, m.type, m.timestamp, c.title, c.timestamp AS chat_timestamp, f.snippet
+    FROM (
+        SELECT rowid, rank, snippet(messages_fts, 0, '[', ']', '...', 16) AS snippet
+        FROM messages_fts
+        WHERE messages_fts MATCH ? AND rowid >= ?
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ) f
+    JOIN messages m ON m.id = f.rowid
+    JOIN chats c ON c.id = m.chat_id
+    ORDER BY f.rank
+    """, (match, oldest[0] if oldest else 0, limit + 1, offset)).fetchall()
+    # Same shape the frontend's client-side search builds: the chat and its matching message
+    results = [{
+        "chat": {"id": row['chat_id'], "title": row['title'], "timestamp": row['chat_timestamp']},
+        "messages": [{"id": row['id'], "type": row['type'], "text": row['snippet'], "timestamp": row['timestamp']}],
+    } for row in rows[:limit]]
+    next_offset = offset + limit if len(rows) > limit else None
+    return results, next_offset
+
+def _chat_title(text: str) -> str:
+    return text[:50] + ('...' if len(text) > 50 else '')
+
+def _insert_message(conn, chat_id: Optional[int], message: Dict[str, Any]) -> int:
+    """Inserts one message on `conn`, creating the chat first when chat_id is empty."""
     # If it's the first message of a new chat
     if not chat_id:
-        chat_title = message['text'][:50] + ('...' if len(message['text']) > 50 else '')
-        cursor.execute("INSERT INTO chats (title, timestamp) VALUES (?, ?)", 
-                       (chat_title, datetime.now().isoformat()))
+        cursor = conn.execute("INSERT INTO chats (title, timestamp) VALUES (?, ?)",
+                              (_chat_title(message['text']), datetime.now().isoformat()))
         chat_id = cursor.lastrowid
     
     # Insert the message
-    cursor.execute("""
+    conn.execute("""
     INSERT INTO messages (chat_id, type, text, sources, timestamp)
     VALUES (?, ?, ?, ?, ?)
     """, (
@@ -89,24 +472,78 @@ def add_message_to_chat(chat_id: Optional[int], message: Dict[str, Any]) -> int:
         json.dumps(message.get('sources', [])), # Convert sources list to JSON string
         message['timestamp']
     ))
-    
-    conn.commit()
-    conn.close()
     return chat_id
 
+@db_call
+def add_message_to_chat(chat_id: Optional[int], message: Dict[str, Any]) -> int:
+    """Adds a new message to the database, creating a new chat if necessary."""
+    with transaction() as conn:
+        return _insert_message(conn, chat_id, message)
+
+@db_call
+def add_turn(chat_id: Optional[int], user_message: Dict[str, Any], ai_message: Dict[str, Any]) -> int:
+    """
+    Saves the user message and the AI answer of one turn in a single
+    transaction (creating the chat if necessary) and returns the chat id.
+    """
+    with transaction() as conn:
+        chat_id = _insert_message(conn, chat_id, user_message)
+        _insert_message(conn, chat_id, ai_message)
+    return chat_id
+
+@db_call
+def create_chat(first_message_text: str) -> int:
+    """Creates an empty chat titled after its first message and returns its id."""
+    with transaction() as conn:
+        cursor = conn.execute("INSERT INTO chats (title, timestamp) VALUES (?, ?)",
+                              (_chat_title(first_message_text), datetime.now().isoformat()))
+        return cursor.lastrowid
+
+@db_call
+def get_journal_seq(journal_id: str) -> int:
+    """Sequence number of the last entry of a message journal written to the database."""
+    row = get_db_connection().execute("SELECT last_seq FROM journal_sequences WHERE journal_id = ?",
+                                      (journal_id,)).fetchone()
+    return row['last_seq'] if row else 0
+
+@db_call
+def write_journal_entries(journal_id: str, entries: List[Dict[str, Any]]) -> List[int]:
+    """
+    Inserts the messages of a journal's entries ({"seq", "chat_id", "messages"})
+    and records its last seq, all in one transaction. An entry whose chat no
+    longer exists (deleted while the entry was queued) is skipped; the seqs
+    of skipped entries are returned.
+    """
+    skipped = []
+    with transaction() as conn:
+        # Explicit BEGIN: a SAVEPOINT outside a transaction would commit on release
+        conn.execute("BEGIN IMMEDIATE")
+        for entry in entries:
+            conn.execute("SAVEPOINT entry")
+            try:
+                for message in entry['messages']:
+                    _insert_message(conn, entry['chat_id'], message)
+                conn.execute("RELEASE SAVEPOINT entry")
+            except sqlite3.IntegrityError:
+                conn.execute("ROLLBACK TO SAVEPOINT entry")
+                conn.execute("RELEASE SAVEPOINT entry")
+                skipped.append(entry['seq'])
+        conn.execute("""
+        INSERT INTO journal_sequences (journal_id, last_seq) VALUES (?, ?)
+        ON CONFLICT (journal_id) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)
+        """, (journal_id, max(entry['seq'] for entry in entries)))
+    return skipped
+
+@db_call
+def forget_journal(journal_id: str):
+    """Drops the sequence number of a journal whose file was fully committed and removed."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM journal_sequences WHERE journal_id = ?", (journal_id,))
+
+@db_call
 def delete_chats(chat_ids: List[int]):
-    """Deletes specified chat sessions and their associated messages."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
+    """Deletes specified chat sessions; their messages go with them (ON DELETE CASCADE)."""
     # The '?' placeholder only works for single values, so we create a string of placeholders
     placeholders = ', '.join('?' for _ in chat_ids)
-    
-    # Delete associated messages first to maintain database integrity
-    cursor.execute(f"DELETE FROM messages WHERE chat_id IN ({placeholders})", chat_ids)
-    
-    # Then delete the chat sessions
-    cursor.execute(f"DELETE FROM chats WHERE id IN ({placeholders})", chat_ids)
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(f"DELETE FROM chats WHERE id IN ({placeholders})", chat_ids)
@@ -0,0 +1,179 @@
+# src/embedding_cache.py
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Kept outside vector_stores/ on purpose: wiping a store to rebuild it should
+# not throw away the embeddings it is about to need again.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+# Hot entries (mostly repeated queries) are also kept in memory
+MEMORY_CACHE_SIZE = int(os.getenv("EMBEDDING_MEMORY_CACHE_SIZE", "2048"))
+# SQLite limits the number of parameters in one statement
+LOOKUP_BATCH_SIZE = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache around an Embeddings model. Vectors are keyed by
+    (model name, SHA-256 of the text) and stored as raw float32 bytes in
+    SQLite, so rebuilding a vector store or repeating a query only pays for
+    text that was never embedded with this model before.
+
+    Queries share the document entries (for OpenAI models embed_query is the
+    same as embedding a single document); pass `query_namespace` for models
+    that embed queries differently.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, path: str = EMBEDDING_CACHE_PATH,
+                 query_namespace: Optional[str] = None, memory_size: int = MEMORY_CACHE_SIZE):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.path = path
+        self.query_model_name = f"{model_name}:{query_namespace}" if query_namespace else model_name
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._init_storage()
+
+    # --- Storage ---
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_storage(self):
+        conn = self._connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT NOT NULL,
+            text_hash BLOB NOT NULL, -- sha256 digest of the text
+            vector BLOB NOT NULL,    -- float32 bytes
+            PRIMARY KEY (model, text_hash)
+        ) WITHOUT ROWID
+        """)
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def _hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def _remember(self, key: tuple, vector: List[float]):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, model: str, hashes: List[bytes]) -> Dict[bytes, List[float]]:
+        """Returns the cached vectors for the given text hashes (memory first, then SQLite)."""
+        found, missing = {}, []
+        with self._lock:
+            for text_hash in hashes:
+                vector = self._memory.get((model, text_hash))
+                if vector is not None:
+                    self._memory.move_to_end((model, text_hash))
+                    found[text_hash] = vector
+                else:
+                    missing.append(text_hash)
+            self._stats["memory_hits"] += len(found)
+        if missing:
+            conn = self._connect()
+            for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+                batch = missing[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ', '.join('?' for _ in batch)
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                    found[text_hash] = vector
+                    self._remember((model, text_hash), vector)
+            conn.close()
+            with self._lock:
+                self._stats["disk_hits"] += len(found) - (len(hashes) - len(missing))
+        return found
+
+    def _store(self, model: str, items: Dict[bytes, List[float]]):
+        conn = self._connect()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(model, text_hash, np.asarray(vector, dtype=np.float32).tobytes()) for text_hash, vector in items.items()]
+        )
+        conn.commit()
+        conn.close()
+        for text_hash, vector in items.items():
+            self._remember((model, text_hash), vector)
+
+    def _plan(self, model: str, texts: List[str]):
+        """Hashes the texts and returns (hashes, cached vectors, unique texts still to embed)."""
+        hashes = [self._hash(text) for text in texts]
+        cached = self._lookup(model, list(dict.fromkeys(hashes)))
+        todo = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in todo:
+                todo[text_hash] = text
+        with self._lock:
+            self._stats["misses"] += len(todo)
+        return hashes, cached, todo
+
+    # --- Embeddings interface ---
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, cached, todo = self._plan(self.model_name, texts)
+        if todo:
+            vectors = self.underlying.embed_documents(list(todo.values()))
+            fresh = dict(zip(todo.keys(), vectors))
+            self._store(self.model_name, fresh)
+            cached.update(fresh)
+        return [cached[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        hashes, cached, todo = self._plan(self.query_model_name, [text])
+        if todo:
+            vector = self.underlying.embed_query(text)
+            self._store(self.query_model_name, {hashes[0]: vector})
+            return vector
+        return cached[hashes[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        hashes, cached, todo = await loop.run_in_executor(None, self._plan, self.model_name, texts)
+        if todo:
+            vectors = await self.underlying.aembed_documents(list(todo.values()))
+            fresh = dict(zip(todo.keys(), vectors))
+            await loop.run_in_executor(None, self._store, self.model_name, fresh)
+            cached.update(fresh)
+        return [cached[text_hash] for text_hash in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        text_hash = self._hash(text)
+        with self._lock:
+            vector = self._memory.get((self.query_model_name, text_hash))
+            if vector is not None:
+                # Repeated queries are answered without leaving the event loop
+                self._memory.move_to_end((self.query_model_name, text_hash))
+                self._stats["memory_hits"] += 1
+                return vector
+        loop = asyncio.get_running_loop()
+        hashes, cached, todo = await loop.run_in_executor(None, self._plan, self.query_model_name, [text])
+        if todo:
+            vector = await self.underlying.aembed_query(text)
+            await loop.run_in_executor(None, self._store, self.query_model_name, {text_hash: vector})
+            return vector
+        return cached[text_hash]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
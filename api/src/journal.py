@@ -0,0 +1,302 @@
+# src/journal.py
+import os
+import glob
+import json
+import time
+import uuid
+import queue
+import asyncio
+import threading
+from typing import Dict, Any, List, Optional
+
+from src import database
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory file locks, run a single worker
+    fcntl = None
+
+# Each process appends to its own file next to this path (chat_journal.<id>.jsonl)
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "chat_journal.jsonl")
+# Entries waiting for the writer; appends wait (backpressure) when it is full
+JOURNAL_MAX_QUEUE = int(os.getenv("JOURNAL_MAX_QUEUE", "10000"))
+# Entries written per transaction at most
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "256"))
+# How long the writer waits for more entries before committing a batch
+JOURNAL_LINGER_SECONDS = float(os.getenv("JOURNAL_LINGER_MS", "5")) / 1000
+# fsync every append (survives power loss, not just a crash of the process)
+JOURNAL_FSYNC = os.getenv("JOURNAL_FSYNC", "false").lower() == "true"
+# Longest wait between retries of a batch the database keeps refusing
+JOURNAL_MAX_RETRY_SECONDS = 30
+
+_STOP = object()
+
+
+def _try_lock(f) -> bool:
+    """Locks an open journal file for this process; False while another live process holds it."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class JournalFull(Exception):
+    """The queue is full: the writer is behind, or the database keeps refusing its batches."""
+
+
+class MessageJournal:
+    """
+    Write-behind journal for chat messages. `append` writes the entry to an
+    append-only file and queues it; a single writer thread commits queued
+    entries to SQLite in batches (group commit) together with the sequence
+    number of the last entry. Every process writes its own file, locked
+    while it runs, with its own sequence numbers. `start` replays the
+    entries of unlocked files (processes that crashed) above their committed
+    sequence number, then removes those files.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH, max_queue: int = JOURNAL_MAX_QUEUE,
+                 batch_size: int = JOURNAL_BATCH_SIZE, linger_seconds: float = JOURNAL_LINGER_SECONDS):
+        self.base_path = path
+        self.path: Optional[str] = None
+        self.journal_id: Optional[str] = None
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        # Unbounded so an append never blocks while it holds the append lock;
+        # `_slots` bounds the entries queued or being written
+        self._queue: "queue.Queue" = queue.Queue()
+        self._slots = threading.Semaphore(max_queue)
+        self._append_lock = threading.Lock()
+        self._committed = threading.Condition()
+        self._file = None
+        self._thread: Optional[threading.Thread] = None
+        self._last_seq = 0
+        self._committed_seq = 0
+        # chat id -> seq of its last entry, until that entry is committed
+        self._chat_seqs: Dict[int, int] = {}
+        # Error of the batch the writer is retrying; None while writes succeed
+        self._write_error: Optional[str] = None
+        self._stats = {"entries": 0, "batches": 0, "replayed": 0, "skipped": 0, "write_errors": 0,
+                       "flush_seconds": 0.0, "max_flush_seconds": 0.0}
+
+    # --- Lifecycle ---
+    def _journal_path(self, journal_id: str) -> str:
+        root, ext = os.path.splitext(self.base_path)
+        return f"{root}.{journal_id}{ext}" if journal_id else self.base_path
+
+    def start(self):
+        """Opens this process's journal, replays those of stopped processes and starts the writer thread."""
+        self.journal_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.path = self._journal_path(self.journal_id)
+        # Locked under a name no other process looks at, so it is never taken for a crashed one
+        self._file = open(self.path + ".new", "w", encoding="utf-8")
+        _try_lock(self._file)
+        os.replace(self.path + ".new", self.path)
+        self._replay_stopped()
+        self._thread = threading.Thread(target=self._run, name="message-journal", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Flushes every queued entry, stops the writer and removes the committed journal."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        if self._committed_seq == self._last_seq:
+            os.remove(self.path)
+            database.forget_journal(self.journal_id)
+
+    def _replay_stopped(self):
+        """Commits the entries other processes journaled but did not commit before they stopped."""
+        root, ext = os.path.splitext(self.base_path)
+        for path in [self.base_path] + sorted(glob.glob(f"{glob.escape(root)}.*{ext}")):
+            if path == self.path:
+                continue
+            journal_id = path[len(root) + 1:len(path) - len(ext)] if path != self.base_path else ""
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with f:
+                # Held by a live process, or replayed and removed by another one since we opened it
+                if not _try_lock(f) or not os.path.exists(path) or \
+                        os.stat(path).st_ino != os.fstat(f.fileno()).st_ino:
+                    continue
+                pending = self._read_pending(f, database.get_journal_seq(journal_id))
+                if pending:
+                    print(f"Replaying {len(pending)} entries of journal '{path}'...")
+                    for start in range(0, len(pending), self.batch_size):
+                        self._store(journal_id, pending[start:start + self.batch_size])
+                    self._stats["replayed"] += len(pending)
+                os.remove(path)
+            database.forget_journal(journal_id)
+
+    @staticmethod
+    def _read_pending(f, committed_seq: int) -> List[Dict[str, Any]]:
+        pending = []
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break  # torn last line of a crashed append
+            if entry["seq"] > committed_seq:
+                pending.append(entry)
+        return pending
+
+    # --- Producers ---
+    def _append(self, chat_id: int, messages: List[Dict[str, Any]]) -> int:
+        """Journals an entry for which a queue slot was acquired."""
+        try:
+            with self._append_lock:
+                self._last_seq += 1
+                entry = {"seq": self._last_seq, "chat_id": chat_id, "messages": messages}
+                self._file.write(json.dumps(entry) + "\n")
+                self._file.flush()
+                if JOURNAL_FSYNC:
+                    os.fsync(self._file.fileno())
+                self._chat_seqs[chat_id] = entry["seq"]
+                # Inside the lock so the queue order is the sequence order
+                self._queue.put((entry, time.perf_counter()))
+        except BaseException:
+            self._slots.release()
+            raise
+        return entry["seq"]
+
+    def append(self, chat_id: int, messages: List[Dict[str, Any]]) -> int:
+        """
+        Journals messages of an existing chat (saved together, in order) and
+        returns the entry's sequence number. Blocks only while the queue is full.
+        """
+        self._slots.acquire()
+        return self._append(chat_id, messages)
+
+    async def aappend(self, chat_id: int, messages: List[Dict[str, Any]]) -> int:
+        """
+        Async variant of append; the file write runs off the event loop.
+        Raises JournalFull instead of waiting when the queue is full, so
+        requests never tie up executor threads behind a stuck writer.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JournalFull(self._write_error or "journal queue is full")
+        return await asyncio.get_running_loop().run_in_executor(None, self._append, chat_id, messages)
+
+    def healthy(self) -> bool:
+        """False while the writer is retrying a batch the database refused."""
+        return self._write_error is None
+
+    def wait_chat_committed(self, chat_id: int, timeout: float = 5.0) -> bool:
+        """Waits until every entry journaled for one chat is in the database."""
+        with self._append_lock:
+            seq = self._chat_seqs.get(chat_id)
+        return seq is None or self.wait_committed(seq, timeout)
+
+    def wait_committed(self, seq: Optional[int] = None, timeout: float = 5.0) -> bool:
+        """Waits until entry `seq` (default: every entry appended so far) is in the database."""
+        target = self._last_seq if seq is None else seq
+        with self._committed:
+            return self._committed.wait_for(lambda: self._committed_seq >= target, timeout=timeout)
+
+    # --- Writer ---
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.perf_counter() + self.linger_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+        # Drain whatever was queued behind the stop marker
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        if rest:
+            self._flush(rest)
+
+    def _flush(self, batch):
+        entries = [entry for entry, _ in batch]
+        retries = 0
+        while True:
+            try:
+                self._write(entries)
+                break
+            except Exception as e:
+                # Keep the order: retry the same batch rather than skipping past it.
+                # The entries are safe in the file; /ready reports the journal
+                # unhealthy and appends fail fast once the queue fills up.
+                delay = min(2 ** retries, JOURNAL_MAX_RETRY_SECONDS)
+                print(f"ERROR writing journal batch (seq {entries[0]['seq']}-{entries[-1]['seq']}), "
+                      f"retrying in {delay}s: {e}")
+                self._write_error = f"{type(e).__name__}: {e}"
+                self._stats["write_errors"] += 1
+                retries += 1
+                time.sleep(delay)
+        if self._write_error is not None:
+            print("Journal writes recovered.")
+            self._write_error = None
+        for _ in batch:
+            self._slots.release()
+        now = time.perf_counter()
+        latency = max(now - queued_at for _, queued_at in batch)
+        self._stats["batches"] += 1
+        self._stats["entries"] += len(entries)
+        self._stats["flush_seconds"] += latency
+        self._stats["max_flush_seconds"] = max(self._stats["max_flush_seconds"], latency)
+        self._truncate_if_idle()
+
+    def _store(self, journal_id: str, entries: List[Dict[str, Any]]):
+        skipped = database.write_journal_entries(journal_id, entries)
+        if skipped:
+            print(f"Skipped journal entries of deleted chats: {skipped}")
+            self._stats["skipped"] += len(skipped)
+
+    def _write(self, entries: List[Dict[str, Any]]):
+        self._store(self.journal_id, entries)
+        with self._append_lock:
+            for entry in entries:
+                if self._chat_seqs.get(entry["chat_id"]) == entry["seq"]:
+                    del self._chat_seqs[entry["chat_id"]]
+        with self._committed:
+            self._committed_seq = entries[-1]["seq"]
+            self._committed.notify_all()
+
+    def _truncate_if_idle(self):
+        """Empties the journal file once everything in it is committed."""
+        with self._append_lock:
+            if self._committed_seq == self._last_seq and self._file is not None:
+                self._file.seek(0)
+                self._file.truncate()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        batches = stats.pop("batches")
+        flush_seconds = stats.pop("flush_seconds")
+        return {
+            "journal_id": self.journal_id,
+            "healthy": self._write_error is None,
+            "write_error": self._write_error,
+            "queue_depth": self._queue.qsize(),
+            "last_seq": self._last_seq,
+            "committed_seq": self._committed_seq,
+            "batches": batches,
+            "avg_batch_size": stats["entries"] / batches if batches else 0.0,
+            "avg_flush_latency_ms": 1000 * flush_seconds / batches if batches else 0.0,
+            "max_flush_latency_ms": 1000 * stats.pop("max_flush_seconds"),
+            **stats,
+        }
@@ -0,0 +1,184 @@
+# src/lexical.py
+import math
+import re
+import time
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Any, List, Optional, Set, Tuple
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# R identifiers (pivot_longer, as.numeric, geom_bar) and infix operators (%>%, %in%)
+TOKEN_PATTERN = re.compile(r"%[^%\s]+%|[a-z][a-z0-9_.]*[a-z0-9_]|[a-z0-9]+")
+CALL_PATTERN = re.compile(r"([A-Za-z][A-Za-z0-9_.]*)\(")
+BACKTICK_PATTERN = re.compile(r"`([A-Za-z][A-Za-z0-9_.]*)(?:\(\))?`")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased terms for the inverted index. Compound identifiers are kept
+    whole and also split into their parts, so `pivot_longer` matches both
+    the exact symbol and questions about "pivot" or "longer".
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        if ("_" in token or "." in token) and not token.startswith("%"):
+            terms.extend(part for part in re.split(r"[_.]", token) if part)
+    return terms
+
+
+def is_symbol(term: str) -> bool:
+    """
+    Whether a term is distinctive enough to be an R symbol on its own. A
+    compound needs a part longer than one letter, which rules out
+    abbreviations such as e.g and i.e but keeps t.test.
+    """
+    if term.startswith("%"):
+        return True
+    parts = [part for part in re.split(r"[_.]", term) if part]
+    return len(parts) > 1 and any(len(part) > 1 for part in parts)
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over the chunks of one vector store."""
+
+    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = documents
+        self.k1, self.b = k1, b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+        # R symbols that appear in the documents: compound identifiers and
+        # names written as calls (`filter(`) or as reference topics
+        self.symbols: Set[str] = set()
+        self.topics: Set[str] = set()
+        for doc_index, doc in enumerate(documents):
+            terms = tokenize(doc.page_content)
+            self.lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                self.postings[term].append((doc_index, frequency))
+                if is_symbol(term):
+                    self.symbols.add(term)
+            self.symbols.update(name.lower() for name in CALL_PATTERN.findall(doc.page_content))
+            topic = doc.metadata.get("topic")
+            if topic:
+                self.topics.add(topic.lower())
+        self.symbols |= self.topics
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        count = len(documents)
+        self.idf = {term: math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for term, posting in self.postings.items()}
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Returns up to k (document index, score) pairs, best first."""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_index, frequency in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.lengths[doc_index] / (self.average_length or 1)
+                scores[doc_index] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def exact_symbols(self, query: str) -> Set[str]:
+        """
+        R symbols named in the query that exist in the indexed documents:
+        names written as calls (`mutate(`) or in backticks, and bare
+        identifiers that are a reference topic (pivot_longer).
+        """
+        marked = {name.lower() for name in CALL_PATTERN.findall(query)}
+        marked.update(name.lower() for name in BACKTICK_PATTERN.findall(query))
+        bare = {term for term in TOKEN_PATTERN.findall(query.lower()) if is_symbol(term)}
+        return (marked & self.symbols) | (bare & self.topics)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses BM25 and vector results with reciprocal rank fusion. When the
+    question names an R symbol that exists in the index (`mutate()`,
+    pivot_longer, geom_bar) only the lexical index is searched, which also
+    skips the query-embedding call; chunks whose reference topic is that
+    symbol are ranked first.
+    """
+
+    vector_retriever: BaseRetriever
+    index: Any
+    # Exposed like VectorStoreRetriever.vectorstore for code that reads the store
+    vectorstore: Any = None
+    k: int = 8
+    rrf_k: int = 60
+    lexical_fast_path: bool = True
+    stats_state: Dict[str, Any] = {}
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stats_state = {"lock": threading.Lock(), "fast_path": 0, "hybrid": 0, "seconds": 0.0}
+
+    def _fast_path(self, query: str) -> Optional[List[Document]]:
+        if not self.lexical_fast_path:
+            return None
+        symbols = self.index.exact_symbols(query)
+        if not symbols:
+            return None
+        hits = self.index.search(query, self.k * 4)
+        if not hits:
+            return None
+        documents = self.index.documents
+        # Stable sort: chunks documenting the symbol first, BM25 order otherwise
+        ranked = sorted(hits, key=lambda hit: (documents[hit[0]].metadata.get("topic", "").lower() not in symbols))
+        return [documents[doc_index] for doc_index, _ in ranked[:self.k]]
+
+    def _fuse(self, query: str, vector_documents: List[Document]) -> List[Document]:
+        scores: Dict[str, float] = defaultdict(float)
+        by_key: Dict[str, Document] = {}
+        for rank, doc in enumerate(vector_documents):
+            key = doc.id or doc.page_content
+            by_key.setdefault(key, doc)
+            scores[key] += 1 / (self.rrf_k + rank + 1)
+        for rank, (doc_index, _) in enumerate(self.index.search(query, self.k)):
+            doc = self.index.documents[doc_index]
+            key = doc.id or doc.page_content
+            by_key.setdefault(key, doc)
+            scores[key] += 1 / (self.rrf_k + rank + 1)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [by_key[key] for key in ranked[:self.k]]
+
+    def _record(self, path: str, started: float):
+        with self.stats_state["lock"]:
+            self.stats_state[path] += 1
+            self.stats_state["seconds"] += time.perf_counter() - started
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        started = time.perf_counter()
+        documents = self._fast_path(query)
+        if documents is not None:
+            self._record("fast_path", started)
+            return documents
+        vector_documents = self.vector_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        documents = self._fuse(query, vector_documents)
+        self._record("hybrid", started)
+        return documents
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        started = time.perf_counter()
+        documents = self._fast_path(query)
+        if documents is not None:
+            self._record("fast_path", started)
+            return documents
+        vector_documents = await self.vector_retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        documents = self._fuse(query, vector_documents)
+        self._record("hybrid", started)
+        return documents
+
+    def stats(self) -> Dict[str, Any]:
+        with self.stats_state["lock"]:
+            fast_path, hybrid, seconds = (self.stats_state[key] for key in ("fast_path", "hybrid", "seconds"))
+        total = fast_path + hybrid
+        return {
+            "fast_path": fast_path,
+            "hybrid": hybrid,
+            "fast_path_rate": fast_path / total if total else 0.0,
+            "avg_latency_ms": 1000 * seconds / total if total else 0.0,
+        }
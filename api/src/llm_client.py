@@ -0,0 +1,338 @@
+# src/llm_client.py
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+import httpx
+import openai
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+# --- Shared connection pool ---
+# One keep-alive pool (sync and async) for every chat model and embeddings
+# client, so the TLS connections to the API are reused across stages
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+
+# --- Per-stage policy ---
+# Seconds one attempt of a stage may take (LLM_TIMEOUT_<STAGE> overrides)
+STAGE_TIMEOUTS = {"router": 10.0, "condense": 15.0, "answer": 60.0, "suggestions": 20.0, "summary": 30.0,
+                  "embedding": 20.0}
+# Retries after the first attempt, on timeouts, connection errors, 408/409/429 and 5xx
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Full-jitter exponential backoff: a random wait up to min(max, base * 2^retry)
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+# Hedged requests: when an attempt is slower than the stage's LLM_HEDGE_PERCENTILE
+# latency, a second one is sent and the first answer wins. Only short calls are
+# hedged (not the streamed answer), and at most LLM_HEDGE_MAX_RATE of the calls.
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+LLM_HEDGE_STAGES = set(os.getenv("LLM_HEDGE_STAGES", "router,condense,suggestions,embedding").split(","))
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+# Successful calls a stage needs before its percentile is trusted
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+RETRYABLE_STATUS = {408, 409, 429}
+
+_pool_lock = threading.Lock()
+_http_clients: Optional[tuple] = None
+# name -> StagePolicy, for GET /stats
+_policies: Dict[str, "StagePolicy"] = {}
+
+
+def stage_timeout(stage: str) -> float:
+    return float(os.getenv(f"LLM_TIMEOUT_{stage.upper()}", STAGE_TIMEOUTS[stage]))
+
+
+def shared_http_clients() -> tuple:
+    """(httpx.Client, httpx.AsyncClient) over the shared keep-alive pool, created on first use."""
+    global _http_clients
+    with _pool_lock:
+        if _http_clients is None:
+            limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                  max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                                  keepalive_expiry=LLM_KEEPALIVE_SECONDS)
+            # Each request still gets its stage's timeout from the OpenAI client
+            timeout = httpx.Timeout(60.0, connect=LLM_CONNECT_TIMEOUT)
+            _http_clients = (httpx.Client(limits=limits, timeout=timeout),
+                             httpx.AsyncClient(limits=limits, timeout=timeout))
+        return _http_clients
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    return isinstance(error, (openai.APIConnectionError, httpx.TransportError, asyncio.TimeoutError))
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class StagePolicy:
+    """Retries, backoff and hedging of one stage, with its latency window and counters."""
+
+    def __init__(self, stage: str, max_retries: int = LLM_MAX_RETRIES, hedging: bool = LLM_HEDGING,
+                 name: Optional[str] = None):
+        self.stage = stage
+        self.name = name or stage
+        self.timeout = stage_timeout(stage)
+        self.max_retries = max_retries
+        self.hedging = hedging and stage in LLM_HEDGE_STAGES
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0, "timeouts": 0,
+                       "hedged": 0, "hedge_wins": 0}
+        _policies[self.name] = self
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)]
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging this call, or None to not hedge it."""
+        if not self.hedging:
+            return None
+        with self._lock:
+            if self._stats["hedged"] >= LLM_HEDGE_MAX_RATE * max(self._stats["calls"], 1):
+                return None
+        return self.percentile(LLM_HEDGE_PERCENTILE)
+
+    def backoff(self, retry: int, error: BaseException) -> Optional[float]:
+        """Seconds before retry number `retry` (0-based), or None when the error should not be retried."""
+        if retry >= self.max_retries or not is_retryable(error):
+            return None
+        delay = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** retry))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            if retry_after > LLM_RETRY_MAX_SECONDS:
+                # Longer than we hold a request; let admission control shed instead
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def _failed(self, error: BaseException):
+        if isinstance(error, (openai.APITimeoutError, httpx.TimeoutException, asyncio.TimeoutError)):
+            self._count("timeouts")
+
+    async def _attempt(self, make_call: Callable[[], Awaitable[Any]], hedge: bool) -> Any:
+        """One attempt, hedged by a second one when it is slower than the stage's percentile."""
+        delay = self.hedge_delay() if hedge else None
+        started = time.perf_counter()
+        self._count("attempts")
+        if delay is None:
+            result = await make_call()
+            self._observe(time.perf_counter() - started)
+            return result
+        first, second = asyncio.ensure_future(make_call()), None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                result = first.result()
+                self._observe(time.perf_counter() - started)
+                return result
+            self._count("hedged")
+            self._count("attempts")
+            second = asyncio.ensure_future(make_call())
+            pending, error = {first, second}, None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedge_wins")
+                        self._observe(time.perf_counter() - started)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in (first, second):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def acall(self, make_call: Callable[[], Awaitable[Any]], hedge: bool = True) -> Any:
+        """Runs `make_call()` with this stage's retries, and its hedging unless `hedge` is False."""
+        self._count("calls")
+        retry = 0
+        while True:
+            try:
+                return await self._attempt(make_call, hedge)
+            except Exception as e:
+                self._failed(e)
+                delay = self.backoff(retry, e)
+                if delay is None:
+                    self._count("failures")
+                    raise
+                print(f"LLM {self.stage} attempt failed ({type(e).__name__}: {e}); retrying in {delay:.2f}s")
+                self._count("retries")
+                retry += 1
+                await asyncio.sleep(delay)
+
+    def call(self, make_call: Callable[[], Any]) -> Any:
+        """Blocking variant of acall, without hedging."""
+        self._count("calls")
+        retry = 0
+        while True:
+            started = time.perf_counter()
+            self._count("attempts")
+            try:
+                result = make_call()
+                self._observe(time.perf_counter() - started)
+                return result
+            except Exception as e:
+                self._failed(e)
+                delay = self.backoff(retry, e)
+                if delay is None:
+                    self._count("failures")
+                    raise
+                print(f"LLM {self.stage} attempt failed ({type(e).__name__}: {e}); retrying in {delay:.2f}s")
+                self._count("retries")
+                retry += 1
+                time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        p50, p95 = self.percentile(50), self.percentile(95)
+        return {
+            **stats,
+            "timeout_seconds": self.timeout,
+            "hedging": self.hedging,
+            "p50_ms": 1000 * p50 if p50 is not None else None,
+            "p95_ms": 1000 * p95 if p95 is not None else None,
+        }
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Chat model that calls another (built without its own retries) through a
+    StagePolicy: per-stage timeout, jittered retries and optional hedging.
+    `for_stage(stage)` returns the model for a stage of the chains; stages
+    share the connection pool. Streams are retried only until their first
+    chunk arrives.
+    """
+
+    model: Any
+    stage: str = "answer"
+    policy: Any = None
+    # stage -> ResilientChatModel, one dict shared by every stage of a client
+    # (typed Any so pydantic does not copy it)
+    stages: Any = None
+    factory: Any = None
+    # StagePolicy arguments (max_retries, hedging) of every stage
+    policy_options: Dict[str, Any] = {}
+
+    @classmethod
+    def create(cls, factory: Callable[[float], BaseChatModel], stage: str = "answer",
+               **policy_options: Any) -> "ResilientChatModel":
+        """`factory(timeout)` builds the underlying model of a stage."""
+        model = cls(model=factory(stage_timeout(stage)), stage=stage, policy=StagePolicy(stage, **policy_options),
+                    stages={}, factory=factory, policy_options=policy_options)
+        model.stages[stage] = model
+        return model
+
+    def for_stage(self, stage: str) -> "ResilientChatModel":
+        if stage not in self.stages:
+            self.stages[stage] = ResilientChatModel(
+                model=self.factory(stage_timeout(stage)), stage=stage,
+                policy=StagePolicy(stage, **self.policy_options), stages=self.stages,
+                factory=self.factory, policy_options=self.policy_options)
+        return self.stages[stage]
+
+    @property
+    def _llm_type(self) -> str:
+        return f"resilient-{self.model._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {**self.model._identifying_params, "stage": self.stage}
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return self.policy.call(lambda: self.model._generate(messages, stop=stop, **kwargs))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # A hedged call runs twice, so the attempts do not report tokens to the callbacks
+        return await self.policy.acall(lambda: self.model._agenerate(messages, stop=stop, **kwargs))
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        def start():
+            stream = self.model._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return stream, next(stream, None)
+        stream, first = self.policy.call(start)
+        if first is not None:
+            yield first
+            yield from stream
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                       **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        async def start():
+            stream = self.model._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            # Not anext(): the builtin needs Python 3.10
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+        # Streams are never hedged: both attempts would stream tokens to the client
+        stream, first = await self.policy.acall(start, hedge=False)
+        if first is not None:
+            yield first
+            async for chunk in stream:
+                yield chunk
+
+
+class ResilientEmbeddings(Embeddings):
+    """Embeddings called through the "embedding" StagePolicy; only single-text calls are hedged."""
+
+    def __init__(self, underlying: Embeddings):
+        self.underlying = underlying
+        self.policy = StagePolicy("embedding")
+        self.batch_policy = StagePolicy("embedding", hedging=False, name="embedding_batch")
+
+    def __getattr__(self, name: str):
+        if name == "underlying":
+            raise AttributeError(name)
+        return getattr(self.underlying, name)
+
+    def _policy(self, texts: List[str]) -> StagePolicy:
+        return self.policy if len(texts) == 1 else self.batch_policy
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._policy(texts).call(lambda: self.underlying.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.policy.call(lambda: self.underlying.embed_query(text))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._policy(texts).acall(lambda: self.underlying.aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.policy.acall(lambda: self.underlying.aembed_query(text))
+
+
+def stats() -> Dict[str, Any]:
+    """Counters and recent latency of every stage policy in use."""
+    return {name: policy.stats() for name, policy in list(_policies.items())}
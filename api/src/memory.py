@@ -0,0 +1,114 @@
+# src/memory.py
+import os
+import asyncio
+import threading
+from typing import Dict, Any, List, Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from src import database
+from src.chunking import count_tokens
+
+# Turns (question + answer) replayed verbatim into the prompt
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "3"))
+# Longer messages are cut to this size in the replayed turns
+MEMORY_MESSAGE_TOKENS = int(os.getenv("MEMORY_MESSAGE_TOKENS", "400"))
+# Target length of the rolling summary of older turns
+MEMORY_SUMMARY_WORDS = int(os.getenv("MEMORY_SUMMARY_WORDS", "150"))
+# Messages folded into the summary per update; a long chat that predates the
+# summaries catches up over several requests instead of in one large call
+MEMORY_FOLD_MAX_MESSAGES = 20
+
+SUMMARY_PROMPT = PromptTemplate.from_template(
+    """Progressively summarize a conversation between a student and an R tutor.
+Extend the current summary with the new messages and return the new summary in at most {max_words} words.
+Keep the R packages, functions, code and facts the student asked about; drop greetings and filler.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{messages}
+
+NEW SUMMARY:"""
+)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    # ~4 characters per token; close enough for a bound
+    return text[:max_tokens * 4].rstrip() + " ..."
+
+
+def _to_message(message: Dict[str, Any]) -> BaseMessage:
+    text = _truncate(message['text'], MEMORY_MESSAGE_TOKENS)
+    return HumanMessage(content=text) if message['type'] == "user" else AIMessage(content=text)
+
+
+class ConversationMemory:
+    """
+    Bounded conversation memory: the last MEMORY_TURNS turns verbatim plus a
+    rolling summary of everything older, kept in the chat_summaries table.
+    After each turn only the messages that just left the window are folded
+    into the summary, so the prompt size stays bounded and no request ever
+    re-summarizes the whole chat.
+    """
+
+    def __init__(self, llm, turns: int = MEMORY_TURNS, callbacks: Optional[List[Any]] = None):
+        self.turns = turns
+        self.summary_chain = (SUMMARY_PROMPT | llm | StrOutputParser()).with_config(run_name="summary", callbacks=callbacks)
+        self._lock = threading.Lock()
+        self._stats = {"loads": 0, "history_tokens": 0, "summary_updates": 0, "messages_summarized": 0}
+
+    def load(self, chat_id: Optional[int]) -> Dict[str, Any]:
+        """
+        Returns {"history": [messages], "history_tokens": int} for the chain;
+        the history is empty for a new chat.
+        """
+        if not chat_id:
+            return {"history": [], "history_tokens": 0}
+        summary = database.get_chat_summary(chat_id)
+        recent = database.get_recent_messages(chat_id, 2 * self.turns)
+        history: List[BaseMessage] = []
+        if summary:
+            history.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary['summary']}"))
+        history.extend(_to_message(message) for message in recent)
+        history_tokens = sum(count_tokens(message.content) for message in history)
+        with self._lock:
+            self._stats["loads"] += 1
+            self._stats["history_tokens"] += history_tokens
+        return {"history": history, "history_tokens": history_tokens}
+
+    async def aupdate(self, chat_id: int) -> bool:
+        """Folds the messages that left the verbatim window into the chat's summary."""
+        loop = asyncio.get_running_loop()
+        summary = await loop.run_in_executor(None, database.get_chat_summary, chat_id)
+        covered = (summary['covered_timestamp'], summary['covered_id']) if summary else None
+        pending = await loop.run_in_executor(
+            None, database.get_messages_to_summarize, chat_id, covered, 2 * self.turns, MEMORY_FOLD_MAX_MESSAGES
+        )
+        if not pending:
+            return False
+        new_summary = await self.summary_chain.ainvoke({
+            "summary": summary['summary'] if summary else "(none yet)",
+            "messages": get_buffer_string([_to_message(message) for message in pending],
+                                          human_prefix="Student", ai_prefix="Tutor"),
+            "max_words": MEMORY_SUMMARY_WORDS,
+        })
+        saved = await loop.run_in_executor(
+            None, database.save_chat_summary, chat_id, new_summary.strip(),
+            (pending[-1]['timestamp'], pending[-1]['id']), summary['covered_id'] if summary else None
+        )
+        if saved:
+            with self._lock:
+                self._stats["summary_updates"] += 1
+                self._stats["messages_summarized"] += len(pending)
+        return saved
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_history_tokens"] = stats["history_tokens"] / stats["loads"] if stats["loads"] else 0.0
+        return stats
@@ -0,0 +1,256 @@
+# src/metrics.py
+import os
+import time
+import functools
+import threading
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Add a Server-Timing header to every response; otherwise only to requests
+# that send `X-Server-Timing: true`
+TIMING_HEADER = os.getenv("TIMING_HEADER", "false").lower() == "true"
+TIMING_REQUEST_HEADER = b"x-server-timing"
+
+# Seconds; from in-memory lookups up to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DOCUMENT_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Counter:
+    """Monotonic counter with labels, in the Prometheus text format."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name, self.documentation, self.labels = name, documentation, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge:
+    """Value that goes up and down, in the Prometheus text format."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        self.name, self.documentation = name, documentation
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    def render(self) -> List[str]:
+        return [f"{self.name} {_format_value(self._value)}"]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, in the Prometheus text format."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.documentation, self.labels = name, documentation, tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (non-cumulative, last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = 'le="{}"'.format(bound if bound == "+Inf" else _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[Any] = []
+
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+REQUEST_SECONDS = _register(Histogram(
+    "chatbot_http_request_seconds", "HTTP request latency, until the last byte of the response.",
+    ["method", "route", "status"]))
+STAGE_SECONDS = _register(Histogram(
+    "chatbot_stage_seconds", "Latency of a stage of answering a question "
+    "(condense, router, query_embedding, retrieval, generation, suggestions, summary, ...).", ["stage"]))
+STAGE_ERRORS = _register(Counter("chatbot_stage_errors_total", "Stages that raised an error.", ["stage"]))
+DB_SECONDS = _register(Histogram("chatbot_db_seconds", "Latency of a database call.", ["operation"]))
+LLM_TOKENS = _register(Counter(
+    "chatbot_llm_tokens_total", "LLM tokens by stage; direction is input (prompt) or output (completion).",
+    ["stage", "direction"]))
+ROUTES = _register(Counter("chatbot_route_total", "Questions answered per route (knowledge base).", ["route"]))
+RETRIEVED_DOCUMENTS = _register(Histogram(
+    "chatbot_retrieved_documents", "Documents returned by a retrieval.", buckets=DOCUMENT_BUCKETS))
+ADMISSION_IN_FLIGHT = _register(Gauge("chatbot_admission_in_flight", "Admission slots in use by LLM requests."))
+ADMISSION_QUEUE_DEPTH = _register(Gauge("chatbot_admission_queue_depth", "LLM requests waiting for an admission slot."))
+ADMISSION_WAIT_SECONDS = _register(Histogram(
+    "chatbot_admission_wait_seconds", "Time a queued LLM request waited for its admission slot."))
+ADMISSION_REJECTED = _register(Counter(
+    "chatbot_admission_rejected_total", "LLM requests not admitted, by reason "
+    "(rate_limited, queue_full, deadline, timeout, upstream).", ["reason"]))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Per-request traces ---
+class RequestTrace:
+    """Time spent in each stage while serving one request, for the Server-Timing header."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}  # stage -> [seconds, calls]
+        self.route: Optional[str] = None
+        self.documents = 0
+        self.tokens = {"input": 0, "output": 0}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def server_timing(self) -> str:
+        with self._lock:
+            stages = dict(self.stages)
+        parts = [f'{stage};dur={1000 * seconds:.1f};desc="{calls} call{"s" if calls != 1 else ""}"'
+                 for stage, (seconds, calls) in stages.items()]
+        if self.route:
+            parts.append(f'route;desc="{self.route}"')
+        if self.documents:
+            parts.append(f'documents;desc="{self.documents}"')
+        if self.tokens["input"] or self.tokens["output"]:
+            parts.append(f'tokens;desc="{self.tokens["input"]} in / {self.tokens["output"]} out"')
+        parts.append(f"total;dur={1000 * (time.perf_counter() - self.started):.1f}")
+        return ", ".join(parts)
+
+
+# Context variables are copied into threadpool calls and tasks, so stages
+# running there are added to the trace of the request that started them
+_trace: ContextVar[Optional[RequestTrace]] = ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _trace.get()
+
+
+def observe_stage(stage: str, seconds: float, error: bool = False):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if error:
+        STAGE_ERRORS.inc(stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+def db_call(func: Callable) -> Callable:
+    """Times a database function into chatbot_db_seconds and the request's `db` stage."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_SECONDS.observe(elapsed, operation=func.__name__)
+            trace = _trace.get()
+            if trace is not None:
+                trace.add("db", elapsed)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: times every request (streams until their last chunk)
+    and starts the request's trace; adds the Server-Timing header when
+    TIMING_HEADER is on or the request asks for it. For streamed responses
+    the header is sent first, so it only covers the stages before the stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trace = RequestTrace()
+        token = _trace.set(trace)
+        timing = TIMING_HEADER or any(name == TIMING_REQUEST_HEADER and value.lower() in (b"1", b"true")
+                                      for name, value in scope["headers"])
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if timing:
+                    message = dict(message, headers=[*message.get("headers", []),
+                                                     (b"server-timing", trace.server_timing().encode("latin-1"))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+            # The route template, not the path, keeps the label set bounded
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(time.perf_counter() - trace.started, method=scope["method"],
+                                    route=getattr(route, "path", "unmatched"), status=str(status[0]))
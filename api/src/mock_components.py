@@ -1,24 +1,142 @@
+import os
 import re
-from typing import List
+import math
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Iterator, AsyncIterator, List
 from langchain_core.embeddings import Embeddings
 from langchain.chat_models.base import BaseChatModel
-from langchain_core.messages import AIMessage, BaseMessage
-from langchain_core.outputs import ChatResult, ChatGeneration
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
+
+# --- Latency models for load testing ---
+# A spec is "<distribution>:<params in ms>": "fixed:200", "uniform:100:300",
+# "normal:200:50" (mean, std) or "lognormal:200:0.5" (median, sigma). The
+# defaults add no latency.
+MOCK_LLM_LATENCY = os.getenv("MOCK_LLM_LATENCY", "fixed:0")              # until the first token
+MOCK_LLM_TOKEN_LATENCY = os.getenv("MOCK_LLM_TOKEN_LATENCY", "fixed:0")  # between streamed tokens
+MOCK_EMBEDDING_LATENCY = os.getenv("MOCK_EMBEDDING_LATENCY", "fixed:0")  # per embedding call
+MOCK_SEED = int(os.getenv("MOCK_SEED", "42"))
+MOCK_EMBEDDING_DIMENSION = 256
+
+class Latency:
+    """Samples delays (in seconds) from a seeded distribution given by a spec string."""
+
+    def __init__(self, spec: str, seed: int = MOCK_SEED):
+        name, *params = spec.split(":")
+        if name not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        self.spec = spec
+        self.name = name
+        self.params = [float(p) for p in params]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.name == "fixed":
+                ms = self.params[0]
+            elif self.name == "uniform":
+                ms = self._random.uniform(*self.params)
+            elif self.name == "normal":
+                ms = self._random.gauss(*self.params)
+            else:
+                ms = self.params[0] * math.exp(self._random.gauss(0, self.params[1]))
+        return max(ms, 0.0) / 1000
 
 class FakeEmbeddings(Embeddings):
-    _dimension = 10 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]: return [[0.1] * self._dimension for _ in texts]
-    def embed_query(self, text: str) -> List[float]: return [0.1] * self._dimension
+    """
+    Deterministic feature-hashing embeddings: words and their character
+    trigrams are hashed into signed buckets and the vector is L2-normalized,
+    so texts that share vocabulary are close and retrieval, routing
+    centroids and the semantic cache behave meaningfully offline.
+    """
+
+    def __init__(self, dimension: int = MOCK_EMBEDDING_DIMENSION, latency: str = MOCK_EMBEDDING_LATENCY):
+        self.dimension = dimension
+        self.model_name = f"mock-hash-{dimension}"
+        self.latency = Latency(latency)
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        for word in re.findall(r"\w+", text.lower()):
+            features = [(word, 1.0)]
+            # Parts of R identifiers (pivot_longer -> pivot, longer)
+            if "_" in word:
+                features.extend((part, 0.5) for part in word.split("_") if part)
+            padded = f"#{word}#"
+            features.extend((padded[i:i + 3], 0.3) for i in range(len(padded) - 2))
+            for feature, weight in features:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dimension
+                vector[bucket] += weight if digest[4] & 1 else -weight
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency.sample())
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency.sample())
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency.sample())
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self.latency.sample())
+        return self._embed(text)
+
+# Shared by all FakeChatModel instances (pydantic models do not take plain attributes)
+_llm_latency = Latency(MOCK_LLM_LATENCY)
+_token_latency = Latency(MOCK_LLM_TOKEN_LATENCY, seed=MOCK_SEED + 1)
 
 class FakeChatModel(BaseChatModel):
-    def _generate(self, messages: List[BaseMessage], **kwargs) -> ChatResult:
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self._respond(messages)
+        time.sleep(_llm_latency.sample() + sum(_token_latency.sample() for _ in self._tokens(text)[1:]))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self._respond(messages)
+        await asyncio.sleep(_llm_latency.sample() + sum(_token_latency.sample() for _ in self._tokens(text)[1:]))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(_llm_latency.sample())
+        for i, token in enumerate(self._tokens(self._respond(messages))):
+            if i:
+                time.sleep(_token_latency.sample())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(_llm_latency.sample())
+        for i, token in enumerate(self._tokens(self._respond(messages))):
+            if i:
+                await asyncio.sleep(_token_latency.sample())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        """Splits a response into word-sized stream chunks (whitespace kept)."""
+        return re.findall(r"\S+\s*|\s+", text) or [text]
+
+    def _respond(self, messages: List[BaseMessage]) -> str:
         full_prompt = messages[-1].content
         lower_prompt = full_prompt.lower()
         text = "This is a fallback mock response. The question wasn't recognized."
 
         # --- 1. Handle ROUTING prompt ---
         # This part decides which 'expert' should answer the question.
-        if "classify it as" in lower_prompt:
+        if "classify it" in lower_prompt:
             match = re.search(r"<question>(.*?)<\/question>", lower_prompt)
             question_text = match.group(1) if match else ""
 
@@ -29,6 +147,12 @@ class FakeChatModel(BaseChatModel):
             else: # Default for "p-value", "review my code", etc.
                 text = "general_knowledge"
 
+        # --- 1b. Handle the follow-up condensing prompt ---
+        # Returns the follow-up question unchanged as the standalone question.
+        elif "standalone question:" in lower_prompt:
+            match = re.search(r"<question>(.*?)<\/question>", full_prompt, re.DOTALL)
+            text = match.group(1).strip() if match else full_prompt
+
         # --- 2. Handle COURSE MODULES answer prompt ---
         # This part gives a realistic answer if the router chose 'course_modules'.
         elif "course material context" in lower_prompt:
@@ -92,7 +216,7 @@ class FakeChatModel(BaseChatModel):
             else:
                 text = "This is a general knowledge mock response. I can answer questions about a wide variety of topics outside of the specific course material."
 
-        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+        return text
 
     def _llm_type(self) -> str: return "fake-chat-model"
 
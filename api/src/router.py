@@ -0,0 +1,210 @@
+# src/router.py
+import os
+import re
+import json
+import math
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.data_loader import KNOWLEDGE_BASE_ROOT
+
+# A local decision is only trusted when it is at least this confident
+# (0..1); anything below falls back to the LLM router.
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.5"))
+# Embedding-centroid step: cosine similarity a knowledge base must reach, the
+# margin it must have over the other one, and the similarity below which a
+# question matches neither and is sent to general knowledge.
+ROUTER_MIN_SIMILARITY = float(os.getenv("ROUTER_MIN_SIMILARITY", "0.35"))
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.05"))
+ROUTER_GENERAL_MAX_SIMILARITY = float(os.getenv("ROUTER_GENERAL_MAX_SIMILARITY", "0.15"))
+
+# Keyword weights: an R package name is nearly decisive, a function written
+# as a call (`mutate()` or in backticks) is strong, a bare snake_case or
+# dotted name (pivot_longer, as.numeric) is a hint.
+PACKAGE_NAME_WEIGHT = 3.0
+FUNCTION_CALL_WEIGHT = 2.0
+FUNCTION_NAME_WEIGHT = 1.0
+COURSE_KEYWORD_WEIGHT = 1.0
+
+IDENTIFIER_PATTERN = re.compile(r"[a-z][a-z0-9_.]*[a-z0-9_]|[a-z]")
+CALL_PATTERN = re.compile(r"([A-Za-z][A-Za-z0-9_.]*)\s?\(")
+BACKTICK_PATTERN = re.compile(r"`([A-Za-z][A-Za-z0-9_.]*)(?:\(\))?`")
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class LocalRouter:
+    """
+    Picks `course_modules`, `r_packages` or `general_knowledge` without an LLM
+    call, from keyword/R-function dictionaries built from the knowledge base
+    and, when those are inconclusive, from the similarity of the question
+    embedding to each knowledge base's document centroid.
+    """
+
+    def __init__(self, package_names, function_names, course_keywords, centroids=None, embeddings=None):
+        self.package_names = set(package_names)
+        self.function_names = set(function_names)
+        self.course_keywords = set(course_keywords)
+        self.centroids = centroids or {}
+        self.embeddings = embeddings
+        self._lock = threading.Lock()
+        self._counts = {"keywords": 0, "centroids": 0, "fallback": 0}
+
+    @classmethod
+    def from_retrievers(cls, retrievers, embeddings=None, knowledge_base_root: str = KNOWLEDGE_BASE_ROOT):
+        """Builds the dictionaries and centroids from the loaded vector stores."""
+        package_names, function_names, course_keywords = set(), set(), set()
+
+        packages_path = os.path.join(knowledge_base_root, "r_packages")
+        if os.path.isdir(packages_path):
+            for filename in os.listdir(packages_path):
+                name = os.path.splitext(filename)[0].lower()
+                # Skip documents like "Short-refcard" that are not a package
+                if re.fullmatch(r"[a-z][a-z0-9.]*", name):
+                    package_names.add(name)
+
+        modules_path = os.path.join(knowledge_base_root, "course_modules")
+        if os.path.isdir(modules_path):
+            for filename in os.listdir(modules_path):
+                if filename.endswith(".json"):
+                    with open(os.path.join(modules_path, filename), 'r') as f:
+                        data = json.load(f)
+                    for keyword in data.get("keywords", []):
+                        # One/two letter keywords such as "R" would match every question
+                        if len(keyword) >= 3:
+                            course_keywords.add(keyword.lower())
+
+        centroids = {}
+        for kb_name, retriever in retrievers.items():
+            store = getattr(retriever, "vectorstore", None)
+            if store is None or not hasattr(store, "get"):
+                continue
+            include = ["documents", "embeddings"] if embeddings is not None else ["documents"]
+            data = store.get(include=include)
+            if kb_name == "r_packages":
+                for text in data.get("documents") or []:
+                    function_names.update(name.lower() for name in CALL_PATTERN.findall(text))
+            vectors = data.get("embeddings")
+            if vectors is not None and len(vectors) > 0:
+                dimension = len(vectors[0])
+                centroid = [0.0] * dimension
+                for vector in vectors:
+                    for i, value in enumerate(vector):
+                        centroid[i] += float(value)
+                centroids[kb_name] = [value / len(vectors) for value in centroid]
+
+        # Course keywords win over the function dictionary ("functions", "variables")
+        function_names -= course_keywords
+        print(f"Local router ready: {len(package_names)} packages, {len(function_names)} R functions, "
+              f"{len(course_keywords)} course keywords, {len(centroids)} centroids.")
+        return cls(package_names, function_names, course_keywords, centroids, embeddings)
+
+    # --- Scoring ---
+    def _keyword_scores(self, question: str) -> Dict[str, float]:
+        lower = question.lower()
+        words = set(IDENTIFIER_PATTERN.findall(lower))
+        calls = {name.lower() for name in CALL_PATTERN.findall(question)}
+        calls.update(name.lower() for name in BACKTICK_PATTERN.findall(question))
+
+        packages = 0.0
+        for word in words:
+            if word in self.package_names:
+                packages += PACKAGE_NAME_WEIGHT
+            elif word in calls and word in self.function_names:
+                packages += FUNCTION_CALL_WEIGHT
+            elif word in self.function_names and ("_" in word or "." in word):
+                # Plain words ("data", "analysis") also appear as calls in the
+                # manuals, so only distinctive names count when written bare.
+                packages += FUNCTION_NAME_WEIGHT
+
+        course = 0.0
+        for keyword in self.course_keywords:
+            if re.search(r"(?<![a-z0-9])" + re.escape(keyword) + r"(?![a-z0-9])", lower):
+                course += COURSE_KEYWORD_WEIGHT
+        return {"r_packages": packages, "course_modules": course}
+
+    def _decide_keywords(self, question: str) -> Tuple[Optional[str], float]:
+        scores = self._keyword_scores(question)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        (best, top), (_, second) = ranked[0], ranked[1]
+        if top <= 0:
+            return None, 0.0
+        return best, (top - second) / top
+
+    def _decide_centroids(self, vector: List[float]) -> Tuple[Optional[str], float]:
+        similarities = {name: _cosine(vector, centroid) for name, centroid in self.centroids.items()}
+        if not similarities:
+            return None, 0.0
+        ranked = sorted(similarities.items(), key=lambda item: item[1], reverse=True)
+        best, top = ranked[0]
+        second = ranked[1][1] if len(ranked) > 1 else 0.0
+        if top < ROUTER_GENERAL_MAX_SIMILARITY:
+            return "general_knowledge", 1.0
+        if top >= ROUTER_MIN_SIMILARITY and top - second >= ROUTER_MIN_MARGIN:
+            return best, 1.0
+        return None, 0.0
+
+    def _record(self, method: str):
+        with self._lock:
+            self._counts[method] += 1
+
+    def classify(self, question: str) -> Optional[str]:
+        """Returns the route, or None when the LLM router should decide."""
+        route, confidence = self._decide_keywords(question)
+        if route and confidence >= ROUTER_CONFIDENCE_THRESHOLD:
+            self._record("keywords")
+            return route
+        if self.centroids and self.embeddings is not None:
+            route, _ = self._decide_centroids(self.embeddings.embed_query(question))
+            if route:
+                self._record("centroids")
+                return route
+        self._record("fallback")
+        return None
+
+    async def aclassify(self, question: str) -> Optional[str]:
+        """Async variant of classify (the centroid step awaits the embedding call)."""
+        route, confidence = self._decide_keywords(question)
+        if route and confidence >= ROUTER_CONFIDENCE_THRESHOLD:
+            self._record("keywords")
+            return route
+        if self.centroids and self.embeddings is not None:
+            route, _ = self._decide_centroids(await self.embeddings.aembed_query(question))
+            if route:
+                self._record("centroids")
+                return route
+        self._record("fallback")
+        return None
+
+    def with_fallback(self, llm_router):
+        """
+        Wraps the LLM router: the local decision is returned as an AIMessage
+        (the same shape the LLM router produces) and the LLM is only called
+        when the local router is not confident.
+        """
+        def route(info: Dict[str, Any]):
+            topic = self.classify(info["input"])
+            return AIMessage(content=topic) if topic else llm_router.invoke(info)
+
+        async def aroute(info: Dict[str, Any]):
+            topic = await self.aclassify(info["input"])
+            return AIMessage(content=topic) if topic else await llm_router.ainvoke(info)
+
+        return RunnableLambda(route, afunc=aroute, name="local_router")
+
+    def stats(self) -> Dict[str, Any]:
+        """Decision counts per method and the share of questions sent to the LLM router."""
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            "decisions": counts,
+            "total": total,
+            "fallback_rate": counts["fallback"] / total if total else 0.0,
+        }
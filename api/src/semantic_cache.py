@@ -0,0 +1,269 @@
+# src/semantic_cache.py
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import threading
+import heapq
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+
+from src.data_loader import knowledge_base_fingerprint
+
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "semantic_cache.sqlite3")
+# Cosine similarity a new question needs with a cached one to reuse its answer
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# How often lookups re-check whether a vector store was rebuilt
+KB_CHECK_INTERVAL_SECONDS = 30
+# Rows of the first vector matrix; it doubles when full, up to max_entries
+INITIAL_CAPACITY = 64
+
+
+class SemanticCache:
+    """
+    Answer cache in front of the master chain, keyed on question embeddings.
+    A question whose embedding is within `threshold` cosine similarity of a
+    cached question gets that question's answer, sources and suggested
+    prompts back. Entries live in memory for the lookup and in SQLite so they
+    survive restarts; they expire after `ttl_seconds`, the least recently
+    used ones are evicted past `max_entries`, and all of them are dropped
+    when a knowledge base under knowledge_base/ is rebuilt with new content
+    (the mock stores with `is_mock`).
+    """
+
+    def __init__(self, embeddings, path: str = SEMANTIC_CACHE_PATH, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS,
+                 is_mock: bool = False):
+        self.embeddings = embeddings
+        self.is_mock = is_mock
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # Preallocated vector matrix: entry id -> row, and the rows of removed entries to reuse
+        self._vectors: Optional[np.ndarray] = None
+        self._live: Optional[np.ndarray] = None
+        self._used = 0
+        self._rows: Dict[int, int] = {}
+        self._row_ids: List[Optional[int]] = []
+        self._free: List[int] = []
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._kb_version = knowledge_base_fingerprint(self.is_mock)
+        self._kb_checked_at = time.monotonic()
+        self._stats = {"hits": 0, "misses": 0, "latency_saved_seconds": 0.0, "lookup_seconds": 0.0, "invalidations": 0}
+        self._init_storage()
+        self._load()
+
+    # --- Persistence ---
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_storage(self):
+        conn = self._connect()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS semantic_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            embedding BLOB NOT NULL, -- normalized float32 vector
+            answer TEXT NOT NULL,
+            sources TEXT NOT NULL,
+            suggested_prompts TEXT NOT NULL,
+            kb_version TEXT NOT NULL,
+            compute_seconds REAL NOT NULL,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        )
+        """)
+        conn.commit()
+        conn.close()
+
+    def _load(self):
+        """Loads valid entries into memory, deleting expired and outdated ones."""
+        conn = self._connect()
+        conn.execute("DELETE FROM semantic_cache WHERE created_at < ? OR kb_version != ?",
+                     (time.time() - self.ttl_seconds, self._kb_version))
+        conn.commit()
+        rows = conn.execute("SELECT * FROM semantic_cache ORDER BY last_used_at DESC LIMIT ?",
+                            (self.max_entries,)).fetchall()
+        conn.close()
+        for row in rows:
+            entry = dict(row)
+            vector = np.frombuffer(entry.pop("embedding"), dtype=np.float32)
+            entry["sources"] = json.loads(entry["sources"])
+            entry["suggested_prompts"] = json.loads(entry["suggested_prompts"])
+            self._add(entry, vector)
+        print(f"Semantic cache loaded with {len(self._entries)} entries.")
+
+    def _delete_rows(self, ids: List[int]):
+        if not ids:
+            return
+        conn = self._connect()
+        conn.executemany("DELETE FROM semantic_cache WHERE id = ?", [(i,) for i in ids])
+        conn.commit()
+        conn.close()
+
+    # --- In-memory index (callers hold self._lock) ---
+    def _add(self, entry: Dict[str, Any], vector: np.ndarray):
+        """Puts an entry's vector in a free row, growing the matrix geometrically when there is none."""
+        if self._free:
+            row = self._free.pop()
+        else:
+            if self._vectors is None or self._used == len(self._vectors):
+                capacity = INITIAL_CAPACITY if self._vectors is None else 2 * len(self._vectors)
+                vectors = np.zeros((min(capacity, max(self.max_entries, 1)), vector.shape[0]), dtype=np.float32)
+                live = np.zeros(len(vectors), dtype=bool)
+                if self._vectors is not None:
+                    vectors[:self._used] = self._vectors[:self._used]
+                    live[:self._used] = self._live[:self._used]
+                self._vectors, self._live = vectors, live
+                self._row_ids.extend([None] * (len(vectors) - len(self._row_ids)))
+            row = self._used
+            self._used += 1
+        self._vectors[row] = vector
+        self._live[row] = True
+        self._row_ids[row] = entry["id"]
+        self._rows[entry["id"]] = row
+        self._entries[entry["id"]] = entry
+
+    def _remove(self, ids: List[int]):
+        for entry_id in ids:
+            row = self._rows.pop(entry_id, None)
+            if row is None:
+                continue
+            self._live[row] = False
+            self._row_ids[row] = None
+            self._free.append(row)
+            self._entries.pop(entry_id, None)
+
+    def _kb_check_due(self) -> bool:
+        """Claims the next knowledge-base check when it is due, so only one caller runs it."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._kb_checked_at < KB_CHECK_INTERVAL_SECONDS:
+                return False
+            self._kb_checked_at = now
+            return True
+
+    def _check_kb_version(self):
+        """Drops every entry when a knowledge base changed. Reads the manifests: call it off the event loop."""
+        version = knowledge_base_fingerprint(self.is_mock)
+        with self._lock:
+            if version == self._kb_version:
+                return
+            print("Knowledge base changed; invalidating the semantic cache.")
+            stale = list(self._entries)
+            self._remove(stale)
+            self._kb_version = version
+            self._stats["invalidations"] += 1
+        self._delete_rows(stale)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _match(self, vector: np.ndarray) -> Tuple[Optional[Dict[str, Any]], List[int]]:
+        """In-memory only: returns (entry or None, ids of expired entries to delete from SQLite)."""
+        with self._lock:
+            if not self._entries:
+                return None, []
+            similarities = np.where(self._live[:self._used], self._vectors[:self._used] @ vector, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None, []
+            entry = self._entries[self._row_ids[best]]
+            if time.time() - entry["created_at"] > self.ttl_seconds:
+                self._remove([entry["id"]])
+                return None, [entry["id"]]
+            entry["last_used_at"] = time.time()
+            return dict(entry, similarity=float(similarities[best])), []
+
+    def _record_lookup(self, entry: Optional[Dict[str, Any]], started: float, expired: List[int]):
+        self._delete_rows(expired)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["lookup_seconds"] += elapsed
+            if entry is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                self._stats["latency_saved_seconds"] += max(entry["compute_seconds"] - elapsed, 0.0)
+        if entry is not None:
+            conn = self._connect()
+            conn.execute("UPDATE semantic_cache SET last_used_at = ? WHERE id = ?", (entry["last_used_at"], entry["id"]))
+            conn.commit()
+            conn.close()
+
+    # --- Public API ---
+    def lookup(self, question: str) -> Tuple[Optional[Dict[str, Any]], np.ndarray]:
+        """
+        Returns (entry, question_vector). `entry` is None on a miss; the vector
+        is handed back so `store` does not have to embed the question again.
+        """
+        started = time.perf_counter()
+        vector = self._normalize(self.embeddings.embed_query(question))
+        if self._kb_check_due():
+            self._check_kb_version()
+        entry, expired = self._match(vector)
+        self._record_lookup(entry, started, expired)
+        return entry, vector
+
+    async def alookup(self, question: str) -> Tuple[Optional[Dict[str, Any]], np.ndarray]:
+        """Async variant of lookup."""
+        started = time.perf_counter()
+        vector = self._normalize(await self.embeddings.aembed_query(question))
+        loop = asyncio.get_running_loop()
+        if self._kb_check_due():
+            await loop.run_in_executor(None, self._check_kb_version)
+        entry, expired = self._match(vector)
+        # The match is in-memory; the LRU touch on a hit and the deletes of
+        # expired entries write to SQLite, so they run off the event loop.
+        await loop.run_in_executor(None, self._record_lookup, entry, started, expired)
+        return entry, vector
+
+    def store(self, question: str, vector: np.ndarray, answer: str, sources: List[Dict[str, Any]],
+              suggested_prompts: List[str], compute_seconds: float):
+        """Caches a freshly computed answer."""
+        now = time.time()
+        conn = self._connect()
+        cursor = conn.execute("""
+        INSERT INTO semantic_cache (question, embedding, answer, sources, suggested_prompts, kb_version,
+                                    compute_seconds, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (question, vector.astype(np.float32).tobytes(), answer, json.dumps(sources),
+              json.dumps(suggested_prompts), self._kb_version, compute_seconds, now, now))
+        conn.commit()
+        entry_id = cursor.lastrowid
+        conn.close()
+
+        entry = {
+            "id": entry_id, "question": question, "answer": answer, "sources": sources,
+            "suggested_prompts": suggested_prompts, "kb_version": self._kb_version,
+            "compute_seconds": compute_seconds, "created_at": now, "last_used_at": now,
+        }
+        with self._lock:
+            # Evict first, so the new entry reuses a row of the least recently used ones
+            evicted = []
+            if len(self._entries) >= self.max_entries:
+                evicted = heapq.nsmallest(len(self._entries) - self.max_entries + 1, self._entries,
+                                          key=lambda i: self._entries[i]["last_used_at"])
+                self._remove(evicted)
+            self._add(entry, vector.astype(np.float32))
+        self._delete_rows(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["capacity"] = len(self._vectors) if self._vectors is not None else 0
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["avg_lookup_ms"] = 1000 * stats.pop("lookup_seconds") / lookups if lookups else 0.0
+        return stats
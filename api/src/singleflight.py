@@ -0,0 +1,95 @@
+# src/singleflight.py
+import re
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation do not make a question different."""
+    return re.sub(r"\s+", " ", question.casefold()).strip().rstrip("?!. ")
+
+
+class _Broadcast:
+    """One async iterator consumed by a background task and replayed to every subscriber."""
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.chunks: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for chunk in source:
+                async with self._changed:
+                    self.chunks.append(chunk)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            async with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """Every chunk from the first one on, then the source's error if it failed."""
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self.chunks) or self.done)
+                chunks, done = self.chunks[index:], self.done
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution: the
+    first caller starts it and every caller that arrives while it is in
+    flight awaits (or, for streams, replays) the same result. Nothing is
+    kept once it finishes. The execution runs as its own task, so a caller
+    that disconnects does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Any] = {}
+        self._stats = {"calls": 0, "executions": 0}
+
+    def _join(self, key: Hashable, start: Callable[[], Any]):
+        self._stats["calls"] += 1
+        flight = self._flights.get(key)
+        if flight is None:
+            self._stats["executions"] += 1
+            flight = self._flights[key] = start()
+            task = flight.task if isinstance(flight, _Broadcast) else flight
+            task.add_done_callback(lambda _: self._flights.pop(key, None) if self._flights.get(key) is flight else None)
+            # Retrieved here so a failure nobody is waiting for is not logged as never retrieved
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return flight
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of `factory()`, shared with the concurrent calls of the same key."""
+        task = self._join(key, lambda: asyncio.ensure_future(factory()))
+        return await asyncio.shield(task)
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Chunks of `factory()`, shared with the concurrent streams of the same key."""
+        broadcast = self._join(key, lambda: _Broadcast(factory()))
+        async for chunk in broadcast.subscribe():
+            yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        calls, executions = self._stats["calls"], self._stats["executions"]
+        return {
+            "calls": calls,
+            "executions": executions,
+            "coalesced": calls - executions,
+            "coalescing_ratio": (calls - executions) / calls if calls else 0.0,
+            "in_flight": len(self._flights),
+        }
@@ -0,0 +1,275 @@
+# src/suggestion_index.py
+import os
+import re
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from src.data_loader import VECTOR_STORE_ROOT, KNOWLEDGE_BASE_ROOT
+from src.lexical import CALL_PATTERN, tokenize
+
+# Follow-ups returned per answer, and candidates stored per chunk
+SUGGESTION_COUNT = 3
+SUGGESTIONS_PER_CHUNK = 5
+# A candidate this similar (word Jaccard) to the question or to a picked
+# suggestion is skipped
+DUPLICATE_THRESHOLD = 0.6
+
+# Served for general-knowledge answers (no retrieved documents), best match first
+GENERAL_SUGGESTIONS = [
+    "How do I install and load an R package?",
+    "What is the difference between a vector, a list and a data frame in R?",
+    "How do I read a CSV file into R?",
+    "How do I handle missing values (NA) in R?",
+    "How do I write my own function in R?",
+    "How do I make a basic plot with ggplot2?",
+    "How do I filter and summarise data with dplyr?",
+    "How do I reshape data between wide and long format with tidyr?",
+    "What does the pipe operator %>% do?",
+    "How do I run a t-test or a linear regression in R?",
+    "How do I find help for an R function?",
+    "How do I loop over elements in R, and when should I use lapply instead?",
+]
+
+LLM_SUGGESTION_PROMPT = PromptTemplate.from_template(
+    """You write follow-up questions for students learning R.
+Below is an excerpt from {source}. Write {count} short, distinct questions a student could ask next about it.
+One question per line, without numbering.
+
+EXCERPT:
+{text}
+
+QUESTIONS:"""
+)
+
+COURSE_STOP_KEYWORDS = {"r"}
+
+
+def suggestion_index_path(kb_name: str, is_mock: bool = False) -> str:
+    """The index is stored next to the knowledge base's vector store."""
+    return os.path.join(VECTOR_STORE_ROOT, f"{kb_name}_suggestions{'_mock' if is_mock else ''}.json")
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def read_index(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_index(path: str, index: Dict[str, Any]):
+    """Writes the index atomically, like the vector store manifests."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def parse_lines(text: str) -> List[str]:
+    """One suggestion per non-empty line, without list markers."""
+    lines = (re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip() for line in text.splitlines())
+    return [line for line in lines if line]
+
+
+# --- Generators: (text, metadata) -> candidate follow-ups ---
+def _course_keywords(knowledge_base_root: str = KNOWLEDGE_BASE_ROOT) -> Dict[str, List[str]]:
+    """Keywords of every course module, by module title."""
+    keywords = {}
+    modules_path = os.path.join(knowledge_base_root, "course_modules")
+    if os.path.isdir(modules_path):
+        for filename in sorted(os.listdir(modules_path)):
+            if filename.endswith(".json"):
+                with open(os.path.join(modules_path, filename), 'r') as f:
+                    data = json.load(f)
+                keywords[data.get("module_title", "Unknown Module")] = [
+                    keyword for keyword in data.get("keywords", []) if keyword.lower() not in COURSE_STOP_KEYWORDS
+                ]
+    return keywords
+
+
+def template_generator(knowledge_base_root: str = KNOWLEDGE_BASE_ROOT) -> Callable[[str, Dict[str, Any]], List[str]]:
+    """
+    Deterministic follow-ups built from a chunk's reference topic, sections
+    and R calls (package manuals) or the course keywords it mentions
+    (transcripts). Free and offline; used for the mock stores.
+    """
+    course_keywords = _course_keywords(knowledge_base_root)
+
+    def generate(text: str, metadata: Dict[str, Any]) -> List[str]:
+        suggestions = []
+        if "source_module" in metadata:
+            lower = text.lower()
+            mentioned = [keyword for keyword in course_keywords.get(metadata["source_module"], [])
+                         if re.search(r"(?<![a-z0-9])" + re.escape(keyword.lower()) + r"(?![a-z0-9])", lower)]
+            for keyword in mentioned[:2]:
+                suggestions.append(f"What does the course say about {keyword}?")
+                suggestions.append(f"Can you show how {keyword} works in R with an example?")
+            suggestions.append(f"What are the key takeaways of {metadata['source_module'].split(':')[0]}?")
+            return suggestions[:SUGGESTIONS_PER_CHUNK]
+
+        package = os.path.splitext(os.path.basename(metadata.get("source", "")))[0]
+        topic = metadata.get("topic")
+        if topic and topic.endswith("-package"):
+            suggestions.append(f"What is the {package} package used for?")
+            topic = None
+        calls = []
+        for name in CALL_PATTERN.findall(text):
+            if name != topic and name not in calls and len(name) > 1:
+                calls.append(name)
+        if topic:
+            sections = metadata.get("sections", "")
+            suggestions.append(f"Can you show an example of `{topic}()` from {package}?")
+            if "Arguments" in sections:
+                suggestions.append(f"What do the arguments of `{topic}()` do?")
+            suggestions.append(f"When should I use `{topic}()`?")
+            if calls:
+                suggestions.append(f"How is `{topic}()` different from `{calls[0]}()`?")
+        for name in calls[:2]:
+            suggestions.append(f"How do I use `{name}()` in R?")
+        return suggestions[:SUGGESTIONS_PER_CHUNK]
+
+    return generate
+
+
+def llm_generator(llm) -> Callable[[str, Dict[str, Any]], List[str]]:
+    """Follow-ups written by the LLM, one call per chunk."""
+    chain = LLM_SUGGESTION_PROMPT | llm | StrOutputParser()
+
+    def generate(text: str, metadata: Dict[str, Any]) -> List[str]:
+        if "source_module" in metadata:
+            source = f"the course transcript of {metadata['source_module']}"
+        else:
+            source = f"the manual of {os.path.basename(metadata.get('source', 'an R package'))}"
+        return parse_lines(chain.invoke({"source": source, "text": text, "count": SUGGESTIONS_PER_CHUNK}))[:SUGGESTIONS_PER_CHUNK]
+
+    return generate
+
+
+def sync_suggestion_index(db, kb_name: str, path: str, generator_name: str,
+                          generate: Callable[[str, Dict[str, Any]], List[str]], concurrency: int = 1) -> Dict[str, int]:
+    """
+    Brings a knowledge base's suggestion index in line with its vector store:
+    entries of chunks that are gone are dropped and suggestions are only
+    generated for new or changed chunks (or for all of them when the
+    generator changed). Returns counts of generated, kept and removed entries.
+    """
+    index = read_index(path) or {}
+    if index.get("generator") != generator_name:
+        index = {"generator": generator_name, "chunks": {}}
+    entries = index["chunks"]
+    data = db.get(include=["documents", "metadatas"])
+    current = {doc_id: (text, metadata or {}) for doc_id, text, metadata in
+               zip(data["ids"], data["documents"], data["metadatas"])}
+
+    removed = [doc_id for doc_id in entries if doc_id not in current]
+    for doc_id in removed:
+        del entries[doc_id]
+    todo = [doc_id for doc_id, (text, _) in current.items()
+            if doc_id not in entries or entries[doc_id]["hash"] != chunk_hash(text)]
+
+    lock = threading.Lock()
+    def run(doc_id: str):
+        text, metadata = current[doc_id]
+        try:
+            suggestions = generate(text, metadata)
+        except Exception as e:
+            print(f"  Could not generate suggestions for chunk {doc_id}: {e}")
+            return
+        with lock:
+            entries[doc_id] = {"hash": chunk_hash(text), "suggestions": suggestions}
+            # Persist now and then so an interrupted build resumes where it stopped
+            if len(entries) % 100 == 0:
+                write_index(path, index)
+
+    if todo:
+        print(f"  Generating suggestions for {len(todo)} chunk(s) of '{kb_name}' ({generator_name})...")
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+            for _ in pool.map(run, todo):
+                pass
+    if todo or removed or not os.path.exists(path):
+        write_index(path, index)
+    return {"generated": len(todo), "kept": len(current) - len(todo), "removed": len(removed)}
+
+
+def _similar(a: set, b: set) -> bool:
+    return bool(a and b) and len(a & b) / len(a | b) >= DUPLICATE_THRESHOLD
+
+
+class SuggestionIndex:
+    """
+    Follow-up questions precomputed per knowledge base chunk (by `python
+    ingest.py`). An answer's suggestions are picked from the chunks it was
+    generated from, in retrieval order and round-robin so they cover several
+    chunks; general-knowledge answers get the best matching general ones.
+    """
+
+    def __init__(self, by_chunk: Dict[str, List[str]], general: List[str] = GENERAL_SUGGESTIONS,
+                 count: int = SUGGESTION_COUNT):
+        self.by_chunk = by_chunk
+        self.count = count
+        self.general = general
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "complete": 0, "general": 0}
+
+    @classmethod
+    def load(cls, retrievers: Dict[str, Any], is_mock: bool = False) -> "SuggestionIndex":
+        """
+        Loads the index of every knowledge base. In mock mode missing or
+        outdated indexes are (re)built from the stores with the template generator.
+        """
+        by_chunk = {}
+        generate = template_generator() if is_mock else None
+        for kb_name, retriever in retrievers.items():
+            path = suggestion_index_path(kb_name, is_mock)
+            store = getattr(retriever, "vectorstore", None)
+            if is_mock and store is not None:
+                sync_suggestion_index(store, kb_name, path, "template", generate)
+            index = read_index(path)
+            if index is None:
+                print(f"WARNING: No suggestion index at '{path}'. Run `python ingest.py` to build it.")
+                continue
+            by_chunk.update({doc_id: entry["suggestions"] for doc_id, entry in index["chunks"].items()})
+        print(f"Suggestion index loaded: {len(by_chunk)} chunk(s).")
+        return cls(by_chunk)
+
+    def suggest(self, question: str, documents: List[Document]) -> List[str]:
+        """Up to `count` follow-ups for an answer built from `documents` (none: a general answer)."""
+        count = self.count
+        asked = set(tokenize(question))
+        if documents:
+            candidates = [self.by_chunk.get(doc.id, []) for doc in documents if doc.id]
+            ordered = [suggestions[i] for i in range(SUGGESTIONS_PER_CHUNK)
+                       for suggestions in candidates if i < len(suggestions)]
+        else:
+            # Best word overlap with the question first; the list order breaks ties
+            ordered = sorted(self.general, key=lambda text: -len(asked & set(tokenize(text))))
+        picked, picked_terms = [], []
+        for suggestion in ordered:
+            terms = set(tokenize(suggestion))
+            if suggestion in picked or _similar(terms, asked) or any(_similar(terms, other) for other in picked_terms):
+                continue
+            picked.append(suggestion)
+            picked_terms.append(terms)
+            if len(picked) == count:
+                break
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["complete"] += len(picked) == count
+            self._stats["general"] += not documents
+        return picked
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["chunks"] = len(self.by_chunk)
+        stats["complete_rate"] = stats["complete"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
@@ -0,0 +1,70 @@
+# src/suggestions.py
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+# How long a finished (or abandoned) suggestion task is kept around for the
+# frontend to fetch, and how many we keep at most.
+SUGGESTION_TTL_SECONDS = 600
+MAX_PENDING_SUGGESTIONS = 5000
+
+def parse_suggestions(suggestions_text: str) -> List[str]:
+    """Splits the suggestion chain output into one prompt per non-empty line."""
+    return [line.strip() for line in suggestions_text.strip().splitlines() if line.strip()]
+
+async def generate_suggestions(suggestion_chain, question: str, answer: str) -> List[str]:
+    """Runs the suggestion chain asynchronously. Never raises: failures yield no suggestions."""
+    try:
+        suggestions_result = await suggestion_chain.ainvoke({"input": question, "answer": answer})
+        return parse_suggestions(suggestions_result.content)
+    except Exception as e:
+        print(f"Error generating suggestions: {e}")
+        return []
+
+class SuggestionRegistry:
+    """
+    Keeps suggestion tasks that were started in the background so the
+    frontend can fetch their result later by id (see GET /suggestions/{id}).
+    """
+
+    def __init__(self, ttl_seconds: int = SUGGESTION_TTL_SECONDS, max_entries: int = MAX_PENDING_SUGGESTIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, task: "asyncio.Task") -> str:
+        """Stores a running suggestion task and returns the id to fetch it with."""
+        self._evict_expired()
+        suggestions_id = uuid.uuid4().hex
+        self._tasks[suggestions_id] = {"task": task, "created": time.monotonic()}
+        return suggestions_id
+
+    async def get(self, suggestions_id: str, wait_seconds: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        Returns {"status": "ready" | "pending", "suggested_prompts": [...]},
+        waiting up to `wait_seconds` for a pending task. None if the id is unknown.
+        """
+        entry = self._tasks.get(suggestions_id)
+        if entry is None:
+            return None
+        task = entry["task"]
+        if not task.done() and wait_seconds > 0:
+            try:
+                # shield() so a client giving up does not cancel the task for others
+                await asyncio.wait_for(asyncio.shield(task), timeout=wait_seconds)
+            except asyncio.TimeoutError:
+                pass
+        if not task.done():
+            return {"status": "pending", "suggested_prompts": []}
+        return {"status": "ready", "suggested_prompts": task.result()}
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._tasks.items() if now - entry["created"] > self.ttl_seconds]
+        for key in expired:
+            self._tasks.pop(key)["task"].cancel()
+        # Dicts keep insertion order, so the first keys are the oldest ones.
+        while len(self._tasks) >= self.max_entries:
+            oldest = next(iter(self._tasks))
+            self._tasks.pop(oldest)["task"].cancel()
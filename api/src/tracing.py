@@ -0,0 +1,216 @@
+# src/tracing.py
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+from src import metrics
+from src.chunking import count_tokens
+
+# Runs with these names (set with .with_config(run_name=...) in src.chains
+# and src.memory) are timed as a stage; runs inside them belong to it. An
+# LLM call outside every named stage is the answer generation.
+STAGES = {"condense", "router", "retrieval", "speculative_retrieval", "suggestions", "summary"}
+# Runs whose output is the documents an answer uses: a retrieval, or the chosen
+# route's prefetched documents with speculative retrieval (whose searches are
+# not counted, since one of them is discarded)
+DOCUMENT_RUNS = {"retrieval", "prefetched_retrieval"}
+# Runs whose end was never reported (cancelled streams) are dropped past this
+MAX_OPEN_RUNS = 10000
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Turns LangChain run events into src.metrics stages: latency per stage,
+    LLM tokens in/out per stage, the route picked (metadata["route"] of the
+    run named "answer") and the number of retrieved documents.
+    """
+
+    # Cheap bookkeeping only, so it runs on the event loop instead of a thread
+    run_inline = True
+
+    def __init__(self):
+        # run_id -> {"stage", "started" (timed runs only), "messages" (LLM runs)}
+        self._runs: "OrderedDict[UUID, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: Optional[str], llm: bool = False,
+               messages: Optional[List[Any]] = None):
+        with self._lock:
+            parent = self._runs.get(parent_run_id) if parent_run_id else None
+            run: Dict[str, Any] = {"stage": parent["stage"] if parent else None}
+            if name in STAGES:
+                run["stage"], run["started"] = name, time.perf_counter()
+            if name in DOCUMENT_RUNS:
+                run["documents"] = True
+            elif llm and run["stage"] is None:
+                run["stage"], run["started"] = "generation", time.perf_counter()
+            if messages is not None:
+                run["messages"] = messages
+            self._runs[run_id] = run
+            while len(self._runs) > MAX_OPEN_RUNS:
+                self._runs.popitem(last=False)
+
+    def _end(self, run_id: UUID, error: bool = False) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None and "started" in run:
+            metrics.observe_stage(run["stage"], time.perf_counter() - run["started"], error=error)
+        return run
+
+    # --- Chains ---
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        self._start(run_id, parent_run_id, name)
+        if name == "answer" and metadata and metadata.get("route"):
+            metrics.ROUTES.inc(route=metadata["route"])
+            trace = metrics.current_trace()
+            if trace is not None:
+                trace.route = metadata["route"]
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        run = self._end(run_id)
+        if run is not None and run.get("documents") and isinstance(outputs, list):
+            self._count_documents(outputs)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    # --- Retrievers ---
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name"))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        run = self._end(run_id)
+        if run is not None and run.get("documents"):
+            self._count_documents(documents)
+
+    @staticmethod
+    def _count_documents(documents: List[Any]):
+        metrics.RETRIEVED_DOCUMENTS.observe(len(documents))
+        trace = metrics.current_trace()
+        if trace is not None:
+            trace.documents += len(documents)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    # --- LLMs ---
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name"), llm=True, messages=prompts)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name"), llm=True, messages=messages[0] if messages else [])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._end(run_id)
+        if run is None:
+            return
+        input_tokens, output_tokens = self._usage(response, run.get("messages") or [])
+        metrics.LLM_TOKENS.inc(input_tokens, stage=run["stage"], direction="input")
+        metrics.LLM_TOKENS.inc(output_tokens, stage=run["stage"], direction="output")
+        trace = metrics.current_trace()
+        if trace is not None:
+            trace.tokens["input"] += input_tokens
+            trace.tokens["output"] += output_tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+
+    @staticmethod
+    def _usage(response, messages: List[Any]):
+        """(input, output) tokens as reported by the model, else counted locally."""
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("prompt_tokens") is not None:
+            return usage["prompt_tokens"], usage.get("completion_tokens", 0)
+        generations = [generation for batch in response.generations for generation in batch]
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens", 0), metadata.get("output_tokens", 0)
+        input_tokens = sum(count_tokens(message if isinstance(message, str) else str(message.content))
+                           for message in messages)
+        return input_tokens, sum(count_tokens(generation.text) for generation in generations)
+
+
+# Shared by every chain of the process
+callback_handler = MetricsCallbackHandler()
+
+
+# Query vectors embedded ahead of time in one request (POST /chat/batch);
+# tasks started while they are set answer embed_query from them
+_prefetched_queries: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("prefetched_queries", default=None)
+
+
+class TimedEmbeddings(Embeddings):
+    """
+    Times the embedding calls of another Embeddings (query_embedding /
+    document_embedding stages). Queries embedded ahead with `aembed_queries`
+    are served from `prefetched()` without another call.
+    """
+
+    def __init__(self, underlying: Embeddings):
+        self.underlying = underlying
+
+    def __getattr__(self, name: str):
+        # model_name, stats(), ... of the wrapped embeddings
+        if name == "underlying":
+            raise AttributeError(name)
+        return getattr(self.underlying, name)
+
+    def _timed(self, stage: str, call, *args):
+        started = time.perf_counter()
+        error = False
+        try:
+            return call(*args)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe_stage(stage, time.perf_counter() - started, error=error)
+
+    async def _atimed(self, stage: str, call, *args):
+        started = time.perf_counter()
+        error = False
+        try:
+            return await call(*args)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe_stage(stage, time.perf_counter() - started, error=error)
+
+    @staticmethod
+    @contextmanager
+    def prefetched(vectors: Dict[str, List[float]]):
+        """Serves embed_query / aembed_query of these texts from `vectors` in this context."""
+        token = _prefetched_queries.set(vectors)
+        try:
+            yield
+        finally:
+            _prefetched_queries.reset(token)
+
+    def _prefetched(self, text: str) -> Optional[List[float]]:
+        vectors = _prefetched_queries.get()
+        return vectors.get(text) if vectors else None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._timed("document_embedding", self.underlying.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._prefetched(text) or self._timed("query_embedding", self.underlying.embed_query, text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self._atimed("document_embedding", self.underlying.aembed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self._prefetched(text) or await self._atimed("query_embedding", self.underlying.aembed_query, text)
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embeds many queries in one request. For the OpenAI models a query embeds like a document."""
+        return await self._atimed("query_embedding", self.underlying.aembed_documents, texts)
@@ -0,0 +1,245 @@
+# src/vector_index.py
+import os
+import json
+import time
+import asyncio
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+INDEX_FILENAME = "index.json"
+INDEX_FORMAT = 1
+DTYPES = ("int8", "float16")
+# Rows scored per step: each block is widened to float32 in a small scratch
+# buffer that stays in cache instead of converting the whole matrix per query
+SEARCH_BLOCK_ROWS = 64
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Unit-normalizes float vectors and stores them as float16, or as int8
+    with one float32 scale per row (symmetric, max-abs). Returns (matrix, scales).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    if dtype != "int8":
+        raise ValueError(f"Unknown vector index dtype: {dtype}")
+    scales = np.abs(vectors).max(axis=1, initial=0) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def _save_array(path: str, array: np.ndarray):
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def export_numpy_index(db, path: str, source: str, embedding: str, dtype: str = "int8") -> Dict[str, Any]:
+    """
+    Writes every vector, text and metadata of a Chroma store to `path` as a
+    NumpyVectorStore. The arrays get new file names on every export and
+    index.json (written last, atomically) points to them, so processes
+    that still map the previous files keep a consistent view.
+    """
+    data = db.get(include=["embeddings", "documents", "metadatas"])
+    embeddings = data["embeddings"]
+    dimension = len(embeddings[0]) if embeddings is not None and len(embeddings) else 0
+    matrix, scales = quantize(np.asarray(embeddings, dtype=np.float32).reshape(len(data["ids"]), dimension), dtype)
+
+    os.makedirs(path, exist_ok=True)
+    stamp = f"{source[:12]}-{int(time.time() * 1000)}"
+    vectors_file = f"vectors-{stamp}.npy"
+    _save_array(os.path.join(path, vectors_file), matrix)
+    scales_file = None
+    if scales is not None:
+        scales_file = f"scales-{stamp}.npy"
+        _save_array(os.path.join(path, scales_file), scales)
+
+    index = {
+        "format": INDEX_FORMAT, "source": source, "embedding": embedding, "dtype": dtype,
+        "count": len(data["ids"]), "dimension": dimension, "vectors": vectors_file, "scales": scales_file,
+        "ids": data["ids"], "documents": data["documents"], "metadatas": [m or {} for m in data["metadatas"]],
+    }
+    index_path = os.path.join(path, INDEX_FILENAME)
+    with open(index_path + ".tmp", 'w') as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+
+    # Files of earlier exports; mapped copies stay readable after unlinking
+    for filename in os.listdir(path):
+        if filename.endswith(".npy") and filename not in (vectors_file, scales_file):
+            os.remove(os.path.join(path, filename))
+    return index
+
+
+def read_index_header(path: str) -> Optional[Dict[str, Any]]:
+    """The index.json of an exported store, or None when there is none."""
+    index_path = os.path.join(path, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Read-only vector store over a memory-mapped int8 or float16 matrix,
+    exported from a Chroma store by `python ingest.py`. Search is exact:
+    the query is scored against every row with cosine similarity. The
+    matrix is mapped read-only, so uvicorn workers share its pages in the
+    OS page cache instead of each loading their own copy.
+    """
+
+    def __init__(self, path: str, embedding_function: Embeddings, index: Dict[str, Any],
+                 vectors: np.ndarray, scales: Optional[np.ndarray]):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.source = index["source"]
+        self.embedding = index["embedding"]
+        self.dtype = index["dtype"]
+        self.ids: List[str] = index["ids"]
+        self.texts: List[str] = index["documents"]
+        self.metadatas: List[Dict[str, Any]] = index["metadatas"]
+        self.vectors = vectors
+        self.scales = scales
+        self._lock = threading.Lock()
+        self._stats = {"searches": 0, "seconds": 0.0}
+
+    @classmethod
+    def load(cls, path: str, embedding_function: Embeddings) -> "NumpyVectorStore":
+        index = read_index_header(path)
+        if index is None or index.get("format") != INDEX_FORMAT:
+            raise FileNotFoundError(f"No vector index at '{path}'. Run `python ingest.py` to build it.")
+        vectors = np.load(os.path.join(path, index["vectors"]), mmap_mode="r")
+        scales = np.load(os.path.join(path, index["scales"])) if index["scales"] else None
+        return cls(path, embedding_function, index, vectors, scales)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    # --- Chroma-compatible reads (BM25 index, router centroids, suggestion index) ---
+    def _dequantize(self, rows) -> np.ndarray:
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows, None]
+        return vectors
+
+    def get(self, ids: Optional[Sequence[str]] = None, limit: Optional[int] = None,
+            include: Iterable[str] = ("documents", "metadatas")) -> Dict[str, Any]:
+        if ids is None:
+            rows = list(range(len(self.ids)))
+        else:
+            wanted = set(ids)
+            rows = [row for row, doc_id in enumerate(self.ids) if doc_id in wanted]
+        rows = rows[:limit] if limit is not None else rows
+        include = set(include)
+        return {
+            "ids": [self.ids[row] for row in rows],
+            "documents": [self.texts[row] for row in rows] if "documents" in include else None,
+            "metadatas": [self.metadatas[row] for row in rows] if "metadatas" in include else None,
+            "embeddings": self._dequantize(rows) if "embeddings" in include else None,
+        }
+
+    # --- Search ---
+    def scores(self, embedding: Sequence[float]) -> np.ndarray:
+        """Cosine similarity of a query vector with every row."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        count = len(self.ids)
+        scores = np.empty(count, dtype=np.float32)
+        block = np.empty((min(SEARCH_BLOCK_ROWS, count), query.shape[0]), dtype=np.float32)
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            rows = self.vectors[start:start + SEARCH_BLOCK_ROWS]
+            buffer = block[:len(rows)]
+            np.copyto(buffer, rows, casting="unsafe")
+            np.dot(buffer, query, out=scores[start:start + len(rows)])
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def _top(self, embedding: Sequence[float], k: int) -> List[Tuple[int, float]]:
+        started = time.perf_counter()
+        scores = self.scores(embedding)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        rows = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        with self._lock:
+            self._stats["searches"] += 1
+            self._stats["seconds"] += time.perf_counter() - started
+        return [(int(row), float(scores[row])) for row in rows]
+
+    def _document(self, row: int) -> Document:
+        return Document(id=self.ids[row], page_content=self.texts[row], metadata=self.metadatas[row])
+
+    def similarity_search_by_vector_with_score(self, embedding: Sequence[float], k: int = 4,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        return [(self._document(row), score) for row, score in self._top(embedding, k)]
+
+    def similarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        embedding = await self.embedding_function.aembed_query(query)
+        # The exact scan reads every row: off the event loop for large stores
+        return await asyncio.get_running_loop().run_in_executor(None, self.similarity_search_by_vector, embedding, k)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score
+
+    def max_marginal_relevance_search_by_vector(self, embedding: Sequence[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        candidates = [row for row, _ in self._top(embedding, fetch_k)]
+        if not candidates:
+            return []
+        picked = maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32), self._dequantize(candidates),
+                                            lambda_mult=lambda_mult, k=k)
+        return [self._document(candidates[i]) for i in picked]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult)
+
+    async def amax_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                             lambda_mult: float = 0.5, **kwargs: Any) -> List[Document]:
+        embedding = await self.embedding_function.aembed_query(query)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.max_marginal_relevance_search_by_vector, embedding, k, fetch_k, lambda_mult)
+
+    # --- Read-only ---
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("NumpyVectorStore is read-only; rebuild it with `python ingest.py`.")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   **kwargs: Any) -> "NumpyVectorStore":
+        raise NotImplementedError("NumpyVectorStore is exported from a Chroma store by `python ingest.py`.")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            searches, seconds = self._stats["searches"], self._stats["seconds"]
+        return {
+            "dtype": self.dtype,
+            "rows": len(self.ids),
+            "dimension": int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+            "matrix_mb": round(self.vectors.nbytes / 1e6, 2),
+            "searches": searches,
+            "avg_search_ms": 1000 * seconds / searches if searches else 0.0,
+        }
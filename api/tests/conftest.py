@@ -0,0 +1,19 @@
+# tests/conftest.py
+import os
+import sys
+
+# Run from api/ (python -m pytest); the tests import the app's modules as src.*, like main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from src import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A new chat database in a temporary directory (the caller runs init_db or builds an old schema)."""
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "chat_history.sqlite3"))
+    database.close_connection()
+    yield database
+    database.close_connection()
@@ -0,0 +1,212 @@
+# tests/test_admission.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src import admission
+from src.admission import AdmissionController, Rejected, TokenBuckets, client_key
+
+
+def rejection(call) -> Rejected:
+    with pytest.raises(Rejected) as info:
+        call()
+    return info.value
+
+
+# --- Token buckets ---
+def test_bucket_allows_a_burst_then_refills_at_the_rate():
+    buckets = TokenBuckets(rate=0.5, burst=3)
+    assert [buckets.take("a", 1, now=100.0) for _ in range(3)] == [None, None, None]
+    assert buckets.take("a", 1, now=100.0) == pytest.approx(2.0)
+    # Other clients have buckets of their own
+    assert buckets.take("b", 1, now=100.0) is None
+    assert buckets.take("a", 1, now=102.0) is None
+    assert buckets.take("a", 2, now=102.0) == pytest.approx(4.0)
+    # Never more than the burst, however long the client was idle
+    assert buckets.take("a", 3, now=10000.0) is None
+    assert buckets.take("a", 1, now=10000.0) is not None
+
+
+def test_rate_zero_disables_the_bucket():
+    buckets = TokenBuckets(rate=0, burst=1)
+    assert all(buckets.take("a", 5, now=0.0) is None for _ in range(10))
+    assert len(buckets) == 0
+
+
+def test_idle_clients_are_dropped_past_the_limit(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_TRACKED_CLIENTS", 3)
+    buckets = TokenBuckets(rate=1, burst=2)
+    for client in "abc":
+        buckets.take(client, 1, now=0.0)
+    # a, b and c are full again by now, so only d is kept
+    buckets.take("d", 1, now=10.0)
+    assert len(buckets) == 1
+
+
+def test_rejected_rounds_retry_after_up_to_whole_seconds():
+    assert Rejected(429, "rate_limited", 0.2).retry_after == 1
+    assert Rejected(503, "deadline", 2.1).retry_after == 3
+
+
+def test_client_key_trusts_a_forwarding_header_only_when_configured(monkeypatch):
+    request = SimpleNamespace(headers={"x-forwarded-for": "6.6.6.6, 10.0.0.7"}, client=SimpleNamespace(host="10.0.0.1"))
+    assert client_key(request) == "10.0.0.1"
+    monkeypatch.setattr(admission, "ADMISSION_CLIENT_HEADER", "x-forwarded-for")
+    # The last address is the one the proxy appended
+    assert client_key(request) == "10.0.0.7"
+
+
+# --- The controller ---
+async def await_rejection(coroutine) -> Rejected:
+    try:
+        await coroutine
+    except Rejected as e:
+        return e
+    raise AssertionError("not rejected")
+
+
+def controller(**kwargs) -> AdmissionController:
+    options = dict(max_concurrent=2, queue_size=2, queue_timeout=0.2, rate_per_minute=0, enabled=True)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def test_client_over_its_rate_gets_429():
+    async def scenario():
+        control = controller(rate_per_minute=60, burst=2, max_concurrent=10)
+        for _ in range(2):
+            (await control.acquire("student")).release()
+        return control, await await_rejection(control.acquire("student"))
+    control, error = asyncio.run(scenario())
+    assert (error.status_code, error.reason, error.retry_after) == (429, "rate_limited", 1)
+    assert control.stats()["rate_limited"] == 1
+
+
+def test_waiters_are_served_in_arrival_order():
+    async def scenario():
+        control = controller(queue_size=5, queue_timeout=5)
+        held = [await control.acquire("a"), await control.acquire("b")]
+        order = []
+
+        async def wait(name):
+            ticket = await control.acquire(name)
+            order.append(name)
+            return ticket
+        waiters = [asyncio.ensure_future(wait(name)) for name in ("c", "d", "e")]
+        await asyncio.sleep(0.01)
+        assert control.stats()["queue_depth"] == 3
+        for ticket in held:
+            ticket.release()
+        tickets = await asyncio.gather(*waiters[:2])
+        assert order == ["c", "d"]
+        tickets[0].release()
+        (await waiters[2]).release()
+        tickets[1].release()
+        return control, order
+    control, order = asyncio.run(scenario())
+    assert order == ["c", "d", "e"]
+    stats = control.stats()
+    assert (stats["in_flight"], stats["queue_depth"], stats["admitted"], stats["queued"]) == (0, 0, 5, 3)
+
+
+def test_full_queue_is_shed_and_refunds_the_token():
+    async def scenario():
+        control = controller(queue_size=1, queue_timeout=5, rate_per_minute=60, burst=4)
+        held = [await control.acquire("a"), await control.acquire("a")]
+        queued = asyncio.ensure_future(control.acquire("a"))
+        await asyncio.sleep(0.01)
+        error = await await_rejection(control.acquire("a"))
+        # The shed request's token came back: "a" still has one left
+        held[0].release()
+        (await queued).release()
+        (await control.acquire("a")).release()
+        held[1].release()
+        return control, error
+    control, error = asyncio.run(scenario())
+    assert (error.status_code, error.reason) == (503, "queue_full")
+    assert control.stats()["shed"]["queue_full"] == 1
+
+
+def test_predicted_wait_over_the_timeout_is_shed_at_once():
+    async def scenario():
+        control = controller(queue_size=10, queue_timeout=1)
+        held = [await control.acquire("a"), await control.acquire("a")]
+        # Requests take 3 s on average: one queued slot on 2 slots waits 1.5 s
+        control._service_seconds = 3.0
+        error = await await_rejection(control.acquire("b"))
+        for ticket in held:
+            ticket.release()
+        return control, error
+    control, error = asyncio.run(scenario())
+    assert (error.status_code, error.reason, error.retry_after) == (503, "deadline", 2)
+    assert control.stats()["queued"] == 0
+
+
+def test_waiting_past_the_timeout_is_shed():
+    async def scenario():
+        control = controller(queue_timeout=0.05)
+        held = [await control.acquire("a"), await control.acquire("a")]
+        error = await await_rejection(control.acquire("b"))
+        for ticket in held:
+            ticket.release()
+        return control, error
+    control, error = asyncio.run(scenario())
+    assert (error.status_code, error.reason) == (503, "timeout")
+    stats = control.stats()
+    assert (stats["in_flight"], stats["queue_depth"]) == (0, 0)
+
+
+def test_a_client_leaving_the_queue_frees_its_place():
+    async def scenario():
+        control = controller(queue_size=1, queue_timeout=5)
+        held = [await control.acquire("a"), await control.acquire("a")]
+        leaving = asyncio.ensure_future(control.acquire("b"))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        await asyncio.sleep(0.01)
+        staying = asyncio.ensure_future(control.acquire("c"))
+        await asyncio.sleep(0.01)
+        held[0].release()
+        (await staying).release()
+        held[1].release()
+        return control
+    stats = asyncio.run(scenario()).stats()
+    assert (stats["in_flight"], stats["shed"]["queue_full"]) == (0, 0)
+
+
+def test_upstream_rate_limit_sheds_new_requests():
+    class RateLimited(Exception):
+        status_code = 429
+        response = SimpleNamespace(headers={"retry-after": "7"})
+
+    async def scenario():
+        control = controller()
+        assert control.upstream_limited(ValueError("other")) is None
+        assert control.upstream_limited(RateLimited()) == 7
+        return control, await await_rejection(control.acquire("a"))
+    control, error = asyncio.run(scenario())
+    assert (error.status_code, error.reason) == (503, "upstream")
+    assert 0 < control.stats()["upstream_backoff_seconds"] <= 7
+
+
+def test_batches_are_charged_per_question_to_their_own_bucket():
+    control = controller(rate_per_minute=60, burst=1, batch_per_hour=3600, batch_burst=10)
+    control.charge_batch("teacher", 6)
+    error = rejection(lambda: control.charge_batch("teacher", 6))
+    assert (error.status_code, error.reason, error.retry_after) == (429, "batch_rate_limited", 2)
+    # The interactive bucket is untouched
+    assert asyncio.run(control.acquire("teacher")).release() is None
+    # A batch larger than the burst takes the full bucket instead of never fitting
+    control.charge_batch("another teacher", 50)
+    assert control.stats()["batch_rate_limited"] == 1
+
+
+def test_disabled_admits_everything():
+    async def scenario():
+        control = controller(enabled=False, rate_per_minute=1, burst=1)
+        return [await control.acquire("a") for _ in range(10)] + [await control.acquire_background()]
+    tickets = asyncio.run(scenario())
+    assert len(tickets) == 11
+    for ticket in tickets:
+        ticket.release()
@@ -0,0 +1,76 @@
+# tests/test_batch.py
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+
+from src.admission import AdmissionController
+from src.chains import with_ticket
+
+
+class SlowChain:
+    """Records how many runs are in flight at once; fails on questions containing "fail"."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def run(self, x):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if "fail" in x["input"]:
+                raise ValueError(x["input"])
+            return {"answer": x["input"].upper()}
+        finally:
+            self.in_flight -= 1
+
+
+async def run_batch(admission, questions, concurrency):
+    chain = SlowChain()
+    admitted = with_ticket(RunnableLambda(chain.run), admission.acquire_background)
+    inputs = [{"input": question, "history": []} for question in questions]
+    results = {}
+    async for i, result in admitted.abatch_as_completed(
+            inputs, config={"max_concurrency": concurrency}, return_exceptions=True):
+        results[i] = result
+    return chain, results
+
+
+def test_every_run_holds_one_background_slot_and_returns_it():
+    admission = AdmissionController(max_concurrent=8, batch_share=0.5)
+    questions = [f"question {i}" for i in range(12)] + ["please fail"]
+    chain, results = asyncio.run(run_batch(admission, questions, concurrency=6))
+    assert sorted(results) == list(range(len(questions)))
+    assert results[0] == {"answer": "QUESTION 0"}
+    assert isinstance(results[12], ValueError)
+    # max_concurrency 6, but batch runs may hold at most half of the 8 slots
+    assert chain.max_in_flight == 4
+    stats = admission.stats()
+    assert stats["background_admitted"] == len(questions)
+    assert (stats["in_flight"], stats["background_in_flight"]) == (0, 0)
+
+
+def test_batch_concurrency_below_the_share_is_the_limit():
+    admission = AdmissionController(max_concurrent=16, batch_share=0.5)
+    chain, results = asyncio.run(run_batch(admission, [f"q{i}" for i in range(10)], concurrency=2))
+    assert len(results) == 10 and chain.max_in_flight == 2
+
+
+def test_batch_runs_wait_while_interactive_requests_are_queued():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=2, batch_share=1.0)
+        first = await admission.acquire("student")
+        second = await admission.acquire("student")
+        waiting = asyncio.ensure_future(admission.acquire("student"))
+        batch = asyncio.ensure_future(run_batch(admission, ["q0", "q1"], concurrency=2))
+        await asyncio.sleep(0.05)
+        # The queued interactive request gets the first free slot, not the batch
+        first.release()
+        ticket = await asyncio.wait_for(waiting, 1)
+        assert not batch.done() and admission.stats()["background_in_flight"] == 0
+        second.release()
+        ticket.release()
+        chain, results = await asyncio.wait_for(batch, 5)
+        return results
+    assert len(asyncio.run(scenario())) == 2
@@ -0,0 +1,96 @@
+# tests/test_database_migrations.py
+import sqlite3
+from datetime import datetime
+
+# The schema init_db created before the migrations existed
+BASELINE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    type TEXT NOT NULL, -- 'user' or 'ai'
+    text TEXT NOT NULL,
+    sources TEXT, -- Store sources as a JSON string
+    timestamp TEXT NOT NULL,
+    FOREIGN KEY (chat_id) REFERENCES chats (id)
+);
+"""
+
+
+def baseline_database(path: str):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    now = datetime.now().isoformat()
+    conn.execute("INSERT INTO chats (id, title, timestamp) VALUES (1, 'ggplot question', ?)", (now,))
+    conn.executemany("INSERT INTO messages (chat_id, type, text, sources, timestamp) VALUES (?, ?, ?, ?, ?)", [
+        (1, "user", "How do I change ggplot axis labels?", "[]", now),
+        (1, "ai", "Use labs(x = ..., y = ...).", '[{"source": "ggplot2"}]', now),
+        # A message of a chat deleted before deletes cascaded
+        (2, "user", "orphaned histogram question", "[]", now),
+    ])
+    conn.commit()
+    return conn
+
+
+def tables(db):
+    return {row[0] for row in db.get_db_connection().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_fresh_database_is_at_the_latest_version(db):
+    db.init_db()
+    conn = db.get_db_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+    assert {"chats", "messages", "messages_fts", "history_version", "chat_summaries",
+            "journal_sequences"} <= tables(db)
+    assert "journal_state" not in tables(db)
+
+
+def test_migrates_the_baseline_schema(db):
+    baseline_database(db.DATABASE_NAME).close()
+    db.init_db()
+    conn = db.get_db_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.MIGRATIONS)
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+    # Existing messages are kept, orphans dropped, and the text is searchable
+    messages = db.get_messages_for_chat(1)
+    assert [m["text"] for m in messages] == ["How do I change ggplot axis labels?", "Use labs(x = ..., y = ...)."]
+    assert messages[1]["sources"] == [{"source": "ggplot2"}]
+    assert conn.execute("SELECT COUNT(*) FROM messages WHERE chat_id = 2").fetchone()[0] == 0
+    results, _ = db.search_messages("axis labels", 10)
+    assert [result["chat"]["id"] for result in results] == [1]
+    assert db.search_messages("histogram", 10)[0] == []
+
+    # Deleting a chat now deletes its messages and bumps the history version
+    version, _ = db.get_history_version()
+    db.delete_chats([1])
+    assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 0
+    assert db.get_history_version()[0] > version
+    assert db.get_journal_seq("") == 0
+
+
+def test_keeps_the_sequence_number_of_the_single_journal(db):
+    conn = baseline_database(db.DATABASE_NAME)
+    # A database from before per-process journals: version 6, one journal_state row
+    for migration in db.MIGRATIONS[:6]:
+        migration(conn)
+    conn.execute("UPDATE journal_state SET last_seq = 7")
+    conn.execute("PRAGMA user_version = 6")
+    conn.commit()
+    conn.close()
+
+    db.init_db()
+    assert db.get_journal_seq("") == 7
+    assert "journal_state" not in tables(db)
+
+
+def test_init_db_is_idempotent(db):
+    db.init_db()
+    chat_id = db.create_chat("What is a tibble?")
+    db.close_connection()
+    db.init_db()
+    assert db.chat_exists(chat_id)
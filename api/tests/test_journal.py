@@ -0,0 +1,175 @@
+# tests/test_journal.py
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from src import journal as journal_module
+from src.journal import JournalFull, MessageJournal
+
+
+def message(text: str, message_type: str = "user"):
+    return {"type": message_type, "text": text, "timestamp": datetime.now().isoformat()}
+
+
+@pytest.fixture
+def chats(db):
+    db.init_db()
+    return [db.create_chat(f"chat {i}") for i in range(3)]
+
+
+def texts(db, chat_id):
+    return [m["text"] for m in db.get_messages_for_chat(chat_id)]
+
+
+def journal_files(tmp_path):
+    return sorted(name for name in os.listdir(tmp_path) if name.startswith("chat_journal"))
+
+
+def test_commits_entries_in_order_and_cleans_up(db, chats, tmp_path):
+    journal = MessageJournal(str(tmp_path / "chat_journal.jsonl"), batch_size=4, linger_seconds=0.001)
+    journal.start()
+    seqs = []
+    for i in range(20):
+        chat_id = chats[i % len(chats)]
+        seqs.append(journal.append(chat_id, [message(f"q{i}"), message(f"a{i}", "ai")]))
+    assert seqs == list(range(1, 21))
+    assert journal.wait_committed(timeout=5)
+    assert journal.stats()["committed_seq"] == 20
+    for n, chat_id in enumerate(chats):
+        expected = [text for i in range(n, 20, len(chats)) for text in (f"q{i}", f"a{i}")]
+        assert texts(db, chat_id) == expected
+    journal_id = journal.journal_id
+    journal.close()
+    # Fully committed: the file and its sequence number are gone
+    assert journal_files(tmp_path) == []
+    assert db.get_journal_seq(journal_id) == 0
+
+
+def test_wait_chat_committed_only_waits_for_that_chat(db, chats, tmp_path):
+    journal = MessageJournal(str(tmp_path / "chat_journal.jsonl"))
+    journal.start()
+    try:
+        journal.append(chats[0], [message("hello")])
+        assert journal.wait_chat_committed(chats[0], timeout=5)
+        assert texts(db, chats[0]) == ["hello"]
+        # No entries: nothing to wait for
+        assert journal.wait_chat_committed(chats[1], timeout=0)
+    finally:
+        journal.close()
+
+
+def write_crashed_journal(path, entries, torn_tail: bool = False):
+    """Writes a journal file as a crashed process left it; returns its entries."""
+    entries = [{"seq": seq, "chat_id": chat_id, "messages": [message(text)]} for seq, chat_id, text in entries]
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+        if torn_tail:
+            f.write('{"seq": 99, "chat_id": 1, "messa')
+    return entries
+
+
+def test_replays_uncommitted_entries_of_a_crashed_process(db, chats, tmp_path):
+    base = tmp_path / "chat_journal.jsonl"
+    crashed = tmp_path / "chat_journal.111-deadbeef.jsonl"
+    entries = write_crashed_journal(crashed, [(1, chats[0], "committed"), (2, chats[0], "lost 1"),
+                                              (3, chats[1], "lost 2"), (4, chats[0], "lost 3")], torn_tail=True)
+    # Entry 1 made it to the database before the crash
+    db.write_journal_entries("111-deadbeef", entries[:1])
+
+    journal = MessageJournal(str(base))
+    journal.start()
+    try:
+        assert texts(db, chats[0]) == ["committed", "lost 1", "lost 3"]
+        assert texts(db, chats[1]) == ["lost 2"]
+        assert journal.stats()["replayed"] == 3
+        assert not crashed.exists()
+        assert db.get_journal_seq("111-deadbeef") == 0
+    finally:
+        journal.close()
+
+
+def test_replays_the_single_journal_of_older_versions(db, chats, tmp_path):
+    base = tmp_path / "chat_journal.jsonl"
+    write_crashed_journal(base, [(1, chats[2], "from the old journal")])
+    journal = MessageJournal(str(base))
+    journal.start()
+    try:
+        assert texts(db, chats[2]) == ["from the old journal"]
+        assert not base.exists()
+    finally:
+        journal.close()
+
+
+def test_skips_entries_of_deleted_chats(db, chats, tmp_path):
+    crashed = tmp_path / "chat_journal.222-deadbeef.jsonl"
+    write_crashed_journal(crashed, [(1, chats[0], "kept"), (2, 987654, "chat was deleted")])
+    journal = MessageJournal(str(tmp_path / "chat_journal.jsonl"))
+    journal.start()
+    try:
+        assert texts(db, chats[0]) == ["kept"]
+        assert journal.stats()["skipped"] == 1
+    finally:
+        journal.close()
+
+
+@pytest.mark.skipif(journal_module.fcntl is None, reason="needs POSIX file locks")
+def test_leaves_the_journal_of_a_running_process_alone(db, chats, tmp_path):
+    running = MessageJournal(str(tmp_path / "chat_journal.jsonl"), linger_seconds=60)
+    running.start()
+    other = None
+    try:
+        # Queued, not committed yet: the writer lingers for more entries
+        running.append(chats[0], [message("in flight")])
+        other = MessageJournal(str(tmp_path / "chat_journal.jsonl"))
+        other.start()
+        assert os.path.exists(running.path)
+        assert other.stats()["replayed"] == 0
+    finally:
+        if other is not None:
+            other.close()
+        running.close()
+    assert texts(db, chats[0]) == ["in flight"]
+
+
+def test_full_queue_fails_fast_and_write_errors_make_it_unhealthy(db, chats, tmp_path, monkeypatch):
+    release = threading.Event()
+    original = db.write_journal_entries
+
+    def failing(journal_id, entries):
+        if not release.is_set():
+            raise RuntimeError("database is locked")
+        return original(journal_id, entries)
+
+    monkeypatch.setattr(db, "write_journal_entries", failing)
+    journal = MessageJournal(str(tmp_path / "chat_journal.jsonl"), max_queue=2, linger_seconds=0.001)
+    journal.start()
+    try:
+        async def appends():
+            first = await journal.aappend(chats[0], [message("one")])
+            second = await journal.aappend(chats[0], [message("two")])
+            with pytest.raises(JournalFull):
+                await journal.aappend(chats[0], [message("three")])
+            return first, second
+        assert asyncio.run(appends()) == (1, 2)
+        assert not journal.wait_committed(timeout=0.5)
+        stats = journal.stats()
+        assert not journal.healthy() and stats["write_errors"] >= 1
+        assert "database is locked" in stats["write_error"]
+
+        release.set()
+        assert journal.wait_committed(timeout=10)
+        # Healthy again once the writer is past the batch that failed
+        deadline = time.monotonic() + 5
+        while not journal.healthy() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert journal.healthy()
+        assert texts(db, chats[0]) == ["one", "two"]
+    finally:
+        release.set()
+        journal.close()
@@ -0,0 +1,229 @@
+# tests/test_llm_client.py
+import argparse
+import asyncio
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+import uvicorn
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from benchmarks import llm_stub
+from src import llm_client
+from src.llm_client import ResilientChatModel, ResilientEmbeddings, StagePolicy
+
+PROMPT = "Given the user question, classify it. <question>How do I use dplyr filter?</question>"
+# Failure draws of the stub fixture: a hang, an HTTP error, an answer
+HANG, FAIL, OK = 0.0, 0.5, 0.9
+
+
+class Script:
+    """Replaces the stub's seeded draws or latencies: the given values in order, then `then`."""
+
+    def __init__(self, values=(), statuses=(503,), then: float = OK):
+        self.values = list(values)
+        self.statuses = list(statuses)
+        self.then = then
+
+    def random(self):
+        return self.values.pop(0) if self.values else self.then
+
+    def choice(self, options):
+        return self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+
+    def sample(self):
+        return self.random()
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    """The OpenAI API stub, served by uvicorn in a thread of this process so tests can script it."""
+    parser = argparse.ArgumentParser()
+    llm_stub.add_arguments(parser)
+    llm_stub.configure(parser.parse_args(["--latency", "fixed:0", "--dimension", "16"]))
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(llm_stub.app, host="127.0.0.1", port=port, log_level="warning",
+                                           timeout_graceful_shutdown=1))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def stub(stub_url, monkeypatch):
+    """Scripts the stub: stub.script(draws, statuses), stub.latencies(seconds...)."""
+    # Draws below 0.25 hang, below 0.75 fail
+    monkeypatch.setitem(llm_stub.settings, "hang_rate", 0.25)
+    monkeypatch.setitem(llm_stub.settings, "fail_rate", 0.5)
+    monkeypatch.setitem(llm_stub.settings, "hang_seconds", 2)
+    monkeypatch.setitem(llm_stub.settings, "random", Script())
+    monkeypatch.setitem(llm_stub.settings, "latency", llm_stub.Latency("fixed:0"))
+    monkeypatch.setattr(llm_client, "LLM_RETRY_BASE_SECONDS", 0.01)
+
+    def script(draws, statuses=(503,)):
+        llm_stub.settings["random"] = Script(draws, statuses)
+
+    def latencies(*seconds):
+        llm_stub.settings["latency"] = Script(seconds, then=0.0)
+
+    return SimpleNamespace(url=stub_url, script=script, latencies=latencies)
+
+
+def chat_model(url, http_async_client, stage="router", timeout=2.0, **policy_options):
+    return ResilientChatModel.create(lambda _: ChatOpenAI(
+        model="gpt-4o", api_key="stub", base_url=url, timeout=timeout, max_retries=0,
+        http_async_client=http_async_client), stage=stage, **policy_options)
+
+
+def run(coroutine_function, *args):
+    """Runs a test body with an httpx client bound to its event loop."""
+    async def main():
+        async with httpx.AsyncClient() as client:
+            return await coroutine_function(client, *args)
+    return asyncio.run(main())
+
+
+def test_answers_without_retrying(stub):
+    async def body(client):
+        model = chat_model(stub.url, client, hedging=False)
+        return model, await model.ainvoke(PROMPT)
+    model, message = run(body)
+    assert message.content
+    stats = model.policy.stats()
+    assert (stats["calls"], stats["attempts"], stats["retries"], stats["failures"]) == (1, 1, 0, 0)
+
+
+@pytest.mark.parametrize("status", [500, 503, 429])
+def test_retries_retryable_errors(stub, status):
+    stub.script([FAIL, FAIL], statuses=[status])
+
+    async def body(client):
+        model = chat_model(stub.url, client, hedging=False)
+        return model, await model.ainvoke(PROMPT)
+    model, message = run(body)
+    assert message.content
+    stats = model.policy.stats()
+    assert (stats["attempts"], stats["retries"], stats["failures"]) == (3, 2, 0)
+
+
+def test_gives_up_after_max_retries(stub):
+    stub.script([FAIL] * 5)
+
+    async def body(client):
+        model = chat_model(stub.url, client, hedging=False, max_retries=2)
+        with pytest.raises(openai.InternalServerError):
+            await model.ainvoke(PROMPT)
+        return model
+    stats = run(body).policy.stats()
+    assert (stats["attempts"], stats["retries"], stats["failures"]) == (3, 2, 1)
+
+
+def test_does_not_retry_client_errors(stub):
+    stub.script([FAIL], statuses=[400])
+
+    async def body(client):
+        model = chat_model(stub.url, client, hedging=False)
+        with pytest.raises(openai.BadRequestError):
+            await model.ainvoke(PROMPT)
+        return model
+    stats = run(body).policy.stats()
+    assert (stats["attempts"], stats["retries"], stats["failures"]) == (1, 0, 1)
+
+
+def test_retries_a_hung_request_after_its_timeout(stub):
+    stub.script([HANG])
+
+    async def body(client):
+        model = chat_model(stub.url, client, hedging=False, timeout=0.3)
+        started = time.perf_counter()
+        message = await model.ainvoke(PROMPT)
+        return model, message, time.perf_counter() - started
+    model, message, seconds = run(body)
+    assert message.content and seconds < 1.5
+    stats = model.policy.stats()
+    assert (stats["timeouts"], stats["retries"]) == (1, 1)
+
+
+def test_retry_after_longer_than_the_cap_is_passed_on():
+    policy = StagePolicy("router", name="test_retry_after")
+    long_wait = SimpleNamespace(status_code=429, response=SimpleNamespace(headers={"retry-after": "600"}))
+    short_wait = SimpleNamespace(status_code=429, response=SimpleNamespace(headers={"retry-after": "1"}))
+    assert policy.backoff(0, long_wait) is None
+    assert policy.backoff(0, short_wait) >= 1
+    assert policy.backoff(policy.max_retries, short_wait) is None
+
+
+def test_hedges_a_slow_call_and_the_hedge_wins(stub, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_HEDGE_STAGES", {"router"})
+    monkeypatch.setattr(llm_client, "HEDGE_MIN_SAMPLES", 5)
+
+    async def body(client):
+        model = chat_model(stub.url, client, hedging=True)
+        for _ in range(5):
+            await model.ainvoke(PROMPT)
+        # The next attempt is stuck for 1.5 s; the hedge is answered at once
+        monkeypatch.setattr(llm_client, "LLM_HEDGE_MAX_RATE", 1.0)
+        stub.latencies(1.5, 0.0)
+        started = time.perf_counter()
+        message = await model.ainvoke(PROMPT)
+        return model, message, time.perf_counter() - started
+    model, message, seconds = run(body)
+    assert message.content and seconds < 1.0
+    stats = model.policy.stats()
+    assert (stats["calls"], stats["hedged"], stats["hedge_wins"], stats["attempts"]) == (6, 1, 1, 7)
+
+
+def test_hedging_stops_at_the_max_rate(stub, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_HEDGE_STAGES", {"router"})
+    monkeypatch.setattr(llm_client, "HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(llm_client, "LLM_HEDGE_MAX_RATE", 0.0)
+
+    async def body(client):
+        model = chat_model(stub.url, client, hedging=True)
+        await model.ainvoke(PROMPT)
+        stub.latencies(0.3)
+        await model.ainvoke(PROMPT)
+        return model
+    stats = run(body).policy.stats()
+    assert (stats["hedged"], stats["attempts"]) == (0, 2)
+
+
+def test_streams_are_retried_until_the_first_chunk(stub):
+    stub.script([FAIL])
+
+    async def body(client):
+        model = chat_model(stub.url, client, stage="answer", hedging=True)
+        chunks = [chunk.content async for chunk in model.astream(PROMPT)]
+        return model, chunks
+    model, chunks = run(body)
+    assert len(chunks) > 1 and "".join(chunks)
+    stats = model.policy.stats()
+    assert (stats["retries"], stats["hedged"]) == (1, 0)
+
+
+def test_embeddings_are_retried(stub):
+    # One failure for the batch call, then one for the query
+    stub.script([FAIL, OK, FAIL])
+
+    async def body(client):
+        embeddings = ResilientEmbeddings(OpenAIEmbeddings(
+            model="text-embedding-3-large", api_key="stub", base_url=stub.url, max_retries=0,
+            check_embedding_ctx_length=False, http_async_client=client))
+        vectors = await embeddings.aembed_documents(["dplyr filter", "ggplot2 bar chart"])
+        query = await embeddings.aembed_query("dplyr filter")
+        return embeddings, vectors, query
+    embeddings, vectors, query = run(body)
+    assert len(vectors) == 2 and len(query) == 16
+    assert embeddings.batch_policy.stats()["retries"] == 1
+    assert embeddings.policy.stats()["retries"] == 1
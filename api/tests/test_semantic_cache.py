@@ -0,0 +1,129 @@
+# tests/test_semantic_cache.py
+import asyncio
+import sqlite3
+import numpy as np
+import pytest
+
+from src import semantic_cache
+from src.semantic_cache import SemanticCache
+
+DIMENSION = 8
+
+
+def unit(i: int, j: int = None) -> list:
+    vector = np.zeros(DIMENSION, dtype=np.float32)
+    vector[i] = 1
+    if j is not None:
+        vector[j] = 1
+    return vector.tolist()
+
+
+class FakeEmbeddings:
+    """Question -> vector from a fixed table."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+    async def aembed_query(self, text):
+        return self.vectors[text]
+
+
+VECTORS = {f"q{i}": unit(i) for i in range(DIMENSION)}
+VECTORS["q0 again"] = unit(0)
+VECTORS["between q0 and q1"] = unit(0, 1)
+
+
+@pytest.fixture
+def kb_version(monkeypatch):
+    version = {"value": "v1"}
+    monkeypatch.setattr(semantic_cache, "knowledge_base_fingerprint", lambda is_mock=False: version["value"])
+    return version
+
+
+def make_cache(tmp_path, **kwargs) -> SemanticCache:
+    return SemanticCache(FakeEmbeddings(VECTORS), path=str(tmp_path / "cache.sqlite3"), threshold=0.95, **kwargs)
+
+
+def cache_answer(cache: SemanticCache, question: str):
+    entry, vector = cache.lookup(question)
+    assert entry is None
+    cache.store(question, vector, f"answer to {question}", [{"source": question}], ["next?"], 2.0)
+
+
+def test_hit_above_threshold_and_miss_below(tmp_path, kb_version):
+    cache = make_cache(tmp_path)
+    cache_answer(cache, "q0")
+    entry, vector = cache.lookup("q0 again")
+    assert entry["answer"] == "answer to q0"
+    assert entry["similarity"] == pytest.approx(1.0)
+    assert np.linalg.norm(vector) == pytest.approx(1.0)
+    # cos = 0.707 < 0.95
+    entry, _ = cache.lookup("between q0 and q1")
+    assert entry is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_entries_survive_a_restart(tmp_path, kb_version):
+    cache_answer(make_cache(tmp_path), "q3")
+    entry, _ = make_cache(tmp_path).lookup("q3")
+    assert entry["answer"] == "answer to q3"
+    assert entry["sources"] == [{"source": "q3"}]
+
+
+def test_matrix_grows_geometrically_without_losing_rows(tmp_path, kb_version, monkeypatch):
+    monkeypatch.setattr(semantic_cache, "INITIAL_CAPACITY", 2)
+    cache = make_cache(tmp_path)
+    capacities = []
+    for i in range(5):
+        cache_answer(cache, f"q{i}")
+        capacities.append(cache.stats()["capacity"])
+    assert capacities == [2, 2, 4, 4, 8]
+    for i in range(5):
+        entry, _ = cache.lookup(f"q{i}")
+        assert entry["answer"] == f"answer to q{i}"
+
+
+def test_evicts_least_recently_used_and_reuses_its_row(tmp_path, kb_version):
+    cache = make_cache(tmp_path, max_entries=3)
+    for i in range(3):
+        cache_answer(cache, f"q{i}")
+    # q0 is used again, so q1 is the least recently used
+    assert cache.lookup("q0")[0] is not None
+    cache_answer(cache, "q3")
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["capacity"] == 3
+    assert cache.lookup("q1")[0] is None
+    for question in ("q0", "q2", "q3"):
+        assert cache.lookup(question)[0]["answer"] == f"answer to {question}"
+    with sqlite3.connect(cache.path) as conn:
+        assert sorted(row[0] for row in conn.execute("SELECT question FROM semantic_cache")) == ["q0", "q2", "q3"]
+
+
+def test_expired_entry_is_deleted(tmp_path, kb_version):
+    cache = make_cache(tmp_path, ttl_seconds=3600)
+    cache_answer(cache, "q0")
+    cache.ttl_seconds = -1
+    entry, _ = asyncio.run(cache.alookup("q0"))
+    assert entry is None
+    assert cache.stats()["entries"] == 0
+    with sqlite3.connect(cache.path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM semantic_cache").fetchone()[0] == 0
+
+
+def test_knowledge_base_change_invalidates_everything(tmp_path, kb_version, monkeypatch):
+    monkeypatch.setattr(semantic_cache, "KB_CHECK_INTERVAL_SECONDS", 0)
+    cache = make_cache(tmp_path)
+    cache_answer(cache, "q0")
+    cache_answer(cache, "q1")
+    kb_version["value"] = "v2"
+    entry, _ = asyncio.run(cache.alookup("q0"))
+    assert entry is None
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stats()["entries"] == 0
+    # New entries carry the new version and survive a restart
+    cache_answer(cache, "q2")
+    assert make_cache(tmp_path).lookup("q2")[0] is not None
@@ -0,0 +1,126 @@
+# tests/test_vector_index.py
+import asyncio
+import numpy as np
+import pytest
+
+from src.vector_index import NumpyVectorStore, export_numpy_index, quantize, read_index_header
+
+ROWS, DIMENSION, K = 500, 64, 10
+
+
+def corpus(seed: int = 7):
+    rng = np.random.default_rng(seed)
+    # Clustered, like embeddings of related chunks, so neighbours are close calls
+    centers = rng.normal(size=(10, DIMENSION))
+    return (centers[rng.integers(0, 10, ROWS)] + 0.5 * rng.normal(size=(ROWS, DIMENSION))).astype(np.float32)
+
+
+class FakeChroma:
+    """The part of a Chroma store export_numpy_index reads."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def get(self, include):
+        return {"ids": [f"doc-{i}" for i in range(len(self.vectors))], "embeddings": self.vectors,
+                "documents": [f"text {i}" for i in range(len(self.vectors))],
+                "metadatas": [{"row": i} for i in range(len(self.vectors))]}
+
+
+class QueryEmbeddings:
+    def __init__(self, queries):
+        self.queries = queries
+
+    def embed_query(self, text):
+        return self.queries[text].tolist()
+
+    async def aembed_query(self, text):
+        return self.queries[text].tolist()
+
+
+def exact_top(vectors, query, k=K):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return list(np.argsort(-scores, kind="stable")[:k]), scores
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    return corpus()
+
+
+@pytest.fixture(scope="module")
+def queries():
+    rng = np.random.default_rng(11)
+    return {f"query {i}": rng.normal(size=DIMENSION).astype(np.float32) for i in range(20)}
+
+
+@pytest.fixture(scope="module", params=["int8", "float16"])
+def store(request, tmp_path_factory, vectors, queries):
+    path = str(tmp_path_factory.mktemp(f"index_{request.param}"))
+    export_numpy_index(FakeChroma(vectors), path, source="abc123", embedding="fake-64", dtype=request.param)
+    return NumpyVectorStore.load(path, QueryEmbeddings(queries))
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_quantize_keeps_unit_vectors_close(vectors, dtype):
+    matrix, scales = quantize(vectors, dtype)
+    assert matrix.dtype == np.dtype(dtype)
+    restored = matrix.astype(np.float32) * (scales[:, None] if scales is not None else 1)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    if dtype == "int8":
+        # Rounding error is at most half a step of each row's scale
+        assert np.all(np.abs(restored - normalized) <= scales[:, None] / 2 + 1e-6)
+        assert np.all(np.abs(matrix).max(axis=1) == 127)
+    else:
+        assert np.allclose(restored, normalized, atol=1e-3)
+
+
+def test_quantize_zero_rows_and_unknown_dtype():
+    matrix, scales = quantize(np.zeros((2, 4)), "int8")
+    assert not matrix.any() and np.all(scales == 1)
+    with pytest.raises(ValueError):
+        quantize(np.ones((1, 4)), "int4")
+
+
+def test_top_k_matches_exact_float32_search(store, vectors, queries):
+    recalls = []
+    for question, query in queries.items():
+        expected, exact_scores = exact_top(vectors, query)
+        results = store.similarity_search_by_vector_with_score(query.tolist(), k=K)
+        rows = [document.metadata["row"] for document, _ in results]
+        recalls.append(len(set(rows) & set(expected)) / K)
+        assert rows[0] == expected[0]
+        scores = [score for _, score in results]
+        assert scores == sorted(scores, reverse=True)
+        assert np.allclose(scores, exact_scores[rows], atol=0.01)
+    assert np.mean(recalls) >= 0.95
+
+
+def test_a_stored_vector_finds_itself(store, vectors):
+    for row in (0, 63, 64, 65, ROWS - 1):  # both sides of a search block boundary
+        document, score = store.similarity_search_by_vector_with_score(vectors[row].tolist(), k=1)[0]
+        assert document.id == f"doc-{row}" and document.page_content == f"text {row}"
+        assert score == pytest.approx(1.0, abs=0.01)
+
+
+def test_async_searches_match_sync(store):
+    async def search():
+        return (await store.asimilarity_search("query 3", k=5),
+                await store.amax_marginal_relevance_search("query 3", k=5, fetch_k=20))
+    similar, diverse = asyncio.run(search())
+    assert similar == store.similarity_search("query 3", k=5)
+    assert diverse == store.max_marginal_relevance_search("query 3", k=5, fetch_k=20)
+    assert len({document.id for document in diverse}) == 5
+    assert diverse[0] == similar[0]
+
+
+def test_get_and_header(store, vectors):
+    data = store.get(ids=["doc-5", "doc-7"], include=["embeddings", "documents"])
+    assert data["ids"] == ["doc-5", "doc-7"] and data["metadatas"] is None
+    normalized = vectors[[5, 7]] / np.linalg.norm(vectors[[5, 7]], axis=1, keepdims=True)
+    assert np.allclose(data["embeddings"], normalized, atol=0.01)
+    header = read_index_header(store.path)
+    assert (header["count"], header["dimension"], header["dtype"]) == (ROWS, DIMENSION, store.dtype)
+    with pytest.raises(NotImplementedError):
+        store.add_texts(["new"])